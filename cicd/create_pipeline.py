@@ -1,13 +1,65 @@
-import boto3
+import argparse
+import io
+import os
 import sys
-from botocore.config import Config
 import json
+import zipfile
+from botocore.exceptions import ClientError
 
-def create_deployment_group(environment,company,service,awsRegion):
-    clientConfig = Config(region_name = awsRegion)
-    cdClient = boto3.client('codedeploy',config=clientConfig)
-    elbClient = boto3.client('elbv2',config=clientConfig)
-    iamClient = boto3.client('iam',config=clientConfig)
+# Shared helpers live in scripts/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+from aws_clients import get_client
+from latency_gate import DEFAULT_BUDGETS, DEFAULT_REQUESTS
+
+# Short names of the ECS deployment configurations (any full name is also accepted)
+DEPLOYMENT_CONFIGS = {
+    'all-at-once': 'CodeDeployDefault.ECSAllAtOnce',
+    'canary': 'CodeDeployDefault.ECSCanary10Percent5Minutes',
+    'canary-15': 'CodeDeployDefault.ECSCanary10Percent15Minutes',
+    'linear': 'CodeDeployDefault.ECSLinear10PercentEvery1Minutes',
+    'linear-3': 'CodeDeployDefault.ECSLinear10PercentEvery3Minutes',
+}
+LATENCY_GATE_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'latency_gate.py')
+LATENCY_GATE_TIMEOUT = 600 # seconds
+
+def create_latency_gate(environment,company,service,awsRegion,budgets=DEFAULT_BUDGETS,requests=DEFAULT_REQUESTS):
+    # Lambda run by the AfterAllowTestTraffic hook of appspec.yaml; created
+    #  or updated in place, so re-running the script picks up new budgets
+    lambdaClient = get_client('lambda',awsRegion)
+    elbClient = get_client('elbv2',awsRegion)
+    iamClient = get_client('iam',awsRegion)
+
+    functionName = environment+'-'+company+'-'+service+'-latency-gate'
+    lbDnsName = elbClient.describe_load_balancers(Names=[environment+'-'+company+'-'+service+'-lb'])['LoadBalancers'][0]['DNSName']
+    roleArn = iamClient.get_role(RoleName=environment+'-'+company+'-'+service+'-latencygate-role')['Role']['Arn']
+    environmentVariables = {'Variables': {
+        'BLUE_URL': 'http://'+lbDnsName+':80',
+        'GREEN_URL': 'http://'+lbDnsName+':8080',
+        'GATE_BUDGETS': json.dumps(budgets),
+        'GATE_REQUESTS': str(requests),
+    }}
+    zipBuffer = io.BytesIO()
+    with zipfile.ZipFile(zipBuffer, 'w', zipfile.ZIP_DEFLATED) as zipFile:
+        zipFile.write(LATENCY_GATE_SOURCE, 'latency_gate.py')
+
+    try:
+        lambdaClient.get_function(FunctionName=functionName)
+        lambdaClient.update_function_code(FunctionName=functionName, ZipFile=zipBuffer.getvalue())
+        lambdaClient.get_waiter('function_updated').wait(FunctionName=functionName)
+        lambdaClient.update_function_configuration(FunctionName=functionName, Role=roleArn, Environment=environmentVariables,
+                                                   Timeout=LATENCY_GATE_TIMEOUT)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ResourceNotFoundException':
+            raise
+        lambdaClient.create_function(FunctionName=functionName, Runtime='python3.12', Role=roleArn, Handler='latency_gate.lambda_handler',
+                                     Code={'ZipFile': zipBuffer.getvalue()}, Timeout=LATENCY_GATE_TIMEOUT, Environment=environmentVariables)
+    print('Latency gate ' + functionName + ' compares green (port 8080) with blue (port 80): ' + json.dumps(budgets))
+    return functionName
+
+def create_deployment_group(environment,company,service,awsRegion,deploymentConfig='all-at-once'):
+    cdClient = get_client('codedeploy',awsRegion)
+    elbClient = get_client('elbv2',awsRegion)
+    iamClient = get_client('iam',awsRegion)
 
     lbArn = elbClient.describe_load_balancers(Names=[environment+'-'+company+'-'+service+'-lb'])['LoadBalancers'][0]['LoadBalancerArn']
     listenersList = elbClient.describe_listeners(LoadBalancerArn=lbArn)['Listeners']
@@ -19,8 +71,10 @@ def create_deployment_group(environment,company,service,awsRegion):
     cdClient.create_deployment_group(
         applicationName = environment+'-'+company+'-'+service+'-codedeploy',
         deploymentGroupName = environment+'-'+company+'-'+service+'-dg',
-        deploymentConfigName='CodeDeployDefault.ECSAllAtOnce',
+        deploymentConfigName=DEPLOYMENT_CONFIGS.get(deploymentConfig, deploymentConfig),
         serviceRoleArn=codeDeployRoleArn,
+        # A failed latency gate hook fails the deployment, which sends traffic back to blue
+        autoRollbackConfiguration={'enabled': True, 'events': ['DEPLOYMENT_FAILURE', 'DEPLOYMENT_STOP_ON_REQUEST']},
         deploymentStyle={'deploymentType': 'BLUE_GREEN','deploymentOption': 'WITH_TRAFFIC_CONTROL'},
         blueGreenDeploymentConfiguration={
             'terminateBlueInstancesOnDeploymentSuccess': {'action': 'TERMINATE','terminationWaitTimeInMinutes': 5},
@@ -40,9 +94,8 @@ def create_deployment_group(environment,company,service,awsRegion):
     )
 
 def create_pipeline(environment,company,service,awsRegion):
-    clientConfig = Config(region_name = awsRegion)
-    cpClient = boto3.client('codepipeline',config=clientConfig)
-    iamClient = boto3.client('iam',config=clientConfig)
+    cpClient = get_client('codepipeline',awsRegion)
+    iamClient = get_client('iam',awsRegion)
 
     with open('templates/pipeline-template.json', "r") as pipelineTemplateFile:
         pipeline = json.load(pipelineTemplateFile)['pipeline']
@@ -55,7 +108,8 @@ def create_pipeline(environment,company,service,awsRegion):
         pipeline['stages'][1]['actions'][0]['configuration']['EnvironmentVariables']= \
             '[{"name":"ENVIRONMENT","value":"'+environment+'","type":"PLAINTEXT"},\
               {"name":"COMPANY","value":"'+company+'","type":"PLAINTEXT"},\
-              {"name":"AWS_REGION","value":"'+awsRegion+'","type":"PLAINTEXT"}]'
+              {"name":"AWS_REGION","value":"'+awsRegion+'","type":"PLAINTEXT"},\
+              {"name":"PIPELINE_EXECUTION_ID","value":"#{codepipeline.PipelineExecutionId}","type":"PLAINTEXT"}]'
         pipeline['stages'][1]['actions'][0]['configuration']['ProjectName']=environment + '-'+company+'-'+service+'-codebuild'
         pipeline['stages'][1]['actions'][0]['region']=awsRegion
         pipeline['stages'][2]['actions'][0]['configuration']['ApplicationName']=environment + '-'+company+'-'+service+'-codedeploy'
@@ -63,9 +117,26 @@ def create_pipeline(environment,company,service,awsRegion):
         pipeline['stages'][2]['actions'][0]['region']=awsRegion
         cpClient.create_pipeline(pipeline=pipeline)
 
-def main(environment,company,service,awsRegion):
-    create_deployment_group(environment,company,service,awsRegion)
-    create_pipeline(environment,company,service,awsRegion)
+def main(*args):
+    parser = argparse.ArgumentParser(description='Create the CodeDeploy deployment group, latency gate and CodePipeline pipeline.')
+    parser.add_argument('environment')
+    parser.add_argument('company')
+    parser.add_argument('service')
+    parser.add_argument('awsRegion')
+    parser.add_argument('--deployment-config', default='all-at-once',
+                        help='traffic shifting: '+', '.join(sorted(DEPLOYMENT_CONFIGS))+' or a deployment configuration name')
+    parser.add_argument('--gate-requests', type=int, default=DEFAULT_REQUESTS, help='latency gate requests per endpoint and target')
+    parser.add_argument('--p95-ratio', type=float, default=DEFAULT_BUDGETS['p95Ratio'], help='maximum green/blue p95 latency ratio')
+    parser.add_argument('--p99-ratio', type=float, default=DEFAULT_BUDGETS['p99Ratio'], help='maximum green/blue p99 latency ratio')
+    parser.add_argument('--slack-ms', type=float, default=DEFAULT_BUDGETS['slackMs'], help='latency allowed on top of the ratios')
+    parser.add_argument('--error-rate-increase', type=float, default=DEFAULT_BUDGETS['errorRateIncrease'],
+                        help='maximum green error rate above the blue one')
+    arguments = parser.parse_args(args)
+    budgets = {'p95Ratio': arguments.p95_ratio, 'p99Ratio': arguments.p99_ratio, 'slackMs': arguments.slack_ms,
+               'errorRateIncrease': arguments.error_rate_increase}
+    create_latency_gate(arguments.environment,arguments.company,arguments.service,arguments.awsRegion,budgets,arguments.gate_requests)
+    create_deployment_group(arguments.environment,arguments.company,arguments.service,arguments.awsRegion,arguments.deployment_config)
+    create_pipeline(arguments.environment,arguments.company,arguments.service,arguments.awsRegion)
 
 if __name__ == '__main__':
     main(*sys.argv[1:])
@@ -0,0 +1,118 @@
+# LATENCY_GATE
+# Deployment validation hook: load-probes the green task set through the test
+#  listener (port 8080) and the blue one through the production listener
+#  (port 80) at the same time, and fails the deployment (so CodeDeploy rolls
+#  it back) when green exceeds the p95/p99 latency or error rate budgets.
+#  Runs as the AfterAllowTestTraffic Lambda hook, or locally against any two
+#  URLs. Only uses the standard library (and boto3 in Lambda).
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ENDPOINTS = ['/', '/history', '/search']
+DEFAULT_REQUESTS = 60 # per endpoint and target
+DEFAULT_CONCURRENCY = 4 # per target
+WARMUP_REQUESTS = 3 # per endpoint and target, not measured
+REQUEST_TIMEOUT = 10 # seconds
+# Green may be slower than blue by the ratio plus the slack (so that a few
+#  milliseconds of noise on fast endpoints do not fail a deploy)
+DEFAULT_BUDGETS = {'p95Ratio': 1.2, 'p99Ratio': 1.3, 'slackMs': 25, 'errorRateIncrease': 0.01}
+
+def timed_request(url):
+	# Returns (seconds, is error); 4xx answers are the app working as designed
+	start = time.time()
+	try:
+		with urllib.request.urlopen(url, timeout=REQUEST_TIMEOUT) as response:
+			response.read()
+		failed = False
+	except urllib.error.HTTPError as e:
+		failed = e.code >= 500
+	except Exception:
+		failed = True
+	return time.time() - start, failed
+
+def probe(baseUrl, endpoints=ENDPOINTS, requests=DEFAULT_REQUESTS, concurrency=DEFAULT_CONCURRENCY):
+	baseUrl = baseUrl.rstrip('/')
+	urls = [baseUrl+endpoint for endpoint in endpoints]
+	with ThreadPoolExecutor(max_workers=concurrency) as executor:
+		list(executor.map(timed_request, urls * WARMUP_REQUESTS))
+		# Endpoints are interleaved, so both targets see the same request mix over time
+		results = list(executor.map(timed_request, urls * requests))
+	return [seconds for seconds, _ in results], sum(failed for _, failed in results)
+
+def percentile(values, percent):
+	values = sorted(values)
+	return values[min(len(values) - 1, int(math.ceil(percent / 100.0 * len(values))) - 1)] if values else 0.0
+
+def summary(latencies, errors):
+	return {'p50Ms': 1000*percentile(latencies, 50), 'p95Ms': 1000*percentile(latencies, 95), 'p99Ms': 1000*percentile(latencies, 99),
+	        'errorRate': errors / float(len(latencies)) if latencies else 1.0, 'requests': len(latencies)}
+
+def budget_violations(blue, green, budgets=DEFAULT_BUDGETS):
+	# blue, green: as returned by summary
+	violations = []
+	for quantile, ratio in [('p95Ms', budgets['p95Ratio']), ('p99Ms', budgets['p99Ratio'])]:
+		limit = blue[quantile] * ratio + budgets['slackMs']
+		if green[quantile] > limit:
+			violations.append('%s %.0fms over budget %.0fms (blue %.0fms)' % (quantile[:3], green[quantile], limit, blue[quantile]))
+	if green['errorRate'] > blue['errorRate'] + budgets['errorRateIncrease']:
+		violations.append('error rate %.1f%% over budget %.1f%% (blue %.1f%%)' % (100*green['errorRate'],
+		                  100*(blue['errorRate'] + budgets['errorRateIncrease']), 100*blue['errorRate']))
+	return violations
+
+def run_gate(blueUrl, greenUrl, budgets=DEFAULT_BUDGETS, endpoints=ENDPOINTS, requests=DEFAULT_REQUESTS, concurrency=DEFAULT_CONCURRENCY):
+	# Returns the budget violations (none means green can take production traffic)
+	with ThreadPoolExecutor(max_workers=2) as executor:
+		blueProbe = executor.submit(probe, blueUrl, endpoints, requests, concurrency)
+		greenProbe = executor.submit(probe, greenUrl, endpoints, requests, concurrency)
+		blue = summary(*blueProbe.result())
+		green = summary(*greenProbe.result())
+	for name, stats in [('blue', blue), ('green', green)]:
+		print('%-6s p50 %6.0fms  p95 %6.0fms  p99 %6.0fms  errors %5.1f%%  (%d requests)' % (name, stats['p50Ms'], stats['p95Ms'],
+		      stats['p99Ms'], 100*stats['errorRate'], stats['requests']))
+	violations = budget_violations(blue, green, budgets)
+	for violation in violations:
+		print('BUDGET EXCEEDED: green ' + violation)
+	return violations
+
+def lambda_handler(event, context):
+	# CodeDeploy lifecycle hook: the deployment continues only if the hook reports Succeeded
+	import boto3
+	budgets = dict(DEFAULT_BUDGETS, **json.loads(os.environ.get('GATE_BUDGETS', '{}')))
+	try:
+		violations = run_gate(os.environ['BLUE_URL'], os.environ['GREEN_URL'], budgets,
+		                      requests=int(os.environ.get('GATE_REQUESTS', DEFAULT_REQUESTS)))
+	except Exception as e:
+		print('ERROR: latency gate could not run: ' + str(e))
+		violations = [str(e)]
+	status = 'Failed' if violations else 'Succeeded'
+	boto3.client('codedeploy').put_lifecycle_event_hook_execution_status(deploymentId=event['DeploymentId'],
+		lifecycleEventHookExecutionId=event['LifecycleEventHookExecutionId'], status=status)
+	return {'status': status, 'violations': violations}
+
+def main(*args):
+	parser = argparse.ArgumentParser(description='Compare green against blue latency and error rate budgets.')
+	parser.add_argument('blueUrl', help='e.g. http://<LB DNS>:80')
+	parser.add_argument('greenUrl', help='e.g. http://<LB DNS>:8080')
+	parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS, help='requests per endpoint and target')
+	parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+	parser.add_argument('--p95-ratio', type=float, default=DEFAULT_BUDGETS['p95Ratio'])
+	parser.add_argument('--p99-ratio', type=float, default=DEFAULT_BUDGETS['p99Ratio'])
+	parser.add_argument('--slack-ms', type=float, default=DEFAULT_BUDGETS['slackMs'])
+	parser.add_argument('--error-rate-increase', type=float, default=DEFAULT_BUDGETS['errorRateIncrease'])
+	arguments = parser.parse_args(args)
+	budgets = {'p95Ratio': arguments.p95_ratio, 'p99Ratio': arguments.p99_ratio, 'slackMs': arguments.slack_ms,
+	           'errorRateIncrease': arguments.error_rate_increase}
+	if run_gate(arguments.blueUrl, arguments.greenUrl, budgets, requests=arguments.requests, concurrency=arguments.concurrency):
+		sys.exit(1)
+	print('SUCCESS: green is within the performance budgets')
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
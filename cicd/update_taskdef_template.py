@@ -1,24 +1,163 @@
+import argparse
+import os
 import sys
-import boto3
 import json
-from botocore.config import Config
+from botocore.exceptions import ClientError
 
-def update_taskdef_template(environment, company, awsRegion):
-	clientConfig = Config(region_name = awsRegion)
-	stsClient = boto3.client('sts', config=clientConfig)
-	s3Client = boto3.client('s3', config=clientConfig)
+# Shared helpers live in scripts/ (in CodeBuild they are zipped next to this file)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+from aws_clients import get_client
+from sync_deploy_configs import cached_get_object
+
+DIFF_FILENAME = 'taskdef-diff.json'
+RECOMMENDATION_KEY = 'capacity-recommendation.json' # written by scripts/capacity_planner.py
+# Smallest gifmachine container a recommended task size may leave
+MIN_CONTAINER_CPU = 128
+MIN_CONTAINER_MEMORY = 256 # MiB
+# Fields ECS adds to a task definition when registering it
+REGISTRATION_FIELDS = ['taskDefinitionArn', 'revision', 'status', 'requiresAttributes', 'compatibilities', 'registeredAt', 'registeredBy']
+# Values ECS fills in for fields left out, dropped from both definitions before comparing them
+TASK_DEFAULTS = {'volumes': [], 'placementConstraints': []}
+CONTAINER_DEFAULTS = {'cpu': 0, 'essential': True, 'environment': [], 'mountPoints': [], 'volumesFrom': [], 'systemControls': []}
+
+def image_reference(ecrClient, repositoryName, repositoryUri, tag):
+	# Pinning the image by digest makes the rendered task definition change
+	#  only when the image content changes, not on every build
+	try:
+		imageDetails = ecrClient.describe_images(repositoryName=repositoryName, imageIds=[{'imageTag': tag}])['imageDetails']
+		return repositoryUri+'@'+imageDetails[0]['imageDigest']
+	except (ClientError, IndexError):
+		return repositoryUri+':'+tag
+
+def sorted_items(items):
+	# Lists of named objects (containers, environment variables) are compared
+	#  by name, other lists regardless of their order
+	if all(isinstance(item, dict) and 'name' in item for item in items):
+		return [('['+str(item['name'])+']', item) for item in sorted(items, key=lambda item: str(item['name']))]
+	return [('['+str(i)+']', item) for i, item in enumerate(sorted(items, key=lambda item: json.dumps(item, sort_keys=True)))]
+
+def without_defaults(definition, defaults):
+	return dict((key, value) for key, value in definition.items() if key not in defaults or value != defaults[key])
+
+def comparable_task_definition(taskDef):
+	# Without the registration fields and the values ECS fills in, so that a
+	#  registered definition compares equal to the one it was rendered from
+	taskDef = without_defaults(dict((key, value) for key, value in taskDef.items() if key not in REGISTRATION_FIELDS), TASK_DEFAULTS)
+	containers = []
+	for container in taskDef.get('containerDefinitions', []):
+		container = without_defaults(container, CONTAINER_DEFAULTS)
+		if 'portMappings' in container:
+			# In awsvpc mode the host port is the container port
+			container['portMappings'] = [without_defaults(mapping, {'protocol': 'tcp', 'hostPort': mapping.get('containerPort')})
+			                             for mapping in container['portMappings']]
+		containers.append(container)
+	if 'containerDefinitions' in taskDef:
+		taskDef['containerDefinitions'] = containers
+	return taskDef
+
+def diff_task_definitions(rendered, live, path='taskDefinition'):
+	# Fields of either definition are compared, so removed fields count too
+	if isinstance(rendered, dict):
+		if not isinstance(live, dict):
+			return [path] if rendered or live else []
+		changedFields = []
+		for key in list(rendered) + [key for key in live if key not in rendered]:
+			changedFields = changedFields + diff_task_definitions(rendered.get(key), live.get(key), path+'.'+key)
+		return changedFields
+	if isinstance(rendered, list):
+		if not isinstance(live, list):
+			return [path] if rendered or live else []
+		renderedItems = sorted_items(rendered)
+		liveItems = sorted_items(live)
+		if [label for label, _ in renderedItems] != [label for label, _ in liveItems] or len(rendered) != len(live):
+			return [path]
+		changedFields = []
+		for (label, renderedItem), (_, liveItem) in zip(renderedItems, liveItems):
+			changedFields = changedFields + diff_task_definitions(renderedItem, liveItem, path+label)
+		return changedFields
+	if rendered == live or (live is not None and str(rendered) == str(live)):
+		return []
+	return [path]
+
+def active_task_definition(ecsClient, family):
+	try:
+		return ecsClient.describe_task_definition(taskDefinition=family)['taskDefinition']
+	except ClientError:
+		return None
+
+def load_capacity_recommendation(s3Client, bucketName, recommendationFilename=None):
+	# A local file if given, otherwise the one published to the deploy configs
+	#  bucket (if any), so sizing stays opt-in
+	if recommendationFilename:
+		with open(recommendationFilename, 'r') as recommendationFile:
+			return json.load(recommendationFile)
+	try:
+		return json.loads(cached_get_object(s3Client, bucketName, RECOMMENDATION_KEY))
+	except ClientError as e:
+		if e.response['Error']['Code'] not in ['NoSuchKey', '404']:
+			raise
+		return None
+
+def apply_capacity_recommendation(taskDef, recommendation):
+	# The gifmachine container gets the task size change, so the sidecar
+	#  keeps its reservation. Returns False (leaving taskDef untouched) when
+	#  the recommended size leaves too little for the gifmachine container
+	cpuChange = int(recommendation['cpu']) - int(taskDef['cpu'])
+	memoryChange = int(recommendation['memory']) - int(taskDef['memory'])
+	gifmachine = [container for container in taskDef['containerDefinitions'] if container['name'] == 'gifmachine'][0]
+	containerCpu = gifmachine['cpu'] + cpuChange
+	containerMemory = gifmachine['memory'] + memoryChange
+	if containerCpu < MIN_CONTAINER_CPU or containerMemory < MIN_CONTAINER_MEMORY:
+		print('Capacity recommendation ignored: ' + str(recommendation['cpu']) + ' CPU / ' + str(recommendation['memory']) +
+		      ' MiB per task leaves ' + str(containerCpu) + ' CPU / ' + str(containerMemory) + ' MiB to the gifmachine container (minimum ' +
+		      str(MIN_CONTAINER_CPU) + ' CPU / ' + str(MIN_CONTAINER_MEMORY) + ' MiB)')
+		return False
+	gifmachine['cpu'] = containerCpu
+	gifmachine['memory'] = containerMemory
+	taskDef['cpu'] = str(recommendation['cpu'])
+	taskDef['memory'] = str(recommendation['memory'])
+	print('Applied capacity recommendation: ' + taskDef['cpu'] + ' CPU / ' + taskDef['memory'] + ' MiB per task')
+	return True
+
+def apply_desired_count(cfClient, environment, company, desiredCount):
+	# Through the gifmachine stack DesiredCount parameter, so that stack
+	#  updates keep the count instead of reverting it
+	stackName = environment+'-'+company+'-gifmachine-cf'
+	try:
+		parameters = cfClient.describe_stacks(StackName=stackName)['Stacks'][0].get('Parameters', [])
+	except ClientError:
+		print('Stack ' + stackName + ' not found, desired count not applied')
+		return
+	currentValues = dict((parameter['ParameterKey'], parameter['ParameterValue']) for parameter in parameters)
+	if 'DesiredCount' not in currentValues:
+		print('Stack ' + stackName + ' has no DesiredCount parameter yet (run "sh give_me_gifs.sh --update"), desired count not applied')
+		return
+	if int(currentValues['DesiredCount']) == desiredCount:
+		return
+	cfClient.update_stack(StackName=stackName, UsePreviousTemplate=True, Capabilities=['CAPABILITY_NAMED_IAM'],
+		Parameters=[{'ParameterKey': key, 'UsePreviousValue': True} for key in currentValues if key != 'DesiredCount'] +
+		           [{'ParameterKey': 'DesiredCount', 'ParameterValue': str(desiredCount)}])
+	# Waited for, so the service is resized before the deploy stage starts
+	cfClient.get_waiter('stack_update_complete').wait(StackName=stackName, WaiterConfig={'Delay': 15, 'MaxAttempts': 80})
+	print('Desired count changed from ' + currentValues['DesiredCount'] + ' to ' + str(desiredCount) + ' tasks')
+
+def update_taskdef_template(environment, company, awsRegion, applyCapacity=False, recommendationFilename=None):
+	stsClient = get_client('sts', awsRegion)
+	s3Client = get_client('s3', awsRegion)
+	ecrClient = get_client('ecr', awsRegion)
+	ecsClient = get_client('ecs', awsRegion)
 
 	bucketName = environment+'-'+company+'-gifmachine-deploy-configs'
 	accountId = stsClient.get_caller_identity()['Account']
 	roleArn='arn:aws:iam::'+accountId+':role/'+environment+'-'+company+'-gifmachine-ecs-taskexecution-role'
-	containerImage = accountId+'.dkr.ecr.'+awsRegion+'.amazonaws.com/'+environment+'-'+company+'-gifmachine:gifmachine'
-	csidecarImage = accountId+'.dkr.ecr.'+awsRegion+'.amazonaws.com/'+environment+'-'+company+'-gifmachine:csidecar'
+	repositoryUri = accountId+'.dkr.ecr.'+awsRegion+'.amazonaws.com/'+environment+'-'+company+'-gifmachine'
+	containerImage = image_reference(ecrClient, environment+'-'+company+'-gifmachine', repositoryUri, 'gifmachine')
+	csidecarImage = image_reference(ecrClient, environment+'-'+company+'-gifmachine', repositoryUri, 'csidecar')
 	envVarsFilename = "gifmachine-config.txt"
 	taskDefFilename = "taskdefinition-template.json"
 
-	# Downloading data from S3
-	taskDefFile = s3Client.get_object(Bucket = bucketName, Key = taskDefFilename) 
-	taskDef = json.loads(taskDefFile['Body'].read())
+	# Downloading data from S3 (or from the local cache if unchanged)
+	taskDef = json.loads(cached_get_object(s3Client, bucketName, taskDefFilename))
 
 	# Personalizing task def template
 	taskDef["family"]=environment+'-'+company+'-gifmachine-taskdefinition'
@@ -30,12 +169,39 @@ def update_taskdef_template(environment, company, awsRegion):
 		container["logConfiguration"]["options"]["awslogs-group"]='/ecs/'+environment+'-'+company+'-gifmachine-task-log'
 		container["logConfiguration"]["options"]["awslogs-region"]=awsRegion
 		container["environment"]=[{'name': 'ENVIRONMENT', 'value': environment},{'name': 'COMPANY', 'value': company},{'name': 'AWS_REGION', 'value': awsRegion}]
+	recommendation = load_capacity_recommendation(s3Client, bucketName, recommendationFilename) if applyCapacity else None
+	if recommendation and not apply_capacity_recommendation(taskDef, recommendation):
+		recommendation = None
 	f = open('taskdef.json', "w")
 	f.write(json.dumps(taskDef))
 	f.close()
 
-def main(environment, company, awsRegion):
-	update_taskdef_template(environment, company, awsRegion)
+	# Comparing with the active revision, so the pipeline can skip no-op deploys
+	liveTaskDef = active_task_definition(ecsClient, taskDef["family"])
+	changedFields = diff_task_definitions(comparable_task_definition(taskDef), comparable_task_definition(liveTaskDef)) if liveTaskDef else ['taskDefinition']
+	with open(DIFF_FILENAME, 'w') as diffFile:
+		json.dump({'noop': not changedFields, 'changedFields': changedFields}, diffFile, indent=2)
+	if changedFields:
+		print('Task definition changed: ' + ', '.join(changedFields))
+	else:
+		print('Task definition unchanged from active revision ' + str(liveTaskDef['revision']) + ': deploy is a no-op.')
+	if recommendation and recommendation.get('desiredCount'):
+		if changedFields:
+			apply_desired_count(get_client('cloudformation', awsRegion), environment, company, recommendation['desiredCount'])
+		else:
+			print('Desired count not applied: the pipeline stops no-op deploys')
+	return not changedFields, changedFields
+
+def main(*args):
+	parser = argparse.ArgumentParser(description='Render the gifmachine ECS task definition (taskdef.json).')
+	parser.add_argument('environment')
+	parser.add_argument('company')
+	parser.add_argument('awsRegion')
+	parser.add_argument('--apply-capacity', action='store_true', help='apply the capacity planner recommendation (task size and desired count)')
+	parser.add_argument('--recommendation', help='recommendation file (default: '+RECOMMENDATION_KEY+' in the deploy configs bucket)')
+	arguments = parser.parse_args(args)
+	update_taskdef_template(arguments.environment, arguments.company, arguments.awsRegion,
+	                        arguments.apply_capacity or arguments.recommendation is not None, arguments.recommendation)
 
 if __name__ == '__main__':
     main(*sys.argv[1:])
@@ -11,14 +11,15 @@ function banner(){
 
 banner "CICD"
 
-echo "Checking AWS configuration values..."
-python3 scripts/check_aws_config_validity.py config/aws-config.txt
-if [ $? -ne 0 ]; then
+# Helpers are grouped in batches, so that each group starts one interpreter
+if [ "$1" == "--update" ]; then
+     echo "Checking AWS configuration values and updating existing cicd stacks from the local templates..."
+     ./gifmachine-ops batch "validate-config config/aws-config.txt" "update-stacks cicd ${*:2}"
      exit
 fi
 
-echo "Checking AWS resources availability for monitoring..."
-python3 scripts/check_resources_availability.py 'cicd'
+echo "Checking AWS configuration values and resources availability for cicd..."
+./gifmachine-ops batch "validate-config config/aws-config.txt" "preflight cicd $*"
 if [ $? -ne 0 ]; then
      exit
 fi
@@ -37,22 +38,28 @@ printf "Starting creating infrastructure...\n"
 # CICD
 # Comments: Creating CICD stack via AWS Cloudformation, including
 #			build and deploy environments.
+python3 scripts/preflight_cache.py invalidate "$ENVIRONMENT-$COMPANY-gifmachine-*"
 echo "Creating private bucket '${ENVIRONMENT}-${COMPANY}-gifmachine-pipeline-artifacts' for storing Code Pipeline artifacts..."
 aws s3api create-bucket --bucket $ENVIRONMENT-$COMPANY-gifmachine-pipeline-artifacts --create-bucket-configuration LocationConstraint=$AWS_REGION --region $AWS_REGION > /dev/null
 
 echo "Zipping and sending needed AWS Codepipeline sources files to S3 bucket..."
-zip -j cicd/build_src.zip ./cicd/buildspec.yml ./cicd/update_taskdef_template.py ./cicd/appspec.yaml
-aws s3 cp cicd/build_src.zip s3://$ENVIRONMENT-$COMPANY-gifmachine-deploy-configs/build_src.zip --region $AWS_REGION
-aws s3 cp templates/taskdefinition-template.json s3://$ENVIRONMENT-$COMPANY-gifmachine-deploy-configs/taskdefinition-template.json --region $AWS_REGION
+zip -j cicd/build_src.zip ./cicd/buildspec.yml ./cicd/update_taskdef_template.py ./cicd/appspec.yaml ./scripts/sync_deploy_configs.py ./scripts/aws_clients.py ./scripts/aws_tracing.py
+python3 scripts/sync_deploy_configs.py $ENVIRONMENT-$COMPANY-gifmachine-deploy-configs $AWS_REGION \
+	cicd/build_src.zip=build_src.zip templates/taskdefinition-template.json=taskdefinition-template.json
 
-echo "Creating AWS Cloudformation stack... [ETA: `python3 scripts/get_eta.py 1`]"
+STACK_START=`date +%s`
+echo "Creating AWS Cloudformation stack... [ETA: `./gifmachine-ops eta 1 --phase stack:cicd --region $AWS_REGION`]"
 aws cloudformation create-stack --stack-name $ENVIRONMENT-$COMPANY-cicd-cf --template-body file://infrastructure/cicd-cf.yaml --capabilities CAPABILITY_NAMED_IAM \
 	--parameters ParameterKey=Environment,ParameterValue=$ENVIRONMENT ParameterKey=Company,ParameterValue=$COMPANY --region $AWS_REGION > /dev/null
-aws cloudformation wait stack-create-complete --stack-name $ENVIRONMENT-$COMPANY-cicd-cf
+./gifmachine-ops batch "wait-stack $ENVIRONMENT-$COMPANY-cicd-cf $AWS_REGION --since $STACK_START --phase stack:cicd --expected-minutes 1" "timings record stack:cicd $AWS_REGION $STACK_START"
+if [ $? -ne 0 ]; then
+	./gifmachine-ops timings record stack:cicd $AWS_REGION $STACK_START --failed
+	exit 1
+fi
 echo "AWS Cloudformation stack ${ENVIRONMENT}-${COMPANY}-cicd-cf created!"
 
 echo "Creating deployment pipeline..."
-python3 cicd/create_pipeline.py $ENVIRONMENT $COMPANY 'gifmachine' $AWS_REGION
+./gifmachine-ops pipeline $ENVIRONMENT $COMPANY 'gifmachine' $AWS_REGION --deployment-config ${DEPLOYMENT_CONFIG:-all-at-once}
 echo "CICD pipeline deployed! Deployment starting, go take a look!"
 PIPELINE_URL="https://${AWS_REGION}.console.aws.amazon.com/codesuite/codepipeline/pipelines/${ENVIRONMENT}-${COMPANY}-gifmachine-pipeline/view?region=${AWS_REGION}"
 echo "PIPELINE URL: ${PIPELINE_URL}"
@@ -11,14 +11,15 @@ function banner(){
 
 banner "MONITORING"
 
-echo "Checking AWS configuration values..."
-python3 scripts/check_aws_config_validity.py config/aws-config.txt
-if [ $? -ne 0 ]; then
+# Helpers are grouped in batches, so that each group starts one interpreter
+if [ "$1" == "--update" ]; then
+     echo "Checking AWS configuration values and updating existing monitoring stacks from the local templates..."
+     ./gifmachine-ops batch "validate-config config/aws-config.txt" "update-stacks monitoring ${*:2}"
      exit
 fi
 
-echo "Checking AWS resources availability for monitoring..."
-python3 scripts/check_resources_availability.py 'monitoring'
+echo "Checking AWS configuration values and resources availability for monitoring..."
+./gifmachine-ops batch "validate-config config/aws-config.txt" "preflight monitoring $*"
 if [ $? -ne 0 ]; then
      exit
 fi
@@ -38,22 +39,29 @@ printf "Starting creating infrastructure...\n"
 # Comments: Creating montiroing stack via AWS Cloudformation, including
 #			grafana, prometheus, and home-made sidecar ecosystem for
 # 			monitoring ECS containers.
+python3 scripts/preflight_cache.py invalidate "$ENVIRONMENT-$COMPANY-monitoring-*"
 echo "Creating SSH key for monitoring..."
 aws ec2 create-key-pair --key-name $ENVIRONMENT-$COMPANY-monitoring-key --query KeyMaterial --output text --region $AWS_REGION > keys/$ENVIRONMENT-$COMPANY-monitoring-key.pem
 chmod 600 keys/$ENVIRONMENT-$COMPANY-monitoring-key.pem
-echo "Creating AWS Cloudformation stack... [ETA: `python3 scripts/get_eta.py 4`]"
+STACK_START=`date +%s`
+echo "Creating AWS Cloudformation stack... [ETA: `./gifmachine-ops eta 4 --phase stack:monitoring --region $AWS_REGION`]"
 aws cloudformation create-stack --stack-name $ENVIRONMENT-$COMPANY-monitoring-cf --template-body file://infrastructure/monitoring-cf.yaml --capabilities CAPABILITY_NAMED_IAM \
 	--parameters ParameterKey=Environment,ParameterValue=$ENVIRONMENT ParameterKey=Company,ParameterValue=$COMPANY --region $AWS_REGION > /dev/null
-aws cloudformation wait stack-create-complete --stack-name $ENVIRONMENT-$COMPANY-monitoring-cf
+./gifmachine-ops batch "wait-stack $ENVIRONMENT-$COMPANY-monitoring-cf $AWS_REGION --since $STACK_START --phase stack:monitoring --expected-minutes 4" "timings record stack:monitoring $AWS_REGION $STACK_START"
+if [ $? -ne 0 ]; then
+	./gifmachine-ops timings record stack:monitoring $AWS_REGION $STACK_START --failed
+	exit 1
+fi
 echo "Creating S3 bucket to save monitoring tools source code..."
 aws s3api create-bucket --bucket $ENVIRONMENT-$COMPANY-monitoring-source --create-bucket-configuration LocationConstraint=$AWS_REGION --region $AWS_REGION > /dev/null
 echo "Zipping and copying monitoring tools source code to S3 bucket..."
-zip monitoring/tools_src.zip ./monitoring/cdepot/* ./monitoring/csidecar/* ./monitoring/prometheus/* ./monitoring/grafana/* ./monitoring/docker-compose.yml
+zip monitoring/tools_src.zip ./monitoring/cdepot/* ./monitoring/csidecar/* ./monitoring/prometheus/* ./monitoring/grafana/* ./monitoring/docker-compose.yml ./scripts/readiness.py ./scripts/test_gifmachine.py
 aws s3 cp monitoring/tools_src.zip s3://$ENVIRONMENT-$COMPANY-monitoring-source/tools_src.zip --region $AWS_REGION
 aws s3 cp monitoring/build_monitoring.sh s3://$ENVIRONMENT-$COMPANY-monitoring-source/build_monitoring.sh --region $AWS_REGION
 echo "Waiting 60 secs for monitoring-instance to boot..."
 sleep 60
 echo "Starting monitoring build in monitoring instance..."
+GIFMACHINE_URL="http://`aws elbv2 describe-load-balancers --names $ENVIRONMENT-$COMPANY-gifmachine-lb --query 'LoadBalancers[0].DNSName' --output text --region $AWS_REGION`"
 MONITORING_PUBLIC_IP=`aws ec2 describe-instances \
 	--filters Name=tag:Name,Values=$ENVIRONMENT-$COMPANY-monitoring-instance Name=instance-state-name,Values=running \
 	--query 'Reservations[0].Instances[0].PublicIpAddress' --output text --region $AWS_REGION`
@@ -62,5 +70,5 @@ ssh -o StrictHostKeyChecking=no -o IdentitiesOnly=yes -i keys/$ENVIRONMENT-$COMP
 	export COMPANY=${COMPANY}; \
   	export AWS_REGION=${AWS_REGION}; \
   	aws s3 cp s3://$ENVIRONMENT-$COMPANY-monitoring-source/build_monitoring.sh . --region $AWS_REGION; \
-	sh build_monitoring.sh $ENVIRONMENT $COMPANY $AWS_REGION"
+	sh build_monitoring.sh $ENVIRONMENT $COMPANY $AWS_REGION $GIFMACHINE_URL"
 
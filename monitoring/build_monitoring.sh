@@ -3,6 +3,7 @@
 export ENVIRONMENT=$1
 export COMPANY=$2
 export AWS_REGION=$3
+export GIFMACHINE_URL=$4
 
 echo "Installing needed software..."
 sudo amazon-linux-extras install -y docker
@@ -27,10 +28,19 @@ echo "Building cDepot..."
 GOOS=linux GOARCH=386 go build -o monitoring/cdepot/cdepot ./monitoring/cdepot/main.go
 sudo docker build -t cdepot -f monitoring/cdepot/Dockerfile ./monitoring
 
+echo "Generating Prometheus recording rules from Grafana dashboards..."
+python3 monitoring/grafana/recording_rules.py
+
 printf "Lauching Docker Compose containing\n  - Prometheus\n  - Grafana\n  - cDepot\n"
 sudo docker-compose -f monitoring/docker-compose.yml up -d
 
 MONITORING_PUBLIC_IP=`aws ec2 describe-instances \
 	--filters Name=tag:Name,Values=$ENVIRONMENT-$COMPANY-monitoring-instance Name=instance-state-name,Values=running \
 	--query 'Reservations[0].Instances[0].PublicIpAddress' --output text --region $AWS_REGION`
-python3 monitoring/grafana/set_up_grafana.py "http://${MONITORING_PUBLIC_IP}:3000"
\ No newline at end of file
+python3 monitoring/grafana/set_up_grafana.py "http://${MONITORING_PUBLIC_IP}:3000" "http://localhost:9090"
+
+echo "Launching Gif Machine synthetic probe..."
+# Registered with cDepot, so Prometheus (in a container) scrapes it on the instance private IP
+PRIVATE_IP=`curl -s http://169.254.169.254/latest/meta-data/local-ipv4`
+nohup python3 scripts/test_gifmachine.py "$GIFMACHINE_URL" --probe --port 9101 --cdepot-url http://localhost:8002 \
+	--advertise-address "${PRIVATE_IP}:9101" > gifmachine-probe.log 2>&1 &
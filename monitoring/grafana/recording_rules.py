@@ -0,0 +1,124 @@
+# RECORDING_RULES
+# Generates Prometheus recording rules for the aggregations used by the
+#  Grafana dashboard panels, and rewrites the panel queries to read the
+#  precomputed series, so each refresh no longer re-aggregates every task
+#  series for every viewer.
+
+import copy
+import glob
+import json
+import os
+import re
+import sys
+
+PROVISIONING_FOLDER = 'monitoring/grafana'
+RULES_FILENAME = 'monitoring/prometheus/recording-rules.yml'
+RULE_GROUP_NAME = 'grafana-dashboards'
+
+METRIC = re.compile(r'^[A-Za-z_:][A-Za-z0-9_:]*$')
+# e.g. increase(cSidecar_RxTraffic[1m])
+RANGE_FUNCTION = re.compile(r'^(rate|irate|increase|delta|deriv|avg_over_time|max_over_time|min_over_time)\(\s*([A-Za-z_:][A-Za-z0-9_:]*)\[(\w+)\]\s*\)$')
+# CPU and memory % go up and down, so counter functions on them give
+#  meaningless values. The traffic bytes are cumulative (docker rx/tx_bytes,
+#  back to 0 when a container restarts, which counter functions handle)
+GAUGE_METRICS = ['cSidecar_CPUUtilization', 'cSidecar_MemoryUtilization']
+COUNTER_FUNCTIONS = ['rate', 'irate', 'increase']
+# e.g. histogram_quantile(0.99, sum by (endpoint, le) (rate(x_bucket[5m])))
+QUANTILE = re.compile(r'^histogram_quantile\(\s*([0-9.]+)\s*,\s*(.*)\)$')
+# e.g. avg by (cluster, function) (cSidecar_CPUUtilization)
+AGGREGATION = re.compile(r'^(sum|avg|min|max|count)\s+by\s*\(([\w\s,]*)\)\s*\((.*)\)$')
+
+def load_dashboards(folder):
+	dashboards = []
+	for filename in sorted(glob.glob(os.path.join(folder, '*.json'))):
+		with open(filename) as jsonFile:
+			content = json.load(jsonFile)
+		if 'dashboard' in content:
+			dashboards.append(content['dashboard'])
+	return dashboards
+
+def recorded_series(expr, rules):
+	# Returns the series to query instead of expr (adding the rules needed to
+	#  record it, inner ones first) and the base metric; (None, None) if expr
+	#  is not a supported aggregation. Names follow level:metric:operations.
+	expr = expr.strip()
+	if METRIC.match(expr):
+		return expr, expr
+	match = RANGE_FUNCTION.match(expr)
+	if match:
+		function, metric, timeRange = match.groups()
+		if function in COUNTER_FUNCTIONS and metric in GAUGE_METRICS:
+			raise ValueError("'" + expr + "' applies a counter function to the gauge " + metric + ', use delta, deriv or *_over_time instead')
+		return add_rule(rules, 'instance:'+metric+':'+function+timeRange, expr), metric
+	match = QUANTILE.match(expr)
+	if match:
+		# Quantiles are cheap once the buckets are aggregated, and one recorded
+		#  series serves every quantile, so only the buckets are recorded
+		quantile, inner = match.groups()
+		innerSeries, metric = recorded_series(inner, rules)
+		if innerSeries is None or innerSeries == metric:
+			return None, None
+		return 'histogram_quantile('+quantile+', '+innerSeries+')', metric
+	match = AGGREGATION.match(expr)
+	if match:
+		aggregation, labels, inner = match.groups()
+		innerSeries, metric = recorded_series(inner, rules)
+		if innerSeries is None:
+			return None, None
+		labels = [label.strip() for label in labels.split(',') if label.strip()]
+		operations = aggregation if innerSeries == metric else aggregation+'_'+innerSeries.split(':')[-1]
+		return add_rule(rules, '_'.join(labels)+':'+metric+':'+operations, aggregation+' by ('+', '.join(labels)+') ('+innerSeries+')'), metric
+	return None, None
+
+def add_rule(rules, name, expr):
+	if rules.get(name, expr) != expr:
+		raise ValueError("Recording rule '" + name + "' would record both '" + rules[name] + "' and '" + expr + "'")
+	rules[name] = expr
+	return name
+
+def rewrite_dashboard(dashboard, rules=None):
+	# Returns a copy of the dashboard querying recorded series, and the rules
+	#  ({record: expr}, in dependency order) those series need
+	rules = {} if rules is None else rules
+	dashboard = copy.deepcopy(dashboard)
+	for panel in dashboard.get('panels', []):
+		for target in panel.get('targets', []):
+			if 'expr' not in target: continue
+			series, _ = recorded_series(target['expr'], rules)
+			if series is not None:
+				target['expr'] = series
+	return dashboard, rules
+
+def evaluation_interval(dashboards):
+	# Panels never query finer than their interval, so rules need not either
+	intervals = [panel['interval'] for dashboard in dashboards for panel in dashboard.get('panels', []) if panel.get('interval')]
+	seconds = dict((interval, int(interval[:-1]) * {'s': 1, 'm': 60, 'h': 3600}[interval[-1]]) for interval in intervals)
+	return min(intervals, key=lambda interval: seconds[interval]) if intervals else None
+
+def write_rules_file(rules, interval, filename=RULES_FILENAME):
+	# JSON strings are valid YAML double quoted strings
+	lines = ['# Generated by monitoring/grafana/recording_rules.py from the Grafana dashboards, do not edit.',
+	         'groups:',
+	         '  - name: ' + RULE_GROUP_NAME]
+	if interval: lines.append('    interval: ' + interval)
+	lines.append('    rules:')
+	for name, expr in rules.items():
+		lines.append('      - record: ' + name)
+		lines.append('        expr: ' + json.dumps(expr))
+	with open(filename, 'w') as rulesFile:
+		rulesFile.write('\n'.join(lines) + '\n')
+
+def generate_recording_rules(provisioningFolder=PROVISIONING_FOLDER, rulesFilename=RULES_FILENAME):
+	dashboards = load_dashboards(provisioningFolder)
+	rules = {}
+	for dashboard in dashboards:
+		rewrite_dashboard(dashboard, rules)
+	write_rules_file(rules, evaluation_interval(dashboards), rulesFilename)
+	print('Wrote ' + str(len(rules)) + ' recording rules to ' + rulesFilename)
+	return rules
+
+def main(provisioningFolder=PROVISIONING_FOLDER, rulesFilename=RULES_FILENAME):
+	generate_recording_rules(provisioningFolder, rulesFilename)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
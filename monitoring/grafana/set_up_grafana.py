@@ -1,56 +1,146 @@
+# SET_UP_GRAFANA
+# Provisions Grafana from a folder of datasource and dashboard JSON files:
+#  existing objects are indexed by uid from one listing, compared with the
+#  files, and only new or changed ones are pushed (concurrently, over one
+#  pooled session), so re-running it against a shared Grafana is cheap.
+
+import glob
+import json
+import os
 import sys
 import requests
-import json
-import time
+from concurrent.futures import ThreadPoolExecutor
 from requests.adapters import HTTPAdapter
 
-def set_up_grafana(grafanaUrl):
-	dashboardName = 'gifmachines'
-	dashboardTemplateFilename = 'monitoring/grafana/dashboard.json'
-	sourceApiEndpoint='/api/datasources'
-	createDashboardApiEndpoint='/api/dashboards/db'
-	searchApiEndpoint='/api/search/'
-	headers = {"Accept": "application/json",
-	           "Content-Type": "application/json"}
-		
+# Shared readiness prober (shipped next to this script under scripts/)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'scripts'))
+import readiness
+from recording_rules import rewrite_dashboard
+
+PROVISIONING_FOLDER = 'monitoring/grafana'
+DEFAULT_MAX_WORKERS = 8
+SEARCH_PAGE_SIZE = 5000 # maximum allowed by Grafana
+REQUEST_TIMEOUT = 10 # seconds
+# Set by Grafana on every save, so never a difference worth pushing
+DASHBOARD_SERVER_FIELDS = ['id', 'version']
+DATASOURCE_SERVER_FIELDS = ['id', 'orgId', 'version', 'readOnly', 'typeLogoUrl']
+
+def load_provisioning_files(folder):
+	# Dashboard files wrap the model in a 'dashboard' key (as the API does),
+	#  any other JSON file is a datasource
+	datasources = []
+	dashboards = []
+	for filename in sorted(glob.glob(os.path.join(folder, '*.json'))):
+		with open(filename) as jsonFile:
+			content = json.load(jsonFile)
+		if 'dashboard' in content:
+			dashboards.append(content['dashboard'])
+		else:
+			datasources.append(content)
+	for item in datasources + dashboards:
+		if not item.get('uid'):
+			raise ValueError("Grafana object '" + str(item.get('name') or item.get('title')) + "' has no uid, so it cannot be provisioned idempotently")
+	return datasources, dashboards
+
+def is_unchanged(desired, existing, serverFields):
+	# Only fields set in the files are compared, since Grafana fills in defaults
+	return all(existing.get(key) == value for key, value in desired.items() if key not in serverFields)
+
+class GrafanaProvisioner:
+	def __init__(self, grafanaUrl, maxWorkers=DEFAULT_MAX_WORKERS, session=None):
+		self.grafanaUrl = grafanaUrl.rstrip('/')
+		self.maxWorkers = maxWorkers
+		if session is None:
+			session = requests.Session()
+			session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=maxWorkers))
+			session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=maxWorkers))
+			session.headers.update({'Accept': 'application/json', 'Content-Type': 'application/json'})
+		self.session = session
+
+	def api(self, method, endpoint, **kwargs):
+		response = self.session.request(method, self.grafanaUrl+endpoint, timeout=REQUEST_TIMEOUT, **kwargs)
+		response.raise_for_status()
+		return response.json()
+
+	def existing_datasources(self):
+		return self.api('GET', '/api/datasources')
+
+	def existing_dashboards(self):
+		# uid: search result (with the dashboard url), for every dashboard
+		dashboards = {}
+		page = 1
+		while True:
+			results = self.api('GET', '/api/search', params={'type': 'dash-db', 'limit': SEARCH_PAGE_SIZE, 'page': page})
+			for result in results:
+				dashboards[result['uid']] = result
+			if len(results) < SEARCH_PAGE_SIZE:
+				return dashboards
+			page = page + 1
+
+	def plan_datasource(self, datasource, existingDatasources):
+		# Datasources created before they had a uid are matched by their (unique) name
+		for existing in existingDatasources:
+			if existing.get('uid') == datasource['uid'] or existing.get('name') == datasource['name']:
+				if is_unchanged(datasource, existing, DATASOURCE_SERVER_FIELDS):
+					return ('unchanged', 'datasource', datasource, existing)
+				return ('update', 'datasource', datasource, existing)
+		return ('create', 'datasource', datasource, None)
+
+	def plan_dashboard(self, dashboard, existingDashboards):
+		if dashboard['uid'] not in existingDashboards:
+			return ('create', 'dashboard', dashboard, None)
+		# Only the dashboards we provision are downloaded, not every listed one
+		existing = self.api('GET', '/api/dashboards/uid/'+dashboard['uid'])['dashboard']
+		if is_unchanged(dashboard, existing, DASHBOARD_SERVER_FIELDS):
+			return ('unchanged', 'dashboard', dashboard, existingDashboards[dashboard['uid']])
+		return ('update', 'dashboard', dashboard, existingDashboards[dashboard['uid']])
+
+	def apply(self, action, kind, desired, existing):
+		# Returns the dashboard url (None for datasources)
+		if kind == 'datasource':
+			if action == 'create':
+				self.api('POST', '/api/datasources', json=desired)
+			elif action == 'update':
+				self.api('PUT', '/api/datasources/'+str(existing['id']), json=dict(desired, id=existing['id']))
+			return None
+		if action == 'unchanged':
+			return existing['url']
+		dashboard = dict(desired, id=None)
+		return self.api('POST', '/api/dashboards/db', json={'dashboard': dashboard, 'overwrite': True})['url']
+
+	def provision(self, folder=PROVISIONING_FOLDER):
+		# Returns {dashboard title: exact dashboard url}
+		datasources, dashboards = load_provisioning_files(folder)
+		# Panels read the series recorded by the rules generated from the same files
+		dashboards = [rewrite_dashboard(dashboard)[0] for dashboard in dashboards]
+		with ThreadPoolExecutor(max_workers=self.maxWorkers) as executor:
+			existingDatasources = executor.submit(self.existing_datasources)
+			existingDashboards = executor.submit(self.existing_dashboards)
+			plan = [self.plan_datasource(datasource, existingDatasources.result()) for datasource in datasources]
+			plan = plan + list(executor.map(lambda dashboard: self.plan_dashboard(dashboard, existingDashboards.result()), dashboards))
+			urls = list(executor.map(lambda step: self.apply(*step), plan))
+		for action, kind, desired, _ in plan:
+			print('  [' + action + '] ' + kind + ' "' + (desired.get('name') or desired.get('title')) + '" (uid ' + desired['uid'] + ')')
+		actions = [action for action, _, _, _ in plan]
+		print('Grafana provisioned: ' + str(actions.count('create')) + ' created, ' + str(actions.count('update')) + ' updated, ' +
+		      str(actions.count('unchanged')) + ' unchanged')
+		return dict((desired['title'], self.grafanaUrl+url) for (_, kind, desired, _), url in zip(plan, urls) if kind == 'dashboard')
+
+def set_up_grafana(grafanaUrl, prometheusUrl=None, provisioningFolder=PROVISIONING_FOLDER):
 	print('Waiting for Grafana to be ready...')
-	if check_if_ready(grafanaUrl,2,1,1):
-		print('Grafana ready!')
-		
-		print('Adding Prometheus source...')
-		sourceConfig = {'name':'Prometheus','type':'prometheus','url':'prometheus:9090','access':'proxy','basicAuth':False}
-		requests.post(grafanaUrl+sourceApiEndpoint, headers=headers, json=sourceConfig)
-		
-		print('Creating dashboard...')
-		with open(dashboardTemplateFilename) as jsonFile:
-			dashboard = json.load(jsonFile)
-			dashboard['dashboard']['title']=dashboardName
-			r=requests.post(grafanaUrl+createDashboardApiEndpoint, headers=headers, json=dashboard)
-
-		print('Getting dashboard...')
-		r = requests.get(grafanaUrl+searchApiEndpoint, headers=headers)
-		searchResult = json.loads(r.text)
-		for item in searchResult:
-			if dashboardName in item['title']:
-				dashboardUrl=item['url']
-				break
-		print("DASHBOARD URL: "+grafanaUrl+dashboardUrl)
-
-
-def check_if_ready(grafanaUrl, retryIn, timeout, maxRetries):
-	adapter = HTTPAdapter(max_retries=maxRetries)
-	session = requests.Session()
-	session.mount(grafanaUrl, adapter)
-	while True:
-		try:
-			session.get(grafanaUrl,timeout=timeout)
-			return True
-		except:
-			time.sleep(retryIn)
-
-
-def main(grafanaUrl):
-	set_up_grafana(grafanaUrl)
+	readyUrls = [grafanaUrl+'/api/health']
+	if prometheusUrl: readyUrls.append(prometheusUrl+'/-/ready')
+	readiness.wait_or_exit(readyUrls)
+	print('Grafana ready!')
+
+	print('Provisioning datasources and dashboards from ' + provisioningFolder + '...')
+	dashboardUrls = GrafanaProvisioner(grafanaUrl).provision(provisioningFolder)
+	for title in sorted(dashboardUrls):
+		print("DASHBOARD URL: "+dashboardUrls[title])
+	return dashboardUrls
+
+def main(grafanaUrl, prometheusUrl=None, provisioningFolder=PROVISIONING_FOLDER):
+	set_up_grafana(grafanaUrl, prometheusUrl, provisioningFolder)
 
 if __name__ == '__main__':
     main(*sys.argv[1:])
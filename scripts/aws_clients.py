@@ -0,0 +1,58 @@
+# AWS_CLIENTS
+# Shared factory of boto3 clients: each client is created on first use and
+#  cached per service, region and configuration, all from one session (whose
+#  calls aws_tracing profiles when GIFMACHINE_AWS_TRACE is set).
+
+import boto3
+import copy
+import threading
+import time
+from aws_tracing import install_if_enabled
+from botocore.config import Config
+
+DEFAULT_MAX_POOL_CONNECTIONS = 25
+
+session = None
+tracer = None
+clients = {}
+clientsLock = threading.Lock()
+clientsBuilt = 0
+buildSeconds = 0.0
+
+def get_session():
+	global session, tracer
+	if session is None:
+		session = boto3.session.Session()
+		tracer = install_if_enabled(session)
+	return session
+
+def get_client(service, awsRegion, **configOptions):
+	# configOptions are botocore Config options (e.g. retries, max_pool_connections)
+	global clientsBuilt, buildSeconds
+	configOptions.setdefault('max_pool_connections', DEFAULT_MAX_POOL_CONNECTIONS)
+	key = (service, awsRegion, repr(sorted(configOptions.items())))
+	with clientsLock:
+		if key not in clients:
+			# Creating clients from a session is not thread safe, hence the lock
+			#  (Config rewrites the retries options it gets, so it works on a copy)
+			startTime = time.time()
+			clientConfig = Config(region_name = awsRegion, **copy.deepcopy(configOptions))
+			clients[key] = get_session().client(service, config=clientConfig)
+			clientsBuilt = clientsBuilt + 1
+			buildSeconds = buildSeconds + time.time() - startTime
+		return clients[key]
+
+class RegionClients:
+	# Dict-like view (clients['ec2']) of the lazily created clients of a region
+	def __init__(self, awsRegion, **configOptions):
+		self.awsRegion = awsRegion
+		self.configOptions = configOptions
+
+	def __getitem__(self, service):
+		return get_client(service, self.awsRegion, **self.configOptions)
+
+def client_stats():
+	return clientsBuilt, buildSeconds
+
+def print_client_stats():
+	print('AWS clients: ' + str(clientsBuilt) + ' built in ' + str(round(buildSeconds, 2)) + 's')
@@ -0,0 +1,110 @@
+# AWS_TRACING
+# Opt-in profiling of the AWS API calls made through aws_clients: botocore
+#  call events of the shared session are timed per operation (calls, latency,
+#  retries, error codes), a summary is printed at exit, and every call can be
+#  dumped as a span to a Chrome trace file (chrome://tracing or Perfetto).
+#  Enabled by GIFMACHINE_AWS_TRACE=1 (GIFMACHINE_AWS_TRACE_FILE=<file> also
+#  dumps the spans); when disabled no handler is registered at all.
+
+import atexit
+import json
+import math
+import os
+import threading
+import time
+
+TRACE_VARIABLE = 'GIFMACHINE_AWS_TRACE'
+TRACE_FILE_VARIABLE = 'GIFMACHINE_AWS_TRACE_FILE'
+START_KEY = 'gifmachineTraceStart' # stored in the per call botocore context
+
+def is_enabled():
+	return os.environ.get(TRACE_VARIABLE, '') not in ['', '0'] or bool(os.environ.get(TRACE_FILE_VARIABLE))
+
+class AwsTracer:
+	def __init__(self, clock=time.time):
+		self.clock = clock
+		self.spans = []
+		self.spansLock = threading.Lock()
+		self.startTime = clock()
+
+	def before_call(self, context, **kwargs):
+		context[START_KEY] = self.clock()
+
+	def after_call(self, event_name, parsed, context, **kwargs):
+		# Called for error responses too (before botocore raises the ClientError)
+		metadata = parsed.get('ResponseMetadata', {})
+		error = parsed.get('Error', {}).get('Code') if 'Error' in parsed else None
+		self.add_span(event_name, context, metadata.get('RetryAttempts', 0), error)
+
+	def after_call_error(self, event_name, exception, context, **kwargs):
+		# Calls that got no response (e.g. connection errors after all retries)
+		self.add_span(event_name, context, None, type(exception).__name__)
+
+	def add_span(self, eventName, context, retries, error):
+		end = self.clock()
+		start = context.get(START_KEY, end)
+		_, service, operation = eventName.split('.', 2)
+		span = {'service': service, 'operation': operation, 'region': context.get('client_region'), 'start': start,
+		        'duration': end - start, 'retries': retries, 'error': error, 'thread': threading.current_thread().name}
+		with self.spansLock:
+			self.spans.append(span)
+
+	def install(self, session):
+		# Handlers registered on the session are inherited by every client it creates
+		session.events.register('before-call', self.before_call)
+		session.events.register('after-call', self.after_call)
+		session.events.register('after-call-error', self.after_call_error)
+
+	def operation_stats(self):
+		# [(service.operation, stats)] sorted by total time spent, slowest first
+		operations = {}
+		for span in self.spans:
+			operations.setdefault(span['service']+'.'+span['operation'], []).append(span)
+		stats = []
+		for name, spans in operations.items():
+			durations = sorted(span['duration'] for span in spans)
+			errors = {}
+			for span in spans:
+				if span['error']: errors[span['error']] = errors.get(span['error'], 0) + 1
+			stats.append((name, {'calls': len(spans), 'total': sum(durations), 'mean': sum(durations) / len(durations),
+			                     'p95': durations[int(math.ceil(0.95 * len(durations))) - 1], 'max': durations[-1],
+			                     'retries': sum(span['retries'] or 0 for span in spans), 'errors': errors}))
+		return sorted(stats, key=lambda item: -item[1]['total'])
+
+	def print_summary(self):
+		if not self.spans: return
+		print('AWS API calls (' + str(len(self.spans)) + ' calls over ' + str(round(self.clock() - self.startTime, 1)) + 's):')
+		print('  %-52s %6s %9s %9s %9s %9s %7s  %s' % ('operation', 'calls', 'total', 'mean', 'p95', 'max', 'retries', 'errors'))
+		for name, stats in self.operation_stats():
+			errors = ', '.join(code + ' x' + str(count) for code, count in sorted(stats['errors'].items()))
+			print('  %-52s %6d %8.2fs %7.0fms %7.0fms %7.0fms %7d  %s' % (name, stats['calls'], stats['total'], 1000*stats['mean'],
+			      1000*stats['p95'], 1000*stats['max'], stats['retries'], errors))
+
+	def write_trace(self, filename):
+		# Chrome trace event format: one complete ('X') event per call, one row per thread
+		threadIds = {}
+		events = []
+		for span in self.spans:
+			threadId = threadIds.setdefault(span['thread'], len(threadIds) + 1)
+			events.append({'name': span['service']+'.'+span['operation'], 'cat': span['service'], 'ph': 'X', 'pid': 1, 'tid': threadId,
+			               'ts': int(1e6 * (span['start'] - self.startTime)), 'dur': int(1e6 * span['duration']),
+			               'args': {'region': span['region'], 'retries': span['retries'], 'error': span['error']}})
+		for threadName, threadId in threadIds.items():
+			events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': threadId, 'args': {'name': threadName}})
+		with open(filename, 'w') as traceFile:
+			json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, traceFile)
+		print('AWS API trace (' + str(len(self.spans)) + ' spans) written to ' + filename)
+
+	def report(self, traceFilename=None):
+		self.print_summary()
+		if traceFilename:
+			self.write_trace(traceFilename)
+
+def install_if_enabled(session):
+	# Returns the tracer reporting at exit, or None when tracing is disabled
+	if not is_enabled():
+		return None
+	tracer = AwsTracer()
+	tracer.install(session)
+	atexit.register(tracer.report, os.environ.get(TRACE_FILE_VARIABLE))
+	return tracer
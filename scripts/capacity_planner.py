@@ -0,0 +1,205 @@
+# CAPACITY_PLANNER
+# Recommends the Fargate task size (CPU/memory) and the service desired count
+#  from the cSidecar utilization gauges, for a target headroom. Metrics are
+#  read from a Prometheus range query export (the 'export' subcommand records
+#  one), so planning works offline; update_taskdef_template applies the
+#  recommendation when rendering taskdef.json.
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+TASKDEF_TEMPLATE = 'templates/taskdefinition-template.json'
+RECOMMENDATION_FILENAME = '.gifmachine/capacity-recommendation.json'
+CPU_METRIC = 'cSidecar_CPUUtilization' # % of the task CPU
+MEMORY_METRIC = 'cSidecar_MemoryUtilization' # % of the gifmachine container memory
+NETWORK_METRICS = ['cSidecar_RxTraffic', 'cSidecar_TxTraffic'] # bytes since the task started
+EXPORTED_METRICS = [CPU_METRIC, MEMORY_METRIC] + NETWORK_METRICS
+DEFAULT_HEADROOM = 0.3
+DEFAULT_PERCENTILE = 95
+DEFAULT_MIN_COUNT = 1
+DEFAULT_MAX_COUNT = 10
+DEFAULT_EXPORT_HOURS = 24
+DEFAULT_EXPORT_STEP = 60 # seconds, the cSidecar averaging bin
+# Fargate task sizes: CPU units and the memory (MiB) each one allows
+FARGATE_SIZES = [(256, [512, 1024, 2048])] + \
+                [(512, [1024*gb for gb in range(1, 5)])] + \
+                [(1024, [1024*gb for gb in range(2, 9)])] + \
+                [(2048, [1024*gb for gb in range(4, 17)])] + \
+                [(4096, [1024*gb for gb in range(8, 31)])]
+# Linux/x86 on-demand prices, only used to rank the sizes that fit
+FARGATE_VCPU_HOUR = 0.04048
+FARGATE_GB_HOUR = 0.004445
+HOURS_PER_MONTH = 730
+
+def export_metrics(prometheusUrl, outputFilename, hours=DEFAULT_EXPORT_HOURS, step=DEFAULT_EXPORT_STEP):
+	import requests
+	end = time.time()
+	responses = []
+	for metric in EXPORTED_METRICS:
+		response = requests.get(prometheusUrl.rstrip('/')+'/api/v1/query_range', timeout=30,
+		                        params={'query': metric, 'start': end - hours*3600, 'end': end, 'step': step})
+		response.raise_for_status()
+		responses.append(response.json())
+	with open(outputFilename, 'w') as outputFile:
+		json.dump(responses, outputFile)
+	print('Exported ' + str(sum(len(response['data']['result']) for response in responses)) + ' series (' + str(hours) + 'h) to ' + outputFilename)
+
+def load_series(filename):
+	# {metric: {task labels: [(timestamp, value)]}} from one query_range
+	#  response, a list of them, or a {name: response} dict
+	with open(filename, 'r') as metricsFile:
+		content = json.load(metricsFile)
+	if isinstance(content, dict):
+		responses = [content] if 'data' in content else list(content.values())
+	else:
+		responses = content
+	series = {}
+	for response in responses:
+		for result in response['data']['result']:
+			labels = dict(result['metric'])
+			metric = labels.pop('__name__')
+			task = tuple(sorted(labels.items()))
+			samples = [(float(timestamp), float(value)) for timestamp, value in result['values']]
+			series.setdefault(metric, {}).setdefault(task, []).extend(samples)
+	return series
+
+def percentile(values, percent):
+	values = sorted(values)
+	if not values: return None
+	return values[min(len(values) - 1, int(math.ceil(percent / 100.0 * len(values))) - 1)]
+
+def fleet_totals(taskSeries):
+	# Sum over tasks at each (range query aligned) timestamp
+	totals = {}
+	for samples in taskSeries.values():
+		for timestamp, value in samples:
+			totals[timestamp] = totals.get(timestamp, 0.0) + value
+	return [totals[timestamp] for timestamp in sorted(totals)]
+
+def counter_rates(taskSeries):
+	# Per task rates of cumulative counters (a decrease is a task restart)
+	rates = []
+	for samples in taskSeries.values():
+		samples = sorted(samples)
+		for (previousTime, previousValue), (timestamp, value) in zip(samples, samples[1:]):
+			if timestamp > previousTime and value >= previousValue:
+				rates.append((value - previousValue) / (timestamp - previousTime))
+	return rates
+
+def observed_task_count(taskSeries):
+	# Tasks reporting at the median timestamp; during blue/green deploys both
+	#  task sets report for a while, so the median ignores those
+	counts = {}
+	for samples in taskSeries.values():
+		for timestamp, _ in samples:
+			counts[timestamp] = counts.get(timestamp, 0) + 1
+	return percentile(list(counts.values()), 50)
+
+def monthly_cost(cpu, memory, count):
+	return count * HOURS_PER_MONTH * (cpu/1024.0 * FARGATE_VCPU_HOUR + memory/1024.0 * FARGATE_GB_HOUR)
+
+def current_size(templateFilename=TASKDEF_TEMPLATE):
+	with open(templateFilename, 'r') as templateFile:
+		taskDef = json.load(templateFile)
+	gifmachine = [container for container in taskDef['containerDefinitions'] if container['name'] == 'gifmachine'][0]
+	return int(taskDef['cpu']), int(taskDef['memory']), int(gifmachine['memory'])
+
+def recommend(series, taskCpu, containerMemory, headroom=DEFAULT_HEADROOM, percent=DEFAULT_PERCENTILE,
+              minCount=DEFAULT_MIN_COUNT, maxCount=DEFAULT_MAX_COUNT):
+	# CPU load spreads over the tasks, so the fleet total is sized; memory is
+	#  mostly held by every task, so the per task usage is
+	if not series.get(CPU_METRIC) or not series.get(MEMORY_METRIC):
+		raise ValueError('the metrics need both ' + CPU_METRIC + ' and ' + MEMORY_METRIC + ' series')
+	cpuDemand = percentile(fleet_totals(series[CPU_METRIC]), percent) / 100.0 * taskCpu
+	taskCpuPeak = max(value for samples in series[CPU_METRIC].values() for _, value in samples) / 100.0 * taskCpu
+	memoryDemand = percentile([value for samples in series[MEMORY_METRIC].values() for _, value in samples], percent) / 100.0 * containerMemory
+	usable = 1.0 - headroom
+
+	candidates = []
+	for cpu, memories in FARGATE_SIZES:
+		for memory in memories:
+			if memory * usable < memoryDemand: continue
+			count = max(minCount, int(math.ceil(cpuDemand / (cpu * usable))))
+			if count <= maxCount:
+				# Cheapest first; at equal cost, more (smaller) tasks tolerate a task loss better
+				candidates.append((monthly_cost(cpu, memory, count), -count, cpu, memory, count))
+	if not candidates:
+		raise ValueError('no Fargate size fits ' + str(round(cpuDemand)) + ' CPU units and ' + str(round(memoryDemand)) +
+		                 ' MiB per task with ' + str(maxCount) + ' tasks at most')
+	cost, _, cpu, memory, count = min(candidates)
+	return {'cpu': str(cpu), 'memory': str(memory), 'desiredCount': count, 'monthlyCost': round(cost, 2),
+	        'headroom': headroom, 'percentile': percent,
+	        'basis': {'cpuDemand': round(cpuDemand, 1), 'taskCpuPeak': round(taskCpuPeak, 1), 'memoryDemand': round(memoryDemand, 1),
+	                  'tasks': len(series[CPU_METRIC]), 'samples': sum(len(samples) for samples in series[CPU_METRIC].values())},
+	        'generatedAt': int(time.time())}
+
+def print_report(series, recommendation, taskCpu, taskMemory, containerMemory, currentCount):
+	percent = recommendation['percentile']
+	print('Utilization of ' + str(recommendation['basis']['tasks']) + ' tasks (' + str(recommendation['basis']['samples']) + ' CPU samples):')
+	for metric, unit in [(CPU_METRIC, '% of ' + str(taskCpu) + ' CPU units'), (MEMORY_METRIC, '% of ' + str(containerMemory) + ' MiB')]:
+		values = [value for samples in series[metric].values() for _, value in samples]
+		print('  %-28s p50 %6.1f  p%g %6.1f  max %6.1f  (%s)' % (metric, percentile(values, 50), percent, percentile(values, percent), max(values), unit))
+	for metric in NETWORK_METRICS:
+		rates = counter_rates(series.get(metric, {}))
+		if rates:
+			print('  %-28s p50 %6.1f  p%g %6.1f  max %6.1f  (KB/s per task)' % (metric, percentile(rates, 50)/1024, percent,
+			      percentile(rates, percent)/1024, max(rates)/1024))
+	basis = recommendation['basis']
+	print('Fleet CPU demand (p' + ('%g' % percent) + '): ' + str(basis['cpuDemand']) + ' units, task memory demand: ' + str(basis['memoryDemand']) + ' MiB')
+	print('Current:     ' + str(currentCount) + ' x ' + str(taskCpu) + ' CPU / ' + str(taskMemory) + ' MiB  ($' +
+	      str(round(monthly_cost(taskCpu, taskMemory, currentCount), 2)) + '/month)')
+	print('Recommended: ' + str(recommendation['desiredCount']) + ' x ' + recommendation['cpu'] + ' CPU / ' + recommendation['memory'] +
+	      ' MiB  ($' + str(recommendation['monthlyCost']) + '/month, ' + str(round(100*recommendation['headroom'])) + '% headroom)')
+
+def plan(metricsFilename, outputFilename=RECOMMENDATION_FILENAME, headroom=DEFAULT_HEADROOM, percent=DEFAULT_PERCENTILE,
+         minCount=DEFAULT_MIN_COUNT, maxCount=DEFAULT_MAX_COUNT, currentCount=None, templateFilename=TASKDEF_TEMPLATE):
+	# The recorded percentages are relative to the size the tasks ran with
+	taskCpu, taskMemory, containerMemory = current_size(templateFilename)
+	series = load_series(metricsFilename)
+	recommendation = recommend(series, taskCpu, containerMemory, headroom, percent, minCount, maxCount)
+	if currentCount is None:
+		currentCount = observed_task_count(series[CPU_METRIC])
+	print_report(series, recommendation, taskCpu, taskMemory, containerMemory, currentCount)
+	os.makedirs(os.path.dirname(outputFilename) or '.', exist_ok=True)
+	with open(outputFilename, 'w') as outputFile:
+		json.dump(recommendation, outputFile, indent=2)
+	print('Recommendation written to ' + outputFilename)
+	return recommendation
+
+def main(*args):
+	parser = argparse.ArgumentParser(description='Recommend gifmachine Fargate task size and desired count from cSidecar metrics.')
+	subparsers = parser.add_subparsers(dest='command')
+	exportParser = subparsers.add_parser('export', help='record the cSidecar gauges from Prometheus to a file')
+	exportParser.add_argument('prometheusUrl')
+	exportParser.add_argument('outputFilename')
+	exportParser.add_argument('--hours', type=float, default=DEFAULT_EXPORT_HOURS)
+	exportParser.add_argument('--step', type=int, default=DEFAULT_EXPORT_STEP, help='seconds between samples')
+	planParser = subparsers.add_parser('plan', help='recommend a task size and desired count from a metrics file')
+	planParser.add_argument('metricsFilename', help='Prometheus query_range export (e.g. written by export)')
+	planParser.add_argument('--output', default=RECOMMENDATION_FILENAME)
+	planParser.add_argument('--headroom', type=float, default=DEFAULT_HEADROOM, help='fraction of the capacity kept unused')
+	planParser.add_argument('--percentile', type=float, default=DEFAULT_PERCENTILE, help='utilization percentile to size for')
+	planParser.add_argument('--min-count', type=int, default=DEFAULT_MIN_COUNT)
+	planParser.add_argument('--max-count', type=int, default=DEFAULT_MAX_COUNT)
+	planParser.add_argument('--current-count', type=int, help='desired count the metrics were recorded with (default: tasks seen in the metrics)')
+	planParser.add_argument('--template', default=TASKDEF_TEMPLATE, help='task definition the metrics were recorded with')
+	arguments = parser.parse_args(args)
+	if arguments.command == 'export':
+		export_metrics(arguments.prometheusUrl, arguments.outputFilename, arguments.hours, arguments.step)
+	elif arguments.command == 'plan':
+		try:
+			plan(arguments.metricsFilename, arguments.output, arguments.headroom, arguments.percentile, arguments.min_count,
+			     arguments.max_count, arguments.current_count, arguments.template)
+		except ValueError as e:
+			print('ERROR: ' + str(e))
+			sys.exit(1)
+	else:
+		parser.print_help()
+		sys.exit(1)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -3,19 +3,33 @@
 
 import sys
 
-def get_master_aws_config_vars(filename):
+VALID_REGIONS = ['eu-west-1', 'us-east-1']
+MAX_NAME_TAGS_LENGTH = 15
+
+def parse_config_file(filename):
+	# KEY=VALUE lines, parsed in a single pass
+	config = {}
 	with open(filename, 'r') as configFile:
-		for var in configFile:
-			if var != '':
-				if var.split('=')[0] == 'ENVIRONMENT': environment = var.split('=')[1].strip()
-				if var.split('=')[0] == 'COMPANY': company = var.split('=')[1].strip()
-				if var.split('=')[0] == 'AWS_REGION': awsRegion = var.split('=')[1].strip()
+		for line in configFile:
+			if '=' in line and not line.strip().startswith('#'):
+				key, value = line.split('=', 1)
+				config[key.strip()] = value.strip()
+	return config
+
+def config_error(awsRegion, environment, company):
+	# None if the configuration is valid
 	configLength = len(environment)+len(company)
-	if awsRegion != 'eu-west-1' and awsRegion != 'us-east-1':
-		print("ERROR: Invalid AWS Region. Available values are 'eu-west-1' or 'us-east-1'")
-		sys.exit(1)
-	elif configLength > 15:
-		print("ERROR: Length of ENVIRONMENT and COMPANY configuration values too long. Sum of both values must be below of 16 characters (currently " + str(configLength) + ").")
+	if awsRegion not in VALID_REGIONS:
+		return "ERROR: Invalid AWS Region. Available values are 'eu-west-1' or 'us-east-1'"
+	elif configLength > MAX_NAME_TAGS_LENGTH:
+		return "ERROR: Length of ENVIRONMENT and COMPANY configuration values too long. Sum of both values must be below of 16 characters (currently " + str(configLength) + ")."
+	return None
+
+def get_master_aws_config_vars(filename):
+	config = parse_config_file(filename)
+	error = config_error(config.get('AWS_REGION', ''), config.get('ENVIRONMENT', ''), config.get('COMPANY', ''))
+	if error:
+		print(error)
 		sys.exit(1)
 	else:
 		print('VALID!')
@@ -2,275 +2,416 @@
 # Functions to evaluate if it is possible to created needed AWS resources,
 #  i.e., if resources with same names do not already exist.
 
-import boto3
+import argparse
+import itertools
+import os
+import random
 import sys
-from botocore.config import Config
+import time
+from aws_clients import RegionClients, print_client_stats
+from check_aws_config_validity import parse_config_file, config_error
+from preflight_cache import PreflightCache, DEFAULT_TTL, CACHE_FILENAME, load_entries, save_entries
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+
+DEFAULT_MAX_WORKERS = 8
+MAX_THROTTLING_RETRIES = 8
+THROTTLING_BACKOFF_BASE = 0.5 # seconds
+THROTTLING_BACKOFF_CAP = 20 # seconds
+THROTTLING_ERROR_CODES = ['Throttling', 'ThrottlingException', 'ThrottledException', 'RequestLimitExceeded',
+                          'RequestThrottled', 'RequestThrottledException', 'TooManyRequestsException', 'SlowDown']
+# Not regional: looked up once per fleet run, whatever the targets regions
+GLOBAL_RESOURCE_TYPES = ['role', 'instance_profile', 'bucket']
 
 def get_master_aws_config_vars(filename):
-	with open(filename, 'r') as configFile:
-		for var in configFile:
-			if var != '':
-				if var.split('=')[0] == 'AWS_REGION': awsRegion = var.split('=')[1].strip()
-				if var.split('=')[0] == 'ENVIRONMENT': environment = var.split('=')[1].strip()
-				if var.split('=')[0] == 'COMPANY': company = var.split('=')[1].strip()
-	return awsRegion, environment, company
-				
-def check_secret(smClient, secretName):
-	try:
-		smClient.describe_secret(SecretId=secretName)
-		print('  [x] Secret Manager secret "' + secretName + '"')
-		return 1
-	except:
-		print('      Secret Manager secret "' + secretName + '"')
-		return 0
-
-def check_key_pair(ec2Client, keyPairName):
-	try:
-		ec2Client.describe_key_pairs(KeyNames=[keyPairName])
-		print('  [x] EC2 key pair "' + keyPairName + '"')
-		return 1
-	except:
-		print('      EC2 key pair "' + keyPairName + '"')
-		return 0
-
-def check_stack(cfClient, stackName):
-	try:
-		cfClient.describe_stacks(StackName=stackName)
-		print('  [x] Cloud Formation stack "' + stackName + '"')
-		return 1
-	except:
-		print('      Cloud Formation stack "' + stackName + '"')
-		return 0
-
-def check_security_group(ec2Client, sgName):
-	try:
-		ec2Client.describe_security_groups(Filters=[{'Name': 'group-name','Values': [sgName]}])['SecurityGroups'][0]
-		print('  [x] EC2 security group "' + sgName + '"')
-		return 1
-	except:
-		print('      EC2 security group "' + sgName + '"')
-		return 0
-
-def check_role(iamClient, roleName):
-	try:
-		iamClient.get_role(RoleName=roleName)
-		print('  [x] IAM role "' + roleName + '"')
-		return 1
-	except:
-		print('      IAM role "' + roleName + '"')
-		return 0
-
-def check_instance_profile(iamClient, instanceProfileName):
-	try:
-		iamClient.get_instance_profile(InstanceProfileName=instanceProfileName)
-		print('  [x] IAM instance profile "' + instanceProfileName + '"')
-		return 1
-	except:
-		print('      IAM instance profile "' + instanceProfileName + '"')
-		return 0
-
-def check_repository(ecrClient, repositoryName):
-	try:
-		ecrClient.describe_repositories(repositoryNames=[repositoryName])
-		print('  [x] ECR repository "' + repositoryName + '"')
-		return 1
-	except:
-		print('      ECR repository "' + repositoryName + '"')
-		return 0
-
-def check_bucket(s3Client, bucketName):
-	try:
-		s3Client.get_bucket_location(Bucket=bucketName)
-		print('  [x] S3 bucket "' + bucketName + '"')
-		return 1
-	except:
-		print('      S3 bucket "' + bucketName + '"')
-		return 0
-
-def check_load_balancer(lbv2Client, loadbalancerName):
-	try:
-		lbv2Client.describe_load_balancers(Names=[loadbalancerName])
-		print('  [x] EC2 load balancer "' + loadbalancerName + '"')
-		return 1
-	except:
-		print('      EC2 load balancer "' + loadbalancerName + '"')
-		return 0
-
-def check_target_group(lbv2Client, targetGroupName):
-	try:
-		lbv2Client.describe_target_groups(Names=[targetGroupName])
-		print('  [x] EC2 target group "' + targetGroupName + '"')
-		return 1
-	except:
-		print('      EC2 target group "' + targetGroupName + '"')
-		return 0
-
-def check_cluster(ecsClient, clusterName):
-	clusterList=ecsClient.list_clusters(maxResults=100)
-	if len(clusterList['clusterArns']) == 0:
-		print('      ECS cluster "' + clusterName + '"')
-		return 0
-	else:
-		for cluster in clusterList['clusterArns']:
-			if cluster.split('/')[-1] == clusterName and ecsClient.describe_clusters(clusters=[clusterName])['clusters'][0]['status'] == 'ACTIVE':
-				print('  [x] ECS cluster "' + clusterName + '"')
-				return 1
-	print('      ECS cluster "' + clusterName + '"')
-	return 0
-
-def check_service(ecsClient,clusterName, serviceName):
-	try:
-		serviceList = ecsClient.list_services(cluster=clusterName)
-		if len(serviceList['serviceArns']) == 0:
-			print('      ECS service "' + serviceName + '"')
-			return 0
-		else:
-			for service in serviceList['serviceArns']:
-				if service.split('/')[-1] == serviceName and ecsClient.describe_services(cluster=clusterName,services=[serviceName])['services'][0]['status'] == 'ACTIVE':
-					print('  [x] ECS service "' + serviceName + '"')
-					return 1
-		print('      ECS service "' + serviceName + '"')
-		return 0
-	except:
-		print('      ECS service "' + serviceName + '"')
-		return 0
-
-def check_log_group(logsClient, logGroupName):
-	try:
-		logsClient.describe_log_groups(logGroupNamePrefix=logGroupName)['logGroups'][0]
-		print('  [x] CloudWatch log group "' + logGroupName + '"')
-		return 1
-	except:
-		print('      CloudWatch log group "' + logGroupName + '"')
-		return 0
-
-def check_codebuild_project(cbClient, cbProjectName):
-	try:
-		cbClient.batch_get_projects(names=[cbProjectName])['projects'][0]
-		print('  [x] CodeBuild project "' + cbProjectName + '"')
-		return 1
-	except:
-		print('      CodeBuild project "' + cbProjectName + '"')
-		return 0
-
-def check_codedeploy_application(cdClient, applicationName):
-	try:
-		cdClient.get_application(applicationName=applicationName)
-		print('  [x] CodeDeploy application "' + applicationName + '"')
-		return 1
-	except:
-		print('      CodeDeploy application "' + applicationName + '"')
-		return 0
-
-def check_codedeploy_deploymentgroup(cdClient, applicationName, deploymentGroupName):
-	try:
-		cdClient.batch_get_deployment_groups(applicationName=applicationName, deploymentGroupNames=[deploymentGroupName])
-		print('  [x] CodeDeploy deployment group "' + deploymentGroupName + '"')
-		return 1
-	except:
-		print('      CodeDeploy deployment group "' + deploymentGroupName + '"')
-		return 0
-
-def check_codepipeline_pipeline(cpClient, pipelineName):
-	try:
-		cpClient.get_pipeline(name=pipelineName)
-		print('  [x] CodePipeline pipeline "' + pipelineName + '"')
-		return 1
-	except:
-		print('      CodePipeline pipeline "' + pipelineName + '"')
-		return 0
-
-def resource_validator(section):
-	awsRegion, environment, company = get_master_aws_config_vars('config/aws-config.txt')
+	config = parse_config_file(filename)
+	return config['AWS_REGION'], config['ENVIRONMENT'], config['COMPANY']
 
-	clientConfig = Config(region_name = awsRegion)
-
-	smClient = boto3.client('secretsmanager', config=clientConfig)
-	ec2Client = boto3.client('ec2', config=clientConfig)
-	cfClient = boto3.client('cloudformation', config=clientConfig)
-	iamClient = boto3.client('iam', config=clientConfig)
-	ecrClient = boto3.client('ecr', config=clientConfig)
-	s3Client = boto3.client('s3', config=clientConfig)
-	lbv2Client = boto3.client('elbv2', config=clientConfig)
-	wafv2Client = boto3.client('wafv2', config=clientConfig)
-	ecsClient = boto3.client('ecs', config=clientConfig)
-	logsClient = boto3.client('logs', config=clientConfig)
-	cbClient = boto3.client('codebuild', config=clientConfig)
-	cdClient = boto3.client('codedeploy', config=clientConfig)
-	cpClient = boto3.client('codepipeline', config=clientConfig)
+def call_with_backoff(apiCall, **kwargs):
+	# Throttling is not a verdict on the resource, so keep retrying it with
+	#  exponential backoff (and jitter) instead of letting the check fail
+	for attempt in range(MAX_THROTTLING_RETRIES):
+		try:
+			return apiCall(**kwargs)
+		except ClientError as e:
+			if e.response['Error']['Code'] not in THROTTLING_ERROR_CODES or attempt == MAX_THROTTLING_RETRIES-1:
+				raise
+			time.sleep(random.uniform(0.5, 1) * min(THROTTLING_BACKOFF_CAP, THROTTLING_BACKOFF_BASE * 2**attempt))
 
-	notAvailableResources = 0
+def paginate(client, operationName, resultKey, **kwargs):
+	def collect_pages():
+		items = []
+		for page in client.get_paginator(operationName).paginate(**kwargs):
+			items.extend(page.get(resultKey, []))
+		return items
+	return call_with_backoff(collect_pages)
+
+def chunks(items, size):
+	return [items[i:i+size] for i in range(0, len(items), size)]
+
+def resolve_secrets(smClient, secretNames):
+	existing = set()
+	# Secrets pending deletion still block a new secret with the same name
+	for namesChunk in chunks(sorted(secretNames), 10):
+		for secret in paginate(smClient, 'list_secrets', 'SecretList', IncludePlannedDeletion=True,
+		                       Filters=[{'Key': 'name', 'Values': namesChunk}]):
+			existing.add(secret['Name'])
+	return existing
+
+def resolve_key_pairs(ec2Client, keyPairNames):
+	keyPairs = call_with_backoff(ec2Client.describe_key_pairs, Filters=[{'Name': 'key-name', 'Values': sorted(keyPairNames)}])['KeyPairs']
+	return set(keyPair['KeyName'] for keyPair in keyPairs)
+
+def resolve_stacks(cfClient, stackNames):
+	return set(stack['StackName'] for stack in paginate(cfClient, 'describe_stacks', 'Stacks'))
+
+def resolve_security_groups(ec2Client, sgNames):
+	securityGroups = paginate(ec2Client, 'describe_security_groups', 'SecurityGroups', Filters=[{'Name': 'group-name', 'Values': sorted(sgNames)}])
+	return set(sg['GroupName'] for sg in securityGroups)
+
+def resolve_roles(iamClient, roleNames):
+	return set(role['RoleName'] for role in paginate(iamClient, 'list_roles', 'Roles'))
+
+def resolve_instance_profiles(iamClient, instanceProfileNames):
+	return set(profile['InstanceProfileName'] for profile in paginate(iamClient, 'list_instance_profiles', 'InstanceProfiles'))
+
+def resolve_repositories(ecrClient, repositoryNames):
+	return set(repository['repositoryName'] for repository in paginate(ecrClient, 'describe_repositories', 'repositories'))
+
+def resolve_buckets(s3Client, bucketNames):
+	return set(bucket['Name'] for bucket in paginate(s3Client, 'list_buckets', 'Buckets'))
+
+def resolve_load_balancers(lbv2Client, loadbalancerNames):
+	return set(lb['LoadBalancerName'] for lb in paginate(lbv2Client, 'describe_load_balancers', 'LoadBalancers'))
+
+def resolve_target_groups(lbv2Client, targetGroupNames):
+	return set(tg['TargetGroupName'] for tg in paginate(lbv2Client, 'describe_target_groups', 'TargetGroups'))
+
+def resolve_clusters(ecsClient, clusterNames):
+	clusterArns = [arn for arn in paginate(ecsClient, 'list_clusters', 'clusterArns') if arn.split('/')[-1] in clusterNames]
+	existing = set()
+	for arnsChunk in chunks(clusterArns, 100):
+		for cluster in call_with_backoff(ecsClient.describe_clusters, clusters=arnsChunk)['clusters']:
+			if cluster['status'] == 'ACTIVE': existing.add(cluster['clusterName'])
+	return existing
+
+def resolve_services(ecsClient, clusterServiceNames):
+	# Names are (cluster, service) pairs, resolved with one listing per cluster
+	existing = set()
+	for clusterName in set(cluster for cluster, _ in clusterServiceNames):
+		serviceNames = set(service for cluster, service in clusterServiceNames if cluster == clusterName)
+		try:
+			serviceArns = [arn for arn in paginate(ecsClient, 'list_services', 'serviceArns', cluster=clusterName) if arn.split('/')[-1] in serviceNames]
+		except ClientError:
+			continue
+		for arnsChunk in chunks(serviceArns, 10):
+			for service in call_with_backoff(ecsClient.describe_services, cluster=clusterName, services=arnsChunk)['services']:
+				if service['status'] == 'ACTIVE': existing.add((clusterName, service['serviceName']))
+	return existing
+
+def resolve_log_groups(logsClient, logGroupNames):
+	# Log groups are matched by prefix, so one listing under the common prefix covers them all
+	logGroups = paginate(logsClient, 'describe_log_groups', 'logGroups', logGroupNamePrefix=os.path.commonprefix(sorted(logGroupNames)))
+	return set(name for name in logGroupNames if any(logGroup['logGroupName'].startswith(name) for logGroup in logGroups))
+
+def resolve_codebuild_projects(cbClient, cbProjectNames):
+	existing = set()
+	for namesChunk in chunks(sorted(cbProjectNames), 100):
+		existing.update(project['name'] for project in call_with_backoff(cbClient.batch_get_projects, names=namesChunk)['projects'])
+	return existing
+
+def resolve_codedeploy_applications(cdClient, applicationNames):
+	return set(paginate(cdClient, 'list_applications', 'applications'))
+
+def resolve_codedeploy_deploymentgroups(cdClient, applicationDeploymentGroupNames):
+	# Names are (application, deployment group) pairs
+	existing = set()
+	for applicationName in set(application for application, _ in applicationDeploymentGroupNames):
+		try:
+			deploymentGroups = paginate(cdClient, 'list_deployment_groups', 'deploymentGroups', applicationName=applicationName)
+		except ClientError:
+			continue
+		existing.update((applicationName, deploymentGroup) for deploymentGroup in deploymentGroups)
+	return existing & set(applicationDeploymentGroupNames)
+
+def resolve_codepipeline_pipelines(cpClient, pipelineNames):
+	return set(pipeline['name'] for pipeline in paginate(cpClient, 'list_pipelines', 'pipelines'))
+
+# Resource type -> (AWS service, resolver returning which of the requested names exist)
+RESOLVERS = {
+	'secret': ('secretsmanager', resolve_secrets),
+	'key_pair': ('ec2', resolve_key_pairs),
+	'stack': ('cloudformation', resolve_stacks),
+	'security_group': ('ec2', resolve_security_groups),
+	'role': ('iam', resolve_roles),
+	'instance_profile': ('iam', resolve_instance_profiles),
+	'repository': ('ecr', resolve_repositories),
+	'bucket': ('s3', resolve_buckets),
+	'load_balancer': ('elbv2', resolve_load_balancers),
+	'target_group': ('elbv2', resolve_target_groups),
+	'cluster': ('ecs', resolve_clusters),
+	'service': ('ecs', resolve_services),
+	'log_group': ('logs', resolve_log_groups),
+	'codebuild_project': ('codebuild', resolve_codebuild_projects),
+	'codedeploy_application': ('codedeploy', resolve_codedeploy_applications),
+	'codedeploy_deploymentgroup': ('codedeploy', resolve_codedeploy_deploymentgroups),
+	'codepipeline_pipeline': ('codepipeline', resolve_codepipeline_pipelines),
+}
+
+class ResourceIndex:
+	# Coalesces every requested name per resource type and resolves each type
+	#  with a few batched/paginated calls into an in-memory name -> status index
+	def __init__(self, clients):
+		self.clients = clients
+		self.requested = {}
+		self.existing = {}
+		self.failed = set()
+
+	def request(self, resourceType, name):
+		self.requested.setdefault(resourceType, set()).add(name)
+
+	def resolve_type(self, resourceType):
+		service, resolver = RESOLVERS[resourceType]
+		names = self.requested[resourceType]
+		try:
+			return resourceType, resolver(self.clients[service], names) & names
+		except Exception:
+			# Same verdict as the former per-name checks when a lookup fails
+			self.failed.add(resourceType)
+			return resourceType, set()
+
+	def resolve(self, maxWorkers=DEFAULT_MAX_WORKERS):
+		pending = sorted(resourceType for resourceType in self.requested if resourceType not in self.existing)
+		with ThreadPoolExecutor(max_workers=max(1, int(maxWorkers))) as executor:
+			for resourceType, existing in executor.map(self.resolve_type, pending):
+				self.existing[resourceType] = existing
+
+	def exists(self, resourceType, name):
+		return 1 if name in self.existing.get(resourceType, set()) else 0
+
+def print_check_result(description, name, result):
+	if result:
+		print('  [x] ' + description + ' "' + name + '"')
+	else:
+		print('      ' + description + ' "' + name + '"')
+
+def resource_checks(section, prefix):
+	# (description, printed name, resource type, resource key) of every resource a section creates
+	checks = []
 
-	print('Validating AWS resources availability ([x] means NOT available to be created)...')
 	if section == 'all' or section == 'gifmachine':
 		# #### USER INPUT
-		notAvailableResources = notAvailableResources + check_secret(smClient, environment+'-'+company+'-DB_USERNAME')
-		notAvailableResources = notAvailableResources + check_secret(smClient, environment+'-'+company+'-DB_PASSWORD')
-		notAvailableResources = notAvailableResources + check_secret(smClient, environment+'-'+company+'-API_PASSWORD')
+		checks.append(('Secret Manager secret', prefix+'-DB_USERNAME', 'secret', prefix+'-DB_USERNAME'))
+		checks.append(('Secret Manager secret', prefix+'-DB_PASSWORD', 'secret', prefix+'-DB_PASSWORD'))
+		checks.append(('Secret Manager secret', prefix+'-API_PASSWORD', 'secret', prefix+'-API_PASSWORD'))
 
 		# #### ALL
-		notAvailableResources = notAvailableResources + check_bucket(s3Client, environment+'-'+company+'-keys')
-		notAvailableResources = notAvailableResources + check_key_pair(ec2Client, environment+'-'+company+'-jumpbox-key')
-		notAvailableResources = notAvailableResources + check_key_pair(ec2Client, environment+'-'+company+'-natinstance-key')
-		notAvailableResources = notAvailableResources + check_stack(cfClient, environment+'-'+company+'-all-cf')
-		notAvailableResources = notAvailableResources + check_security_group(ec2Client, environment+'-'+company+'-all-jumpbox-sg')
-		notAvailableResources = notAvailableResources + check_security_group(ec2Client, environment+'-'+company+'-all-natinstance-sg')
-		notAvailableResources = notAvailableResources + check_role(iamClient, environment+'-'+company+'-all-jumpbox-role')
-		notAvailableResources = notAvailableResources + check_role(iamClient, environment+'-'+company+'-all-natinstance-role')
-		notAvailableResources = notAvailableResources + check_role(iamClient, environment+'-'+company+'-all-docker-build-role')
-		notAvailableResources = notAvailableResources + check_instance_profile(iamClient, environment+'-'+company+'-all-jumpbox-iprofile')
-		notAvailableResources = notAvailableResources + check_instance_profile(iamClient, environment+'-'+company+'-all-natinstance-iprofile')
+		checks.append(('S3 bucket', prefix+'-keys', 'bucket', prefix+'-keys'))
+		checks.append(('EC2 key pair', prefix+'-jumpbox-key', 'key_pair', prefix+'-jumpbox-key'))
+		checks.append(('EC2 key pair', prefix+'-natinstance-key', 'key_pair', prefix+'-natinstance-key'))
+		checks.append(('Cloud Formation stack', prefix+'-all-cf', 'stack', prefix+'-all-cf'))
+		checks.append(('EC2 security group', prefix+'-all-jumpbox-sg', 'security_group', prefix+'-all-jumpbox-sg'))
+		checks.append(('EC2 security group', prefix+'-all-natinstance-sg', 'security_group', prefix+'-all-natinstance-sg'))
+		checks.append(('IAM role', prefix+'-all-jumpbox-role', 'role', prefix+'-all-jumpbox-role'))
+		checks.append(('IAM role', prefix+'-all-natinstance-role', 'role', prefix+'-all-natinstance-role'))
+		checks.append(('IAM role', prefix+'-all-docker-build-role', 'role', prefix+'-all-docker-build-role'))
+		checks.append(('IAM instance profile', prefix+'-all-jumpbox-iprofile', 'instance_profile', prefix+'-all-jumpbox-iprofile'))
+		checks.append(('IAM instance profile', prefix+'-all-natinstance-iprofile', 'instance_profile', prefix+'-all-natinstance-iprofile'))
 
 		# #### DB
-		notAvailableResources = notAvailableResources + check_key_pair(ec2Client, environment+'-'+company+'-dbinstance-key')
-		notAvailableResources = notAvailableResources + check_stack(cfClient, environment+'-'+company+'-db-cf')
-		notAvailableResources = notAvailableResources + check_security_group(ec2Client, environment+'-'+company+'-db-dbinstance-sg')
-		notAvailableResources = notAvailableResources + check_role(iamClient, environment+'-'+company+'-db-dbinstance-role')
-		notAvailableResources = notAvailableResources + check_instance_profile(iamClient, environment+'-'+company+'-db-dbinstance-iprofile')
+		checks.append(('EC2 key pair', prefix+'-dbinstance-key', 'key_pair', prefix+'-dbinstance-key'))
+		checks.append(('Cloud Formation stack', prefix+'-db-cf', 'stack', prefix+'-db-cf'))
+		checks.append(('EC2 security group', prefix+'-db-dbinstance-sg', 'security_group', prefix+'-db-dbinstance-sg'))
+		checks.append(('IAM role', prefix+'-db-dbinstance-role', 'role', prefix+'-db-dbinstance-role'))
+		checks.append(('IAM instance profile', prefix+'-db-dbinstance-iprofile', 'instance_profile', prefix+'-db-dbinstance-iprofile'))
 
 		## GIFMACHINE
-		notAvailableResources = notAvailableResources + check_key_pair(ec2Client, environment+'-'+company+'-container-key')
-		notAvailableResources = notAvailableResources + check_repository(ecrClient, environment+'-'+company+'-gifmachine')
-		notAvailableResources = notAvailableResources + check_bucket(s3Client, environment+'-'+company+'-gifmachine-deploy-configs')
-		notAvailableResources = notAvailableResources + check_security_group(ec2Client, environment+'-'+company+'-gifmachine-lb-sg')
-		notAvailableResources = notAvailableResources + check_load_balancer(lbv2Client, environment+'-'+company+'-gifmachine-lb')
-		notAvailableResources = notAvailableResources + check_target_group(lbv2Client, environment+'-'+company+'-gifmachine-tg-b')
-		notAvailableResources = notAvailableResources + check_target_group(lbv2Client, environment+'-'+company+'-gifmachine-tg-g')
-		notAvailableResources = notAvailableResources + check_cluster(ecsClient, environment+'-'+company+'-gifmachine-ecs-cluster')
-		notAvailableResources = notAvailableResources + check_role(iamClient, environment+'-'+company+'-gifmachine-ecs-taskexecution-role')
-		notAvailableResources = notAvailableResources + check_security_group(ec2Client, environment+'-'+company+'-gifmachine-ecs-service-sg')
-		notAvailableResources = notAvailableResources + check_log_group(logsClient, '/ecs/'+environment+'-'+company+'-gifmachine-task-log')
-		notAvailableResources = notAvailableResources + check_service(ecsClient, environment+'-'+company+'-gifmachine-ecs-cluster',environment+'-'+company+'-gifmachine-ecs-service')
+		checks.append(('EC2 key pair', prefix+'-container-key', 'key_pair', prefix+'-container-key'))
+		checks.append(('ECR repository', prefix+'-gifmachine', 'repository', prefix+'-gifmachine'))
+		checks.append(('S3 bucket', prefix+'-gifmachine-deploy-configs', 'bucket', prefix+'-gifmachine-deploy-configs'))
+		checks.append(('EC2 security group', prefix+'-gifmachine-lb-sg', 'security_group', prefix+'-gifmachine-lb-sg'))
+		checks.append(('EC2 load balancer', prefix+'-gifmachine-lb', 'load_balancer', prefix+'-gifmachine-lb'))
+		checks.append(('EC2 target group', prefix+'-gifmachine-tg-b', 'target_group', prefix+'-gifmachine-tg-b'))
+		checks.append(('EC2 target group', prefix+'-gifmachine-tg-g', 'target_group', prefix+'-gifmachine-tg-g'))
+		checks.append(('ECS cluster', prefix+'-gifmachine-ecs-cluster', 'cluster', prefix+'-gifmachine-ecs-cluster'))
+		checks.append(('IAM role', prefix+'-gifmachine-ecs-taskexecution-role', 'role', prefix+'-gifmachine-ecs-taskexecution-role'))
+		checks.append(('EC2 security group', prefix+'-gifmachine-ecs-service-sg', 'security_group', prefix+'-gifmachine-ecs-service-sg'))
+		checks.append(('CloudWatch log group', '/ecs/'+prefix+'-gifmachine-task-log', 'log_group', '/ecs/'+prefix+'-gifmachine-task-log'))
+		checks.append(('ECS service', prefix+'-gifmachine-ecs-service', 'service', (prefix+'-gifmachine-ecs-cluster', prefix+'-gifmachine-ecs-service')))
 
 	if section == 'all' or section == 'cicd':
 		### CICD
-		# notAvailableResources = notAvailableResources + check_bucket(s3Client, environment+'-'+company+'-gifmachine-pipeline-artifacts')
-		notAvailableResources = notAvailableResources + check_role(iamClient, environment+'-'+company+'-gifmachine-codebuild-role')
-		notAvailableResources = notAvailableResources + check_codebuild_project(cbClient, environment+'-'+company+'-gifmachine-codebuild')
-		notAvailableResources = notAvailableResources + check_role(iamClient, environment+'-'+company+'-gifmachine-codedeploy-role')
-		notAvailableResources = notAvailableResources + check_codedeploy_application(cdClient, environment+'-'+company+'-gifmachine-codedeploy')
-		notAvailableResources = notAvailableResources + check_role(iamClient, environment+'-'+company+'-gifmachine-codepipeline-role')
-		notAvailableResources = notAvailableResources + check_codedeploy_deploymentgroup(cdClient, environment+'-'+company+'-gifmachine-codedeploy', environment+'-'+company+'-gifmachine-dg')
-		notAvailableResources = notAvailableResources + check_codepipeline_pipeline(cpClient, environment+'-'+company+'-gifmachine-pipeline')
-
+		# checks.append(('S3 bucket', prefix+'-gifmachine-pipeline-artifacts', 'bucket', prefix+'-gifmachine-pipeline-artifacts'))
+		checks.append(('IAM role', prefix+'-gifmachine-codebuild-role', 'role', prefix+'-gifmachine-codebuild-role'))
+		checks.append(('CodeBuild project', prefix+'-gifmachine-codebuild', 'codebuild_project', prefix+'-gifmachine-codebuild'))
+		checks.append(('IAM role', prefix+'-gifmachine-codedeploy-role', 'role', prefix+'-gifmachine-codedeploy-role'))
+		checks.append(('CodeDeploy application', prefix+'-gifmachine-codedeploy', 'codedeploy_application', prefix+'-gifmachine-codedeploy'))
+		checks.append(('IAM role', prefix+'-gifmachine-latencygate-role', 'role', prefix+'-gifmachine-latencygate-role'))
+		checks.append(('IAM role', prefix+'-gifmachine-codepipeline-role', 'role', prefix+'-gifmachine-codepipeline-role'))
+		checks.append(('CodeDeploy deployment group', prefix+'-gifmachine-dg', 'codedeploy_deploymentgroup', (prefix+'-gifmachine-codedeploy', prefix+'-gifmachine-dg')))
+		checks.append(('CodePipeline pipeline', prefix+'-gifmachine-pipeline', 'codepipeline_pipeline', prefix+'-gifmachine-pipeline'))
 
 	if section == 'all' or section == 'monitoring':
 		### MONITORING
-		notAvailableResources = notAvailableResources + check_key_pair(ec2Client, environment+'-'+company+'-monitoring-key')
-		notAvailableResources = notAvailableResources + check_bucket(s3Client, environment+'-'+company+'-monitoring-source')
-		notAvailableResources = notAvailableResources + check_stack(cfClient, environment+'-'+company+'-monitoring-cf')
-	
+		checks.append(('EC2 key pair', prefix+'-monitoring-key', 'key_pair', prefix+'-monitoring-key'))
+		checks.append(('S3 bucket', prefix+'-monitoring-source', 'bucket', prefix+'-monitoring-source'))
+		checks.append(('Cloud Formation stack', prefix+'-monitoring-cf', 'stack', prefix+'-monitoring-cf'))
+	return checks
+
+def region_clients(awsRegion, maxWorkers):
+	# Adaptive retries rate limit each client (i.e., each service) on its own
+	#  when AWS starts throttling, and the pool fits all concurrent lookups.
+	#  Clients are only built for the services the requested checks need
+	return RegionClients(awsRegion, retries = {'mode': 'adaptive', 'max_attempts': 5},
+	                     max_pool_connections = max(10, maxWorkers))
+
+def run_preflight(targets, section, maxWorkers=DEFAULT_MAX_WORKERS, cacheTtl=DEFAULT_TTL, refresh=False):
+	# targets: (awsRegion, environment, company) tuples. Every lookup of every
+	#  target goes to one index per region (one for account-wide resources),
+	#  so a resource type is listed once however many targets need it.
+	#  Returns ({target: [(description, name, result)]}, hits, lookups, resource type lookups)
+	regions = sorted(set(awsRegion for awsRegion, _, _ in targets))
+	clients = dict((awsRegion, region_clients(awsRegion, maxWorkers)) for awsRegion in regions)
+	accounts = dict((awsRegion, call_with_backoff(clients[awsRegion]['sts'].get_caller_identity)['Account']) for awsRegion in regions)
+	indexes = dict((awsRegion, ResourceIndex(clients[awsRegion])) for awsRegion in regions)
+	globalIndex = ResourceIndex(clients[regions[0]])
+	def index_for(awsRegion, resourceType):
+		return globalIndex if resourceType in GLOBAL_RESOURCE_TYPES else indexes[awsRegion]
+
+	# One cache for all targets (entries are scoped per target), saved once
+	cacheEntries = load_entries(CACHE_FILENAME)
+	caches = {}
+	targetChecks = {}
+	cachedResults = {}
+	for target in targets:
+		awsRegion, environment, company = target
+		caches[target] = PreflightCache(accounts[awsRegion], awsRegion, environment, company, ttl=cacheTtl, refresh=refresh, entries=cacheEntries)
+		targetChecks[target] = resource_checks(section, environment+'-'+company)
+		for description, name, resourceType, key in targetChecks[target]:
+			cachedResult = caches[target].get(resourceType, key)
+			if cachedResult is None:
+				index_for(awsRegion, resourceType).request(resourceType, key)
+			else:
+				cachedResults[(target, resourceType, key)] = cachedResult
+	allIndexes = list(indexes.values()) + [globalIndex]
+	with ThreadPoolExecutor(max_workers=len(allIndexes)) as executor:
+		for future in [executor.submit(index.resolve, maxWorkers) for index in allIndexes]:
+			future.result()
+
+	results = {}
+	for target in targets:
+		awsRegion = target[0]
+		results[target] = []
+		# Results follow the order of the checks list, whatever order the
+		#  resource types were resolved in
+		for description, name, resourceType, key in targetChecks[target]:
+			if (target, resourceType, key) in cachedResults:
+				result = cachedResults[(target, resourceType, key)]
+			else:
+				index = index_for(awsRegion, resourceType)
+				result = index.exists(resourceType, key)
+				if resourceType not in index.failed:
+					caches[target].put(resourceType, key, result)
+			results[target].append((description, name, result))
+	save_entries(CACHE_FILENAME, cacheEntries)
+	hits = sum(cache.hits for cache in caches.values())
+	lookups = sum(cache.hits + cache.misses for cache in caches.values())
+	return results, hits, lookups, sum(len(index.requested) for index in allIndexes)
+
+def resource_validator(section, maxWorkers=DEFAULT_MAX_WORKERS, cacheTtl=DEFAULT_TTL, refresh=False):
+	awsRegion, environment, company = get_master_aws_config_vars('config/aws-config.txt')
+	notAvailableResources = 0
+
+	print('Validating AWS resources availability ([x] means NOT available to be created)...')
+	results, hits, lookups, _ = run_preflight([(awsRegion, environment, company)], section, maxWorkers, cacheTtl, refresh)
+	for description, name, result in results[(awsRegion, environment, company)]:
+		print_check_result(description, name, result)
+		notAvailableResources = notAvailableResources + result
+	print('Preflight cache hit rate: ' + str(round(100*hits/lookups if lookups else 0)) + '% (' + str(hits) + '/' + str(lookups) + ' lookups)')
+	print_client_stats()
+
 	if notAvailableResources==0:
 		print('SUCCESS! Resources for ' + section + ' can be created on your AWS account in region '+awsRegion+'!')
 	else:
 		print('\nERROR: ' +str(notAvailableResources)+ ' resources cannot be created since resources with same name already exist in AWS Region '+awsRegion+""":
 To solve this problem please do one of two things:
   - Delete existing resources mentioned above;
-  - Change master config variables "ENVIRONMENT" or "COMPANY" in config/aws-config.txt file to different values.""")
+  - Change master config variables "ENVIRONMENT" or "COMPANY" in config/aws-config.txt file to different values.
+If the resources were just deleted and still show up, run the preflight again with --refresh
+(e.g. 'sh give_me_gifs.sh --refresh') to ignore all cached results.""")
 		sys.exit(1)
 
-def main(section):
-	resource_validator(section)
+def fleet_targets(configFilenames=[], environments=[], companies=[], awsRegions=[]):
+	# (label, (awsRegion, environment, company) or None, error) for config
+	#  files and for every environment/company/region combination
+	targets = []
+	for filename in configFilenames:
+		try:
+			config = parse_config_file(filename)
+			target = (config.get('AWS_REGION', ''), config.get('ENVIRONMENT', ''), config.get('COMPANY', ''))
+			targets.append((filename, target, config_error(*target)))
+		except IOError as e:
+			targets.append((filename, None, 'ERROR: ' + str(e)))
+	for environment, company, awsRegion in itertools.product(environments, companies, awsRegions):
+		target = (awsRegion, environment, company)
+		targets.append((environment+'-'+company+'@'+awsRegion, target, config_error(*target)))
+	return targets
+
+def fleet_validator(targets, section, maxWorkers=DEFAULT_MAX_WORKERS, cacheTtl=DEFAULT_TTL, refresh=False):
+	# targets: as returned by fleet_targets
+	startTime = time.time()
+	validTargets = []
+	for label, target, error in targets:
+		if not error and target not in validTargets: validTargets.append(target)
+	results, hits, lookups, typeLookups = run_preflight(validTargets, section, maxWorkers, cacheTtl, refresh) if validTargets else ({}, 0, 0, 0)
+
+	# Matrix: one row per check (names with the target prefix replaced), one column per target
+	columns = [(target[1]+'-'+target[2], target[0]) for target in validTargets]
+	width = max([14] + [len(name) + 2 for name, awsRegion in columns] + [len(awsRegion) + 2 for name, awsRegion in columns])
+	rows = []
+	for description, name, resourceType, key in resource_checks(section, '{prefix}'):
+		rows.append(description + ' ' + name)
+	rowWidth = max([len(row) for row in rows] + [10]) + 2
+	print('Fleet preflight of ' + section + ' resources ([x] means NOT available to be created):')
+	print(' ' * rowWidth + ''.join(name.ljust(width) for name, awsRegion in columns))
+	print(' ' * rowWidth + ''.join(awsRegion.ljust(width) for name, awsRegion in columns))
+	for i, row in enumerate(rows):
+		print(row.ljust(rowWidth) + ''.join(('[x]' if results[target][i][2] else ' . ').ljust(width) for target in validTargets))
+	conflicts = dict((target, sum(result for _, _, result in results[target])) for target in validTargets)
+	print('RESULT'.ljust(rowWidth) + ''.join(('OK' if not conflicts[target] else str(conflicts[target]) + ' CONFLICTS').ljust(width) for target in validTargets))
+	invalidTargets = [(label, error) for label, target, error in targets if error]
+	if invalidTargets:
+		print('Invalid configurations (not checked):')
+		for label, error in invalidTargets:
+			print('  ' + label + ': ' + error)
+	print(str(len(validTargets)) + ' targets checked with ' + str(typeLookups) + ' resource type lookups (cache hit rate ' +
+	      str(round(100*hits/lookups if lookups else 0)) + '% of ' + str(lookups) + ') in ' + str(round(time.time() - startTime, 1)) + 's wall time')
+	print_client_stats()
+	if invalidTargets or any(conflicts.values()):
+		sys.exit(1)
+
+def comma_list(value):
+	return [item.strip() for item in value.split(',') if item.strip()]
+
+def main(*args):
+	parser = argparse.ArgumentParser(description='Check if gifmachine AWS resources can be created.')
+	parser.add_argument('section', choices=['all', 'gifmachine', 'cicd', 'monitoring'])
+	parser.add_argument('--workers', type=int, default=DEFAULT_MAX_WORKERS, help='maximum concurrent AWS lookups')
+	parser.add_argument('--ttl', type=int, default=DEFAULT_TTL, help='seconds a cached result stays valid')
+	parser.add_argument('--refresh', action='store_true', help='ignore cached results and query AWS again')
+	parser.add_argument('--config', action='append', default=[], help='fleet mode: config file of a target (repeatable)')
+	parser.add_argument('--environments', type=comma_list, default=[], help='fleet mode: ENVIRONMENT values, crossed with --companies and --regions')
+	parser.add_argument('--companies', type=comma_list, default=[], help='fleet mode: COMPANY values')
+	parser.add_argument('--regions', type=comma_list, default=[], help='fleet mode: AWS_REGION values')
+	arguments = parser.parse_args(args)
+	if arguments.environments or arguments.companies or arguments.regions:
+		if not (arguments.environments and arguments.companies and arguments.regions):
+			parser.error('--environments, --companies and --regions go together')
+	if arguments.config or arguments.environments:
+		fleet_validator(fleet_targets(arguments.config, arguments.environments, arguments.companies, arguments.regions),
+		                arguments.section, arguments.workers, arguments.ttl, arguments.refresh)
+	else:
+		resource_validator(arguments.section, arguments.workers, arguments.ttl, arguments.refresh)
 
 if __name__ == '__main__':
     main(*sys.argv[1:])
@@ -0,0 +1,277 @@
+# DEPLOY_GIFMACHINE
+# Gif Machine infrastructure deployment (VPC, jumpbox, NAT instance,
+#  database and gifmachine service) declared as steps with explicit
+#  dependencies, so that independent steps run side by side and a failed
+#  deployment can be resumed.
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+from aws_clients import RegionClients, print_client_stats
+from botocore.exceptions import ClientError
+from check_resources_availability import call_with_backoff, get_master_aws_config_vars
+from get_eta import predicted_eta_string
+from orchestrator import Orchestrator, Step, DEFAULT_MAX_WORKERS
+from phase_timings import predicted_minutes, record_phase, stack_phase
+from stack_waiter import wait_for_stack
+from sync_deploy_configs import sync_files
+import preflight_cache
+import test_gifmachine
+
+STATE_FOLDER = '.gifmachine'
+KEYS_FOLDER = 'keys'
+SSH_OPTIONS = ['-o', 'StrictHostKeyChecking=no', '-o', 'IdentitiesOnly=yes']
+DEPLOY_CONFIG_FILES = [
+	('config/gifmachine-config.txt', 'gifmachine-config.txt'),
+	('docker/build_image.sh', 'docker/build_image.sh'),
+	('docker/Dockerfile', 'docker/Dockerfile'),
+	('docker/build_up.sh', 'docker/build_up.sh'),
+	('docker/start_up.sh', 'docker/start_up.sh'),
+]
+# Typed by the user in give_me_gifs.sh, only read from the environment by create_secrets
+CREDENTIALS = ['DB_USERNAME', 'DB_PASSWORD', 'API_PASSWORD']
+# Stacks left by a previous run that the deployment can build on
+EXISTING_STACK_STATUSES = ['CREATE_COMPLETE', 'UPDATE_COMPLETE', 'UPDATE_ROLLBACK_COMPLETE']
+STACK_POLL_INTERVAL = 15 # seconds, while an operation of a previous run is in progress
+CSIDECAR_FILES = [
+	('monitoring/csidecar/Dockerfile', 'csidecar/Dockerfile'),
+	('monitoring/csidecar/main.go', 'csidecar/main.go'),
+	('monitoring/build_csidecar.sh', 'csidecar/build_csidecar.sh'),
+]
+
+class GifmachineDeployment:
+	def __init__(self, awsRegion, environment, company, clients=None, runCommand=subprocess.check_call):
+		self.awsRegion = awsRegion
+		self.environment = environment
+		self.company = company
+		self.prefix = environment+'-'+company
+		# Clients can be injected (e.g. stubbed ones), otherwise shared ones are created on first use
+		self.clients = clients if clients is not None else RegionClients(awsRegion)
+		self.runCommand = runCommand
+
+	def client(self, service):
+		return self.clients[service]
+
+	def describe_if_exists(self, describe, notFoundCodes, **kwargs):
+		# Every step first looks for what a previous (interrupted) run may have
+		#  created: the description, or None on one of the not found error codes
+		try:
+			return call_with_backoff(describe, **kwargs)
+		except ClientError as e:
+			if e.response['Error']['Code'] in notFoundCodes: return None
+			raise
+
+	def create_bucket(self, bucketName):
+		if self.describe_if_exists(self.client('s3').head_bucket, ['404', 'NoSuchBucket'], Bucket=bucketName) is not None:
+			print('S3 bucket ' + bucketName + ' already exists')
+		elif self.awsRegion == 'us-east-1':
+			self.client('s3').create_bucket(Bucket=bucketName)
+		else:
+			self.client('s3').create_bucket(Bucket=bucketName, CreateBucketConfiguration={'LocationConstraint': self.awsRegion})
+
+	def get_secret(self, name):
+		# Stored credentials (create_secrets keeps the ones of a previous run)
+		return self.client('secretsmanager').get_secret_value(SecretId=self.prefix+'-'+name)['SecretString']
+
+	def create_secrets(self):
+		for name in CREDENTIALS:
+			secretName = self.prefix+'-'+name
+			secret = self.describe_if_exists(self.client('secretsmanager').describe_secret, ['ResourceNotFoundException'], SecretId=secretName)
+			if secret is None:
+				self.client('secretsmanager').create_secret(Name=secretName, SecretString=os.environ[name])
+				continue
+			# Stored by a previous run whose resources may already use it, so it
+			#  keeps its value (even if different credentials were typed this time)
+			print('Secret ' + secretName + ' already exists, keeping its stored value')
+			if 'DeletedDate' in secret:
+				self.client('secretsmanager').restore_secret(SecretId=secretName)
+
+	def create_keys_bucket(self):
+		self.create_bucket(self.prefix+'-keys')
+
+	def create_key_pair(self, keyName):
+		keyPairName = self.prefix+'-'+keyName+'-key'
+		keyFilename = os.path.join(KEYS_FOLDER, keyPairName+'.pem')
+		if self.describe_if_exists(self.client('ec2').describe_key_pairs, ['InvalidKeyPair.NotFound'], KeyNames=[keyPairName]) is not None:
+			# The private key is only returned on creation
+			if not os.path.exists(keyFilename):
+				raise RuntimeError('Key pair ' + keyPairName + ' already exists but ' + keyFilename + ' is missing: restore the file or delete the key pair')
+			print('Key pair ' + keyPairName + ' already exists')
+			return
+		keyMaterial = self.client('ec2').create_key_pair(KeyName=keyPairName)['KeyMaterial']
+		os.makedirs(KEYS_FOLDER, exist_ok=True)
+		with open(keyFilename, 'w') as keyFile:
+			keyFile.write(keyMaterial)
+		os.chmod(keyFilename, 0o600)
+
+	def upload_key(self, keyName):
+		keyFilename = self.prefix+'-'+keyName+'-key.pem'
+		self.client('s3').upload_file(os.path.join(KEYS_FOLDER, keyFilename), self.prefix+'-keys', keyFilename)
+
+	def stack_status(self, fullStackName):
+		# Status once no operation is in progress on the stack, None if it does not exist
+		while True:
+			try:
+				status = call_with_backoff(self.client('cloudformation').describe_stacks, StackName=fullStackName)['Stacks'][0]['StackStatus']
+			except ClientError as e:
+				if 'does not exist' in e.response['Error'].get('Message', ''): return None
+				raise
+			if not status.endswith('_IN_PROGRESS'): return status
+			print('AWS Cloudformation stack ' + fullStackName + ' is ' + status + ', waiting for it...')
+			time.sleep(STACK_POLL_INTERVAL)
+
+	def create_stack(self, stackName, etaMinutes, parameters={}):
+		fullStackName = self.prefix+'-'+stackName+'-cf'
+		status = self.stack_status(fullStackName)
+		if status == 'ROLLBACK_COMPLETE':
+			# A stack whose creation failed can only be deleted
+			print('AWS Cloudformation stack ' + fullStackName + ' is ROLLBACK_COMPLETE, deleting it to create it again...')
+			self.client('cloudformation').delete_stack(StackName=fullStackName)
+			status = self.stack_status(fullStackName)
+		if status in EXISTING_STACK_STATUSES:
+			print('AWS Cloudformation stack ' + fullStackName + ' already exists (' + status + ')')
+			return
+		if status is not None:
+			raise RuntimeError('AWS Cloudformation stack ' + fullStackName + ' is ' + status + ', fix or delete it before deploying again')
+		parameters = dict(parameters, Environment=self.environment, Company=self.company)
+		print('Creating AWS Cloudformation stack ' + fullStackName + '... [ETA: ' + predicted_eta_string(stack_phase(stackName), self.awsRegion, etaMinutes) + ']')
+		expectedMinutes = predicted_minutes(stack_phase(stackName), self.awsRegion, 50) or etaMinutes
+		startTime = time.time()
+		try:
+			with open('infrastructure/'+stackName+'-cf.yaml', 'r') as templateFile:
+				self.client('cloudformation').create_stack(StackName=fullStackName, TemplateBody=templateFile.read(),
+					Capabilities=['CAPABILITY_NAMED_IAM'], Parameters=[{'ParameterKey': key, 'ParameterValue': value} for key, value in parameters.items()])
+			wait_for_stack(self.client('cloudformation'), fullStackName, startTime, expectedMinutes * 60)
+		except Exception:
+			record_phase(stack_phase(stackName), self.awsRegion, startTime, time.time(), False)
+			raise
+		record_phase(stack_phase(stackName), self.awsRegion, startTime, time.time())
+		print('AWS Cloudformation stack ' + fullStackName + ' created!')
+
+	def create_all_stack(self):
+		self.create_stack('all', 4)
+
+	def create_db_stack(self):
+		self.create_stack('db', 4, {'DBUsername': self.get_secret('DB_USERNAME'), 'DBPassword': self.get_secret('DB_PASSWORD')})
+
+	def repository_uri(self):
+		return self.client('ecr').describe_repositories(repositoryNames=[self.prefix+'-gifmachine'])['repositories'][0]['repositoryUri']
+
+	def create_gifmachine_stack(self):
+		self.create_stack('gifmachine', 10, {'ContainerImage': self.repository_uri()+':gifmachine', 'cSidecarImage': self.repository_uri()+':csidecar'})
+
+	def create_ecr_repository(self):
+		if self.describe_if_exists(self.client('ecr').describe_repositories, ['RepositoryNotFoundException'],
+		                           repositoryNames=[self.prefix+'-gifmachine']) is not None:
+			print('ECR repository ' + self.prefix+'-gifmachine already exists')
+			return
+		self.client('ecr').create_repository(repositoryName=self.prefix+'-gifmachine')
+
+	def create_deploy_configs_bucket(self):
+		self.create_bucket(self.prefix+'-gifmachine-deploy-configs')
+		self.client('s3').put_bucket_versioning(Bucket=self.prefix+'-gifmachine-deploy-configs', VersioningConfiguration={'Status': 'Enabled'})
+
+	def upload_files(self, files):
+		sync_files(self.client('s3'), self.prefix+'-gifmachine-deploy-configs', files)
+
+	def upload_deploy_configs(self):
+		self.upload_files(DEPLOY_CONFIG_FILES)
+
+	def upload_csidecar_files(self):
+		self.upload_files(CSIDECAR_FILES)
+
+	def jumpbox_public_ip(self):
+		reservations = self.client('ec2').describe_instances(Filters=[{'Name': 'tag:Name', 'Values': [self.prefix+'-all-jumpbox']},
+		                                                               {'Name': 'instance-state-name', 'Values': ['running']}])['Reservations']
+		return reservations[0]['Instances'][0]['PublicIpAddress']
+
+	def build_in_jumpbox(self, buildScriptKey):
+		buildScript = buildScriptKey.split('/')[-1]
+		remoteCommand = ' \
+			export ENVIRONMENT='+self.environment+'; \
+			export COMPANY='+self.company+'; \
+			export AWS_REGION='+self.awsRegion+'; \
+			aws s3 cp s3://'+self.prefix+'-gifmachine-deploy-configs/'+buildScriptKey+' . --region '+self.awsRegion+'; \
+			sh '+buildScript+' '+self.environment+' '+self.company+' '+self.awsRegion
+		self.runCommand(['ssh'] + SSH_OPTIONS + ['-i', os.path.join(KEYS_FOLDER, self.prefix+'-jumpbox-key.pem'),
+		                'ec2-user@'+self.jumpbox_public_ip(), remoteCommand])
+
+	def build_gifmachine_image(self):
+		self.build_in_jumpbox('docker/build_image.sh')
+
+	def build_csidecar_image(self):
+		self.build_in_jumpbox('csidecar/build_csidecar.sh')
+
+	def gifmachine_url(self):
+		return 'http://' + self.client('elbv2').describe_load_balancers(Names=[self.prefix+'-gifmachine-lb'])['LoadBalancers'][0]['DNSName']
+
+	def run_smoke_test(self):
+		test_gifmachine.test_gifmachine(self.gifmachine_url(), [self.gifmachine_url()+':8080'])
+
+	def steps(self):
+		steps = [
+			Step('create_secrets', self.create_secrets),
+			Step('create_keys_bucket', self.create_keys_bucket),
+			Step('create_ecr_repository', self.create_ecr_repository),
+			Step('create_deploy_configs_bucket', self.create_deploy_configs_bucket),
+		]
+		for keyName in ['jumpbox', 'natinstance', 'dbinstance', 'container']:
+			steps.append(Step('create_key_'+keyName, lambda keyName=keyName: self.create_key_pair(keyName)))
+			steps.append(Step('upload_key_'+keyName, lambda keyName=keyName: self.upload_key(keyName), ['create_keys_bucket', 'create_key_'+keyName]))
+		steps = steps + [
+			Step('create_all_stack', self.create_all_stack, ['create_key_jumpbox', 'create_key_natinstance']),
+			Step('create_db_stack', self.create_db_stack, ['create_all_stack', 'create_key_dbinstance', 'create_secrets']),
+			Step('upload_deploy_configs', self.upload_deploy_configs, ['create_deploy_configs_bucket']),
+			Step('upload_csidecar_files', self.upload_csidecar_files, ['create_deploy_configs_bucket']),
+			# Image build runs the database migrations, the cSidecar one does not need the database
+			Step('build_gifmachine_image', self.build_gifmachine_image, ['create_db_stack', 'create_ecr_repository', 'upload_deploy_configs', 'upload_key_jumpbox']),
+			Step('build_csidecar_image', self.build_csidecar_image, ['create_all_stack', 'create_ecr_repository', 'upload_csidecar_files', 'upload_key_jumpbox']),
+			Step('create_gifmachine_stack', self.create_gifmachine_stack, ['build_gifmachine_image', 'build_csidecar_image', 'upload_key_container', 'upload_key_dbinstance', 'upload_key_natinstance']),
+			Step('test_gifmachine', self.run_smoke_test, ['create_gifmachine_stack']),
+		]
+		return steps
+
+def state_filename(prefix):
+	return os.path.join(STATE_FOLDER, prefix+'-deploy-gifmachine-state.json')
+
+def needs_credentials(resume=False):
+	# True if the run would store the credentials typed by the user
+	awsRegion, environment, company = get_master_aws_config_vars('config/aws-config.txt')
+	steps = GifmachineDeployment(awsRegion, environment, company).steps()
+	return 'create_secrets' in Orchestrator(steps, state_filename(environment+'-'+company)).pending_steps(resume)
+
+def deploy_gifmachine(resume=False, maxWorkers=DEFAULT_MAX_WORKERS, clients=None):
+	awsRegion, environment, company = get_master_aws_config_vars('config/aws-config.txt')
+	deployment = GifmachineDeployment(awsRegion, environment, company, clients)
+	prefix = environment+'-'+company
+	# Everything named below is about to be created, so cached availability results are stale
+	preflight_cache.invalidate([prefix+'-DB_USERNAME', prefix+'-DB_PASSWORD', prefix+'-API_PASSWORD', prefix+'-keys',
+	                            prefix+'-jumpbox-key', prefix+'-natinstance-key', prefix+'-dbinstance-key', prefix+'-container-key',
+	                            prefix+'-all-*', prefix+'-db-*', prefix+'-gifmachine*', '/ecs/'+prefix+'-gifmachine-*'])
+	orchestrator = Orchestrator(deployment.steps(), state_filename(prefix), maxWorkers,
+	                            lambda name, startTime, endTime, succeeded: record_phase(name, awsRegion, startTime, endTime, succeeded))
+	# Resuming skips the credential prompts, fine unless the secrets were never stored
+	missingCredentials = [name for name in CREDENTIALS if not os.environ.get(name)]
+	if missingCredentials and 'create_secrets' in orchestrator.pending_steps(resume):
+		print('ERROR: ' + ', '.join(missingCredentials) + ' not set, but step create_secrets has not completed yet. ' +
+		      'Run "sh give_me_gifs.sh --resume" again to be asked for the credentials.')
+		sys.exit(1)
+	if not orchestrator.run(resume):
+		sys.exit(1)
+	print('GIFMACHINE URL: ' + deployment.gifmachine_url())
+	print_client_stats()
+
+def main(*args):
+	parser = argparse.ArgumentParser(description='Deploy Gif Machine infrastructure.')
+	parser.add_argument('--resume', action='store_true', help='skip the steps a previous run already completed')
+	parser.add_argument('--workers', type=int, default=DEFAULT_MAX_WORKERS, help='maximum steps running at the same time')
+	parser.add_argument('--needs-credentials', action='store_true', help='only exit with 0 if the run would need the credentials typed by the user')
+	arguments = parser.parse_args(args)
+	if arguments.needs_credentials:
+		sys.exit(0 if needs_credentials(arguments.resume) else 1)
+	deploy_gifmachine(arguments.resume, arguments.workers)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -1,12 +1,37 @@
+import argparse
 import sys
 from datetime import datetime, timedelta
+from phase_timings import predicted_minutes
 
-def get_eta(timeDuration):
-	eta=datetime.now()+timedelta(minutes = int(timeDuration))
-	print(eta.strftime("%H:%M"))
+def eta_string(timeDuration):
+	eta=datetime.now()+timedelta(minutes = float(timeDuration))
+	return eta.strftime("%H:%M")
 
-def main(timeDuration):
-	get_eta(timeDuration)
+def predicted_eta_string(phase, awsRegion, fallbackMinutes):
+	# Median of the recorded durations of the phase in the region (with the
+	#  90th percentile as a pessimistic bound), or the fallback constant
+	#  when the phase never ran there
+	expected = predicted_minutes(phase, awsRegion, 50)
+	if expected is None:
+		return eta_string(fallbackMinutes)
+	pessimistic = predicted_minutes(phase, awsRegion, 90)
+	if eta_string(pessimistic) == eta_string(expected):
+		return eta_string(expected)
+	return eta_string(expected) + ', 90% by ' + eta_string(pessimistic)
+
+def get_eta(timeDuration, phase=None, awsRegion=None):
+	if phase:
+		print(predicted_eta_string(phase, awsRegion, timeDuration))
+	else:
+		print(eta_string(timeDuration))
+
+def main(*args):
+	parser = argparse.ArgumentParser(description='Print the estimated time of arrival (HH:MM) of a deployment phase.')
+	parser.add_argument('timeDuration', help='minutes, used when no timings of the phase were recorded')
+	parser.add_argument('--phase', help='recorded phase to predict from (e.g. stack:monitoring)')
+	parser.add_argument('--region', help='AWS region of the recorded timings')
+	arguments = parser.parse_args(args)
+	get_eta(arguments.timeDuration, arguments.phase, arguments.region)
 
 if __name__ == '__main__':
     main(*sys.argv[1:])
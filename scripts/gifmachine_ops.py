@@ -0,0 +1,127 @@
+# GIFMACHINE_OPS
+# Single entry point for the helper scripts used by the give_me_*.sh scripts.
+#  Modules (and so boto3 or requests) are only imported when a subcommand
+#  needs them, and batch mode runs several subcommands in one interpreter.
+
+import argparse
+import importlib
+import os
+import shlex
+import subprocess
+import sys
+import time
+
+ROOT_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+# subcommand: (folder, module, description); each module's main() gets the subcommand arguments
+SUBCOMMANDS = {
+	'validate-config': ('scripts', 'check_aws_config_validity', 'check the master AWS configuration file'),
+	'preflight': ('scripts', 'check_resources_availability', 'check that AWS resources can be created'),
+	'eta': ('scripts', 'get_eta', 'print the estimated end time (HH:MM) of a phase'),
+	'timings': ('scripts', 'phase_timings', 'record a phase run, or report which phases dominate deploy time'),
+	'wait-stack': ('scripts', 'stack_waiter', 'wait for a CloudFormation stack, streaming its events'),
+	'update-stacks': ('scripts', 'stack_updater', 'update existing stacks from the local templates through change sets'),
+	'taskdef': ('cicd', 'update_taskdef_template', 'render the ECS task definition for a deploy'),
+	'logs': ('scripts', 'log_analyzer', 'report the slowest endpoints and tasks from the gifmachine logs'),
+	'capacity': ('scripts', 'capacity_planner', 'recommend the task size and desired count from recorded metrics'),
+	'pipeline': ('cicd', 'create_pipeline', 'create the CodeDeploy deployment group and CodePipeline pipeline'),
+	'smoke-test': ('scripts', 'test_gifmachine', 'test (or benchmark) Gif Machine endpoints'),
+	'grafana-setup': ('monitoring/grafana', 'set_up_grafana', 'add the Prometheus datasource and dashboards to Grafana'),
+}
+# Groups of subcommands the give_me_*.sh scripts run back to back (as one
+#  batch), with the AWS calls replaced by --help so that only the startup
+#  and imports are measured
+BENCHMARK_GROUPS = [
+	['validate-config config/aws-config.txt', 'preflight monitoring --help'],
+	['wait-stack --help', 'timings report'],
+]
+DEFAULT_BENCHMARK_RUNS = 3
+
+def load_subcommand(name):
+	folder, moduleName, _ = SUBCOMMANDS[name]
+	modulePath = os.path.normpath(os.path.join(ROOT_FOLDER, folder))
+	if modulePath not in sys.path:
+		sys.path.insert(0, modulePath)
+	return importlib.import_module(moduleName)
+
+def run_subcommand(name, args):
+	# Returns the exit code the standalone script would have had
+	if name not in SUBCOMMANDS:
+		print("ERROR: Unknown subcommand '" + name + "'. Available subcommands: " + ', '.join(sorted(SUBCOMMANDS)))
+		return 2
+	try:
+		load_subcommand(name).main(*args)
+	except SystemExit as e:
+		if e.code is None or isinstance(e.code, int):
+			return e.code or 0
+		print(e.code)
+		return 1
+	return 0
+
+def run_batch(commands):
+	# Runs the commands in order, stopping at the first one that fails
+	for command in commands:
+		commandArgs = shlex.split(command)
+		if not commandArgs: continue
+		exitCode = run_subcommand(commandArgs[0], commandArgs[1:])
+		if exitCode != 0:
+			print("ERROR: Batch stopped, '" + command + "' exited with code " + str(exitCode))
+			return exitCode
+	return 0
+
+def script_command(command):
+	# How the scripts were invoked before gifmachine-ops: a fresh interpreter running each script
+	commandArgs = shlex.split(command)
+	folder, moduleName, _ = SUBCOMMANDS[commandArgs[0]]
+	return [sys.executable, os.path.join(folder, moduleName+'.py')] + commandArgs[1:]
+
+def timed_run(command):
+	startTime = time.time()
+	subprocess.call(command, cwd=ROOT_FOLDER, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+	return time.time() - startTime
+
+def benchmark_startup(runs=DEFAULT_BENCHMARK_RUNS):
+	# Every group is timed as the scripts used to run it (one python3 per
+	#  script), with one gifmachine-ops call per subcommand, and as the one
+	#  batch the give_me_*.sh scripts run now
+	opsCommand = [sys.executable, os.path.abspath(__file__)]
+	print('Startup benchmark (command groups of the give_me_*.sh scripts, best of ' + str(runs) + ' runs):')
+	print('  %-70s %9s %9s %9s' % ('group', 'scripts', 'ops each', 'batch'))
+	totals = [0.0, 0.0, 0.0]
+	for group in BENCHMARK_GROUPS:
+		times = [sum(min(timed_run(script_command(command)) for _ in range(runs)) for command in group),
+		         sum(min(timed_run(opsCommand + shlex.split(command)) for _ in range(runs)) for command in group),
+		         min(timed_run(opsCommand + ['batch'] + group) for _ in range(runs))]
+		totals = [total + groupTime for total, groupTime in zip(totals, times)]
+		print('  %-70s %8.3fs %8.3fs %8.3fs' % (' + '.join(group), times[0], times[1], times[2]))
+	print('  %-70s %8.3fs %8.3fs %8.3fs' % ('total', totals[0], totals[1], totals[2]))
+	print('Batch vs one interpreter per script: %.1fx faster' % (totals[0] / totals[2]))
+	etaTime = min(timed_run(opsCommand + ['eta', '4']) for _ in range(runs))
+	print('gifmachine-ops eta 4 alone: %.3fs (no boto3 nor requests imported)' % etaTime)
+
+def main(*args):
+	subcommandsHelp = '\n'.join('  %-16s %s' % (name, SUBCOMMANDS[name][2]) for name in SUBCOMMANDS)
+	parser = argparse.ArgumentParser(prog='gifmachine-ops', description='Gif Machine operations helpers.',
+	                                 formatter_class=argparse.RawDescriptionHelpFormatter,
+	                                 epilog='subcommands:\n' + subcommandsHelp + '\n' +
+	                                        '  %-16s %s\n' % ('batch', 'run several quoted subcommands (or "-" to read them from stdin) in order') +
+	                                        '  %-16s %s' % ('benchmark-startup', 'compare startup time with one interpreter per script'))
+	parser.add_argument('--trace-aws', action='store_true', help='profile the AWS API calls and print a summary at exit')
+	parser.add_argument('--trace-file', help='also write every AWS API call to this Chrome trace file')
+	parser.add_argument('subcommand')
+	parser.add_argument('args', nargs=argparse.REMAINDER)
+	arguments = parser.parse_args(args)
+	# Read by aws_clients when the first AWS client is created
+	if arguments.trace_aws: os.environ['GIFMACHINE_AWS_TRACE'] = '1'
+	if arguments.trace_file: os.environ['GIFMACHINE_AWS_TRACE_FILE'] = arguments.trace_file
+	if arguments.subcommand == 'batch':
+		commands = sys.stdin.read().splitlines() if arguments.args == ['-'] else arguments.args
+		sys.exit(run_batch(commands))
+	if arguments.subcommand == 'benchmark-startup':
+		benchmarkParser = argparse.ArgumentParser(prog='gifmachine-ops benchmark-startup')
+		benchmarkParser.add_argument('--runs', type=int, default=DEFAULT_BENCHMARK_RUNS, help='runs per measure (the best one is kept)')
+		benchmark_startup(benchmarkParser.parse_args(arguments.args).runs)
+		return
+	sys.exit(run_subcommand(arguments.subcommand, arguments.args))
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,256 @@
+# LOG_ANALYZER
+# Per endpoint and per task latency of gifmachine requests, from the ECS task
+#  log group (paginated filter_log_events) or from exported log files. Events
+#  are parsed as they stream in and folded into mergeable latency sketches,
+#  kept per hour in a state file together with the position reached, so
+#  memory stays bounded and repeated runs only read new events.
+
+import argparse
+import gzip
+import json
+import math
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+STATE_FILENAME = '.gifmachine/log-analyzer-state.json'
+LOG_STREAM_PREFIX = 'ecs/gifmachine/' # skips the cSidecar streams
+DEFAULT_HOURS = 24
+DEFAULT_TOP = 10
+MIN_REQUESTS = 5 # below this an endpoint or task is not ranked
+STATE_RETENTION_HOURS = 7*24 # the log group keeps 5 days
+MAX_ENDPOINTS = 100 # per hour, further ones are counted as OTHER
+SAVE_EVERY_PAGES = 20
+# Rack CommonLogger (Sinatra): ... [18/Oct/2026:10:00:00 +0000] "GET /history HTTP/1.1" 200 1234 0.0123
+COMMON_LOG = re.compile(r'\[(\d{2}/\w{3}/\d{4}:\d{2}:\d{2}:\d{2} [+-]\d{4})\] "([A-Z]+) (\S+) HTTP/[\d.]+" (\d{3}) \S+ (\d+(?:\.\d+)?)')
+# Rails: 'Started GET "/history" for ...' then 'Completed 200 OK in 12ms (...)'
+RAILS_STARTED = re.compile(r'Started ([A-Z]+) "([^"]+)"')
+RAILS_COMPLETED = re.compile(r'Completed (\d{3}) .*?in (\d+(?:\.\d+)?)ms')
+# CloudWatch export to S3 lines: '2026-10-18T10:00:00.000Z message'
+EXPORT_LINE = re.compile(r'^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d+)?Z) (.*)$')
+ID_SEGMENT = re.compile(r'^(\d+|[0-9a-fA-F-]{16,})$')
+
+class LatencySketch:
+	# Log-bucketed histogram: quantiles are within RELATIVE_ACCURACY of the
+	#  exact ones, its size only grows with the latency range (not with the
+	#  number of requests), and two sketches merge by adding their buckets
+	RELATIVE_ACCURACY = 0.01
+	GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+	MIN_SECONDS = 1e-4 # smaller latencies share the first bucket
+
+	def __init__(self, buckets=None, count=0, errors=0, maxSeconds=0.0):
+		self.buckets = buckets if buckets is not None else {}
+		self.count = count
+		self.errors = errors
+		self.maxSeconds = maxSeconds
+
+	def add(self, seconds, failed=False):
+		key = int(math.ceil(math.log(max(seconds, self.MIN_SECONDS)) / math.log(self.GAMMA)))
+		self.buckets[key] = self.buckets.get(key, 0) + 1
+		self.count = self.count + 1
+		self.errors = self.errors + (1 if failed else 0)
+		self.maxSeconds = max(self.maxSeconds, seconds)
+
+	def merge(self, other):
+		for key, count in other.buckets.items():
+			self.buckets[key] = self.buckets.get(key, 0) + count
+		self.count = self.count + other.count
+		self.errors = self.errors + other.errors
+		self.maxSeconds = max(self.maxSeconds, other.maxSeconds)
+		return self
+
+	def quantile(self, q):
+		if not self.count: return None
+		rank = q * (self.count - 1)
+		seen = 0
+		for key in sorted(self.buckets):
+			seen = seen + self.buckets[key]
+			if seen > rank:
+				return min(self.maxSeconds, 2 * self.GAMMA**key / (self.GAMMA + 1))
+		return self.maxSeconds
+
+	def to_dict(self):
+		return {'buckets': dict((str(key), count) for key, count in self.buckets.items()), 'count': self.count,
+		        'errors': self.errors, 'max': self.maxSeconds}
+
+	@classmethod
+	def from_dict(cls, content):
+		return cls(dict((int(key), count) for key, count in content['buckets'].items()), content['count'], content['errors'], content['max'])
+
+def normalize_path(path):
+	# Query strings and ids would make every request its own endpoint
+	segments = path.split('?', 1)[0].split('/')
+	return '/'.join(':id' if ID_SEGMENT.match(segment) else segment for segment in segments) or '/'
+
+class RequestParser:
+	# Incremental: Rails requests span two lines, so the last started request
+	#  of each task is remembered (one entry per task)
+	def __init__(self):
+		self.startedRequests = {}
+
+	def parse(self, task, message):
+		# Returns (endpoint, seconds, status, timestamp or None), or None
+		match = COMMON_LOG.search(message)
+		if match:
+			logTime, method, path, status, seconds = match.groups()
+			timestamp = datetime.strptime(logTime, '%d/%b/%Y:%H:%M:%S %z').timestamp()
+			return method+' '+normalize_path(path), float(seconds), int(status), timestamp
+		match = RAILS_STARTED.search(message)
+		if match:
+			self.startedRequests[task] = match.group(1)+' '+normalize_path(match.group(2))
+			return None
+		match = RAILS_COMPLETED.search(message)
+		if match and task in self.startedRequests:
+			return self.startedRequests.pop(task), float(match.group(2)) / 1000, int(match.group(1)), None
+		return None
+
+class LogAnalyzer:
+	def __init__(self, stateFilename=STATE_FILENAME, reset=False):
+		self.stateFilename = stateFilename
+		self.state = {'sources': {}, 'hours': {}}
+		if not reset and os.path.exists(stateFilename):
+			with open(stateFilename, 'r') as stateFile:
+				self.state = json.load(stateFile)
+		self.hours = {}
+		for hour, groups in self.state['hours'].items():
+			self.hours[int(hour)] = dict((group, dict((name, LatencySketch.from_dict(sketch)) for name, sketch in sketches.items()))
+			                             for group, sketches in groups.items())
+		self.parser = RequestParser()
+		self.newRequests = 0
+
+	def position(self, source):
+		return self.state['sources'].get(source)
+
+	def add_request(self, task, endpoint, seconds, status, timestamp):
+		hour = int(timestamp // 3600 * 3600)
+		sketches = self.hours.setdefault(hour, {'endpoints': {}, 'tasks': {}})
+		if endpoint not in sketches['endpoints'] and len(sketches['endpoints']) >= MAX_ENDPOINTS:
+			endpoint = 'OTHER'
+		for group, name in [('endpoints', endpoint), ('tasks', task)]:
+			sketches[group].setdefault(name, LatencySketch()).add(seconds, status >= 500)
+		self.newRequests = self.newRequests + 1
+
+	def add_message(self, task, message, timestamp):
+		request = self.parser.parse(task, message)
+		if request:
+			endpoint, seconds, status, logTimestamp = request
+			self.add_request(task, endpoint, seconds, status, logTimestamp or timestamp)
+
+	def save(self, source, position):
+		self.state['sources'][source] = position
+		oldestHour = time.time() - STATE_RETENTION_HOURS*3600
+		self.hours = dict((hour, sketches) for hour, sketches in self.hours.items() if hour >= oldestHour)
+		self.state['hours'] = dict((str(hour), dict((group, dict((name, sketch.to_dict()) for name, sketch in sketches.items()))
+		                                            for group, sketches in groups.items())) for hour, groups in self.hours.items())
+		os.makedirs(os.path.dirname(self.stateFilename) or '.', exist_ok=True)
+		with open(self.stateFilename + '.tmp', 'w') as stateFile:
+			json.dump(self.state, stateFile)
+		os.replace(self.stateFilename + '.tmp', self.stateFilename)
+
+	def read_log_group(self, logsClient, logGroupName, hours=DEFAULT_HOURS):
+		# Resume token: the last event timestamp read and the ids of the events
+		#  at that millisecond (later events there would otherwise be missed)
+		source = 'logs:' + logGroupName
+		position = self.position(source) or {'timestamp': int(1000 * (time.time() - hours*3600)), 'eventIds': []}
+		seenIds = set(position['eventIds'])
+		pages = 0
+		paginator = logsClient.get_paginator('filter_log_events')
+		for page in paginator.paginate(logGroupName=logGroupName, logStreamNamePrefix=LOG_STREAM_PREFIX, startTime=position['timestamp']):
+			for event in page['events']:
+				if event['eventId'] in seenIds: continue
+				self.add_message(event['logStreamName'].split('/')[-1], event['message'], event['timestamp'] / 1000.0)
+				if event['timestamp'] > position['timestamp']:
+					position = {'timestamp': event['timestamp'], 'eventIds': []}
+					seenIds = set()
+				if event['timestamp'] == position['timestamp']:
+					position['eventIds'].append(event['eventId'])
+			pages = pages + 1
+			if pages % SAVE_EVERY_PAGES == 0:
+				self.save(source, position)
+		self.save(source, position)
+
+	def read_file(self, filename):
+		# Lines are raw log lines, CloudWatch S3 export lines, or JSON events
+		#  (e.g. 'aws logs filter-log-events ... | jq -c .events[]'), optionally
+		#  gzipped; the byte offset reached is the resume token
+		source = 'file:' + os.path.abspath(filename)
+		position = self.position(source) or {'offset': 0, 'size': 0}
+		size = os.path.getsize(filename)
+		if size < position['size']:
+			position = {'offset': 0, 'size': 0} # rotated or replaced
+		fileTime = os.path.getmtime(filename)
+		task = os.path.basename(filename)
+		openFile = gzip.open if filename.endswith('.gz') else open
+		with openFile(filename, 'rb') as logFile:
+			logFile.seek(position['offset'])
+			offset = position['offset']
+			for rawLine in logFile:
+				if not rawLine.endswith(b'\n'): break # still being written
+				offset = offset + len(rawLine)
+				line = rawLine.decode('utf-8', 'replace').rstrip('\n')
+				if line.startswith('{'):
+					event = json.loads(line)
+					self.add_message(event.get('logStreamName', task).split('/')[-1], event.get('message', ''), event.get('timestamp', fileTime*1000) / 1000.0)
+					continue
+				match = EXPORT_LINE.match(line)
+				if match:
+					self.add_message(task, match.group(2), datetime.strptime(match.group(1)[:19]+'+0000', '%Y-%m-%dT%H:%M:%S%z').timestamp())
+				else:
+					self.add_message(task, line, fileTime)
+		self.save(source, {'offset': offset, 'size': size})
+
+	def window_sketches(self, group, hours=DEFAULT_HOURS):
+		# Merged over the hours of the window
+		oldestHour = (time.time() - hours*3600) // 3600 * 3600
+		merged = {}
+		for hour, sketches in self.hours.items():
+			if hour >= oldestHour:
+				for name, sketch in sketches[group].items():
+					merged.setdefault(name, LatencySketch()).merge(sketch)
+		return merged
+
+	def report(self, hours=DEFAULT_HOURS, top=DEFAULT_TOP):
+		print(str(self.newRequests) + ' new requests read. Slowest over the last ' + str(hours) + 'h (by p99, at least ' +
+		      str(MIN_REQUESTS) + ' requests):')
+		for group, title in [('endpoints', 'endpoint'), ('tasks', 'task')]:
+			sketches = [(name, sketch) for name, sketch in self.window_sketches(group, hours).items() if sketch.count >= MIN_REQUESTS]
+			sketches.sort(key=lambda item: -item[1].quantile(0.99))
+			print('  %-40s %8s %9s %9s %9s %7s' % (title, 'requests', 'p50', 'p99', 'max', 'errors'))
+			for name, sketch in sketches[:top]:
+				print('  %-40s %8d %7.0fms %7.0fms %7.0fms %6.1f%%' % (name, sketch.count, 1000*sketch.quantile(0.5), 1000*sketch.quantile(0.99),
+				      1000*sketch.maxSeconds, 100.0*sketch.errors/sketch.count))
+			if not sketches:
+				print('  (no ' + title + ' with enough requests)')
+
+def main(*args):
+	parser = argparse.ArgumentParser(description='Per endpoint and per task latency of gifmachine requests, from its logs.')
+	parser.add_argument('--hours', type=float, default=DEFAULT_HOURS, help='report window (and how far back a first run reads)')
+	parser.add_argument('--top', type=int, default=DEFAULT_TOP, help='endpoints and tasks listed')
+	parser.add_argument('--state', default=STATE_FILENAME, help='sketches and resume positions')
+	parser.add_argument('--reset', action='store_true', help='forget the stored sketches and positions')
+	subparsers = parser.add_subparsers(dest='source')
+	cloudwatchParser = subparsers.add_parser('cloudwatch', help='read the gifmachine ECS task log group')
+	cloudwatchParser.add_argument('environment')
+	cloudwatchParser.add_argument('company')
+	cloudwatchParser.add_argument('awsRegion')
+	filesParser = subparsers.add_parser('files', help='read exported log files')
+	filesParser.add_argument('filenames', nargs='+')
+	arguments = parser.parse_args(args)
+	if arguments.source is None:
+		parser.print_help()
+		sys.exit(1)
+
+	analyzer = LogAnalyzer(arguments.state, arguments.reset)
+	if arguments.source == 'cloudwatch':
+		from aws_clients import get_client
+		logsClient = get_client('logs', arguments.awsRegion, retries = {'mode': 'adaptive', 'max_attempts': 5})
+		analyzer.read_log_group(logsClient, '/ecs/'+arguments.environment+'-'+arguments.company+'-gifmachine-task-log', arguments.hours)
+	else:
+		for filename in arguments.filenames:
+			analyzer.read_file(filename)
+	analyzer.report(arguments.hours, arguments.top)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
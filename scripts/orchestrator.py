@@ -0,0 +1,142 @@
+# ORCHESTRATOR
+# Runs deployment steps on a worker pool following their declared
+#  dependencies, persisting each step completion so that a failed run
+#  resumes where it stopped, and reports the critical path timings.
+
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+DEFAULT_MAX_WORKERS = 4
+
+class Step:
+	def __init__(self, name, function, dependsOn=[]):
+		self.name = name
+		self.function = function
+		self.dependsOn = list(dependsOn)
+
+class Orchestrator:
+	def __init__(self, steps, stateFilename, maxWorkers=DEFAULT_MAX_WORKERS, recordTiming=None):
+		self.steps = dict((step.name, step) for step in steps)
+		self.order = [step.name for step in steps]
+		self.stateFilename = stateFilename
+		self.maxWorkers = maxWorkers
+		# Optional recordTiming(stepName, startTime, endTime, succeeded), called after every step run
+		self.recordTiming = recordTiming
+		self.state = {}
+		self.lock = threading.Lock()
+		self.validate()
+
+	def validate(self):
+		for step in self.steps.values():
+			for dependency in step.dependsOn:
+				if dependency not in self.steps:
+					raise ValueError("Step '" + step.name + "' depends on unknown step '" + dependency + "'")
+		# Kahn's algorithm: every step must be reachable without a cycle
+		remaining = dict((name, set(step.dependsOn)) for name, step in self.steps.items())
+		while remaining:
+			ready = [name for name, dependencies in remaining.items() if not dependencies]
+			if not ready:
+				raise ValueError('Dependency cycle between steps: ' + ', '.join(sorted(remaining)))
+			for name in ready:
+				del remaining[name]
+			for dependencies in remaining.values():
+				dependencies.difference_update(ready)
+
+	def load_state(self):
+		try:
+			with open(self.stateFilename, 'r') as stateFile:
+				return json.load(stateFile)
+		except (IOError, ValueError):
+			return {}
+
+	def pending_steps(self, resume=False):
+		# Steps a run would execute, in declaration order
+		state = self.load_state() if resume else {}
+		return [name for name in self.order if state.get(name, {}).get('status') != 'done']
+
+	def save_state(self):
+		os.makedirs(os.path.dirname(self.stateFilename) or '.', exist_ok=True)
+		with open(self.stateFilename + '.tmp', 'w') as stateFile:
+			json.dump(self.state, stateFile, indent=2)
+		os.replace(self.stateFilename + '.tmp', self.stateFilename)
+
+	def run_step(self, step):
+		print('[START] ' + step.name)
+		startTime = time.time()
+		try:
+			step.function()
+		except (Exception, SystemExit):
+			if self.recordTiming: self.recordTiming(step.name, startTime, time.time(), False)
+			raise
+		endTime = time.time()
+		if self.recordTiming: self.recordTiming(step.name, startTime, endTime, True)
+		with self.lock:
+			self.state[step.name] = {'status': 'done', 'start': startTime, 'end': endTime}
+			self.save_state()
+		print('[DONE]  ' + step.name + ' (' + str(round(endTime - startTime)) + 's)')
+
+	def run(self, resume=False):
+		self.state = self.load_state() if resume else {}
+		self.save_state()
+		done = set(name for name, stepState in self.state.items() if stepState.get('status') == 'done' and name in self.steps)
+		if done:
+			print('Resuming: skipping ' + str(len(done)) + ' steps already done (' + ', '.join(name for name in self.order if name in done) + ')')
+		pending = [name for name in self.order if name not in done]
+		running = {}
+		failedSteps = []
+		runStart = time.time()
+		with ThreadPoolExecutor(max_workers=self.maxWorkers) as executor:
+			while pending or running:
+				# After a failure no new step starts, but running ones may finish
+				if not failedSteps:
+					for name in [name for name in pending if all(dependency in done for dependency in self.steps[name].dependsOn)]:
+						pending.remove(name)
+						running[executor.submit(self.run_step, self.steps[name])] = name
+				if not running:
+					break
+				finished, _ = wait(running, return_when=FIRST_COMPLETED)
+				for future in finished:
+					name = running.pop(future)
+					try:
+						future.result()
+						done.add(name)
+					except (Exception, SystemExit):
+						print('[FAIL]  ' + name)
+						traceback.print_exc()
+						failedSteps.append(name)
+		self.report(time.time() - runStart)
+		if failedSteps:
+			print('ERROR: Steps ' + ', '.join(failedSteps) + ' failed. Fix the problem and re-run with --resume to continue from there.')
+		return not failedSteps
+
+	def critical_path(self):
+		# Longest chain of dependent steps, by recorded step durations
+		finish = {}
+		previous = {}
+		def chain_duration(name):
+			if name not in finish:
+				stepState = self.state.get(name, {})
+				duration = stepState['end'] - stepState['start'] if 'end' in stepState else 0.0
+				dependencies = self.steps[name].dependsOn
+				slowest = max(dependencies, key=chain_duration) if dependencies else None
+				previous[name] = slowest
+				finish[name] = duration + (finish[slowest] if slowest else 0.0)
+			return finish[name]
+		last = max(self.order, key=chain_duration)
+		path = []
+		while last:
+			path.insert(0, last)
+			last = previous[last]
+		return path, finish[path[-1]]
+
+	def report(self, wallTime):
+		durations = dict((name, stepState['end'] - stepState['start']) for name, stepState in self.state.items() if 'end' in stepState)
+		path, pathDuration = self.critical_path()
+		print('Critical path (' + str(round(pathDuration)) + 's):')
+		for name in path:
+			print('  %-32s %6ss' % (name, round(durations.get(name, 0))))
+		print('Wall time of this run: ' + str(round(wallTime)) + 's (steps would take ' + str(round(sum(durations.values()))) + 's one after another)')
@@ -0,0 +1,102 @@
+# PHASE_TIMINGS
+# Records how long each deployment phase (orchestration steps and
+#  CloudFormation stacks) actually took, one JSON line per phase run, so
+#  that ETAs can be predicted from history instead of fixed constants.
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+TIMINGS_FILENAME = '.gifmachine/phase-timings.jsonl'
+STACK_PHASE_PREFIX = 'stack:'
+
+timingsLock = threading.Lock()
+
+def stack_phase(stackName):
+	# e.g. 'all' for the <prefix>-all-cf stack
+	return STACK_PHASE_PREFIX + stackName
+
+def record_phase(phase, awsRegion, startTime, endTime, succeeded=True, filename=TIMINGS_FILENAME):
+	entry = {'phase': phase, 'region': awsRegion, 'start': round(startTime, 1), 'end': round(endTime, 1), 'ok': succeeded}
+	with timingsLock:
+		os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+		with open(filename, 'a') as timingsFile:
+			timingsFile.write(json.dumps(entry, separators=(',', ':')) + '\n')
+
+def load_timings(filename=TIMINGS_FILENAME):
+	timings = []
+	try:
+		with open(filename, 'r') as timingsFile:
+			for line in timingsFile:
+				try:
+					timings.append(json.loads(line))
+				except ValueError:
+					pass # e.g. a line cut by an interrupted run
+	except IOError:
+		pass
+	return timings
+
+def phase_durations(timings, awsRegion=None):
+	# Durations (seconds) of the successful runs, by phase
+	durations = {}
+	for entry in timings:
+		if entry.get('ok') and (awsRegion is None or entry.get('region') == awsRegion):
+			durations.setdefault(entry['phase'], []).append(entry['end'] - entry['start'])
+	return dict((phase, sorted(values)) for phase, values in durations.items())
+
+def percentile(sortedValues, percent):
+	if not sortedValues: return None
+	rank = max(0, int(round(percent / 100.0 * len(sortedValues))) - 1)
+	return sortedValues[min(rank, len(sortedValues)-1)]
+
+def predicted_minutes(phase, awsRegion, percent, filename=TIMINGS_FILENAME):
+	# None when there is no history for this phase in this region
+	durations = phase_durations(load_timings(filename), awsRegion).get(phase)
+	if not durations: return None
+	return percentile(durations, percent) / 60.0
+
+def format_duration(seconds):
+	return '%dm%02ds' % (seconds // 60, seconds % 60)
+
+def print_report(awsRegion=None, filename=TIMINGS_FILENAME):
+	durations = phase_durations(load_timings(filename), awsRegion)
+	if not durations:
+		print('No phase timings recorded yet' + (' for region ' + awsRegion if awsRegion else '') + '.')
+		return
+	# Stacks are created inside steps, so each group is reported on its own
+	for title, phases in [('Deployment steps', [phase for phase in durations if not phase.startswith(STACK_PHASE_PREFIX)]),
+	                      ('CloudFormation stacks', [phase for phase in durations if phase.startswith(STACK_PHASE_PREFIX)])]:
+		if not phases: continue
+		total = sum(percentile(durations[phase], 50) for phase in phases)
+		print(title + (' (' + awsRegion + ')' if awsRegion else '') + ':')
+		print('  %-32s %5s %8s %8s %8s %6s' % ('phase', 'runs', 'p50', 'p90', 'max', 'share'))
+		for phase in sorted(phases, key=lambda phase: percentile(durations[phase], 50), reverse=True):
+			values = durations[phase]
+			print('  %-32s %5d %8s %8s %8s %5.0f%%' % (phase, len(values), format_duration(percentile(values, 50)),
+			      format_duration(percentile(values, 90)), format_duration(values[-1]), 100.0 * percentile(values, 50) / total if total else 0))
+
+def main(*args):
+	parser = argparse.ArgumentParser(description='Record and report deployment phase timings.')
+	subparsers = parser.add_subparsers(dest='command')
+	recordParser = subparsers.add_parser('record', help='record a phase run (start and end as epoch seconds)')
+	recordParser.add_argument('phase')
+	recordParser.add_argument('region')
+	recordParser.add_argument('start', type=float)
+	recordParser.add_argument('end', type=float, nargs='?', help='defaults to now')
+	recordParser.add_argument('--failed', action='store_true', help='the phase failed (kept out of ETA predictions)')
+	reportParser = subparsers.add_parser('report', help='show which phases dominate deploy time')
+	reportParser.add_argument('--region', help='only runs in this AWS region')
+	arguments = parser.parse_args(args)
+	if arguments.command == 'record':
+		record_phase(arguments.phase, arguments.region, arguments.start, arguments.end or time.time(), not arguments.failed)
+	elif arguments.command == 'report':
+		print_report(arguments.region)
+	else:
+		parser.print_help()
+		sys.exit(1)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
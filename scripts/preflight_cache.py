@@ -0,0 +1,77 @@
+# PREFLIGHT_CACHE
+# On-disk cache of AWS resources existence results, so repeated preflights
+#  (e.g. retrying give_me_*.sh within minutes) do not query AWS again.
+#  Only available (not existing) resources are cached: a conflict is looked
+#  up again on every run, so deleting it is seen by the next preflight.
+
+import fnmatch
+import json
+import os
+import sys
+import time
+
+CACHE_FILENAME = '.gifmachine/preflight-cache.json'
+DEFAULT_TTL = 600 # seconds
+
+class PreflightCache:
+	def __init__(self, account, awsRegion, environment, company, ttl=DEFAULT_TTL, refresh=False, filename=CACHE_FILENAME, entries=None):
+		self.scope = [account, awsRegion, environment, company]
+		self.ttl = ttl
+		self.refresh = refresh
+		# Caches of several targets share the loaded entries, which their owner saves once with save_entries
+		self.entries = entries if entries is not None else load_entries(filename)
+		self.hits = 0
+		self.misses = 0
+
+	def entry_key(self, resourceType, name):
+		names = list(name) if isinstance(name, tuple) else [name]
+		return '|'.join(self.scope + [resourceType] + names)
+
+	def get(self, resourceType, name):
+		entry = None if self.refresh else self.entries.get(self.entry_key(resourceType, name))
+		if entry is None or entry['exists'] or time.time() - entry['checkedAt'] > self.ttl:
+			self.misses = self.misses + 1
+			return None
+		self.hits = self.hits + 1
+		return entry['exists']
+
+	def put(self, resourceType, name, exists):
+		if exists:
+			self.entries.pop(self.entry_key(resourceType, name), None)
+			return
+		names = list(name) if isinstance(name, tuple) else [name]
+		self.entries[self.entry_key(resourceType, name)] = {'names': names, 'exists': exists, 'checkedAt': time.time()}
+
+def load_entries(filename):
+	try:
+		with open(filename, 'r') as cacheFile:
+			return json.load(cacheFile)
+	except (IOError, ValueError):
+		return {}
+
+def save_entries(filename, entries):
+	os.makedirs(os.path.dirname(filename), exist_ok=True)
+	# Written aside and renamed, so an interrupted run never leaves a corrupt cache
+	with open(filename + '.tmp', 'w') as cacheFile:
+		json.dump(entries, cacheFile)
+	os.replace(filename + '.tmp', filename)
+
+def invalidate(namePatterns, filename=CACHE_FILENAME):
+	entries = load_entries(filename)
+	staleKeys = [key for key, entry in entries.items()
+	             if any(fnmatch.fnmatchcase(name, pattern) for name in entry['names'] for pattern in namePatterns)]
+	for key in staleKeys:
+		del entries[key]
+	if staleKeys:
+		save_entries(filename, entries)
+	return len(staleKeys)
+
+def main(command, *namePatterns):
+	if command == 'invalidate':
+		invalidate(namePatterns)
+	else:
+		print("ERROR: Unknown command '" + command + "'. Available commands are 'invalidate'")
+		sys.exit(1)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
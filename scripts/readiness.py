@@ -0,0 +1,86 @@
+# READINESS
+# Waits for one or more HTTP services (e.g. Gif Machine listeners, Grafana,
+#  Prometheus) to be ready, with backoff, an overall deadline and keep-alive
+#  connections, and reports how long each one took to come up.
+
+import argparse
+import random
+import sys
+import requests
+import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+NOT_READY_EXIT_CODE = 3
+DEFAULT_DEADLINE = 900 # seconds
+DEFAULT_TIMEOUT = 2 # seconds, per probe
+BACKOFF_BASE = 1 # seconds
+BACKOFF_CAP = 30 # seconds
+
+class ProbeResult:
+	def __init__(self, url, ready, timeToReady, attempts, lastError):
+		self.url = url
+		self.ready = ready
+		self.timeToReady = timeToReady
+		self.attempts = attempts
+		self.lastError = lastError
+
+def is_ready(response, expectedStatus, expectedContent):
+	if response.status_code not in expectedStatus:
+		return False, 'status code ' + str(response.status_code)
+	if expectedContent and expectedContent not in response.text:
+		return False, "response without '" + expectedContent + "'"
+	return True, None
+
+def probe_until_ready(url, deadline, expectedStatus=(200,), expectedContent=None, timeout=DEFAULT_TIMEOUT):
+	# Deadline is an absolute time.time() value shared by all probed urls
+	session = requests.Session()
+	session.mount(url, HTTPAdapter(pool_connections=1, pool_maxsize=1))
+	startTime = time.time()
+	attempts = 0
+	lastError = None
+	while True:
+		attempts = attempts + 1
+		try:
+			ready, lastError = is_ready(session.get(url, timeout=min(timeout, max(0.1, deadline - time.time()))), expectedStatus, expectedContent)
+			if ready:
+				return ProbeResult(url, True, time.time() - startTime, attempts, None)
+		except requests.RequestException as e:
+			lastError = type(e).__name__
+		# Full jitter exponential backoff, never sleeping past the deadline
+		backoff = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**min(attempts, 16)))
+		if time.time() + backoff >= deadline:
+			return ProbeResult(url, False, time.time() - startTime, attempts, lastError)
+		time.sleep(backoff)
+
+def wait_until_ready(urls, deadlineIn=DEFAULT_DEADLINE, expectedStatus=(200,), expectedContent=None, timeout=DEFAULT_TIMEOUT):
+	deadline = time.time() + deadlineIn
+	with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+		futures = [executor.submit(probe_until_ready, url, deadline, expectedStatus, expectedContent, timeout) for url in urls]
+		return [future.result() for future in futures]
+
+def report(results):
+	for result in results:
+		if result.ready:
+			print('> ' + result.url + ' ready after ' + str(round(result.timeToReady, 1)) + 's (' + str(result.attempts) + ' attempts)')
+		else:
+			print('> ' + result.url + ' NOT ready after ' + str(round(result.timeToReady, 1)) + 's (' + str(result.attempts) + ' attempts, last error: ' + str(result.lastError) + ')')
+	return all(result.ready for result in results)
+
+def wait_or_exit(urls, deadlineIn=DEFAULT_DEADLINE, expectedStatus=(200,), expectedContent=None, timeout=DEFAULT_TIMEOUT):
+	if not report(wait_until_ready(urls, deadlineIn, expectedStatus, expectedContent, timeout)):
+		print('ERROR: Deadline of ' + str(deadlineIn) + 's exceeded while waiting for services to be ready.')
+		sys.exit(NOT_READY_EXIT_CODE)
+
+def main(*args):
+	parser = argparse.ArgumentParser(description='Wait for HTTP services to be ready.')
+	parser.add_argument('urls', nargs='+')
+	parser.add_argument('--deadline', type=float, default=DEFAULT_DEADLINE, help='overall seconds to wait for all urls')
+	parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help='seconds to wait for each probe')
+	parser.add_argument('--status', type=int, nargs='+', default=[200], help='status codes considered ready')
+	parser.add_argument('--contains', help='text the response must contain to be considered ready')
+	arguments = parser.parse_args(args)
+	wait_or_exit(arguments.urls, arguments.deadline, tuple(arguments.status), arguments.contains, arguments.timeout)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
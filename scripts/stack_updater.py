@@ -0,0 +1,200 @@
+# STACK_UPDATER
+# Incremental updates of existing stacks from the local templates: a change
+#  set is created for every stack (with the parameters it already has), the
+#  resources each one would add, modify, remove or replace are summarized,
+#  empty change sets are dropped, and the others are executed one stack at a
+#  time in dependency order. Template tweaks take minutes instead of a full
+#  rebuild.
+
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError, WaiterError
+from aws_clients import get_client
+from check_resources_availability import call_with_backoff, get_master_aws_config_vars
+from phase_timings import predicted_minutes, record_phase, stack_phase
+from stack_waiter import StackFailed, wait_for_stack
+
+# Dependency order: later stacks import values exported by earlier ones
+STACK_ORDER = ['all', 'db', 'gifmachine', 'monitoring', 'cicd']
+SECTION_STACKS = {
+	'gifmachine': ['all', 'db', 'gifmachine'],
+	'monitoring': ['monitoring'],
+	'cicd': ['cicd'],
+	'all': STACK_ORDER,
+}
+CHANGE_SET_PREFIX = 'gifmachine-update-'
+# How CloudFormation reports a change set without changes
+EMPTY_CHANGE_SET_REASONS = ["didn't contain changes", 'No updates are to be performed']
+DEFAULT_UPDATE_MINUTES = 5
+# The gifmachine service uses the CODE_DEPLOY deployment controller: its task
+#  definition only changes through CodeDeploy, and CloudFormation fails to update it
+CODE_DEPLOY_STACKS = ['gifmachine']
+
+def stack_name(prefix, stack):
+	return prefix+'-'+stack+'-cf'
+
+def existing_stack(cfClient, stackName):
+	try:
+		return call_with_backoff(cfClient.describe_stacks, StackName=stackName)['Stacks'][0]
+	except ClientError as e:
+		if 'does not exist' in e.response['Error']['Message']:
+			return None
+		raise
+
+def change_set_changes(cfClient, stackName, changeSetName):
+	changes = []
+	nextToken = None
+	while True:
+		kwargs = {'NextToken': nextToken} if nextToken else {}
+		response = call_with_backoff(cfClient.describe_change_set, StackName=stackName, ChangeSetName=changeSetName, **kwargs)
+		changes = changes + [change['ResourceChange'] for change in response['Changes']]
+		nextToken = response.get('NextToken')
+		if not nextToken:
+			return changes
+
+def create_change_set(cfClient, stackName, templateFilename, parameterKeys):
+	# Returns (change set name, [resource changes]), or (None, []) when the
+	#  template and parameters already match the stack
+	changeSetName = CHANGE_SET_PREFIX + str(int(time.time()))
+	with open(templateFilename, 'r') as templateFile:
+		templateBody = templateFile.read()
+	# Parameters removed from the template cannot be passed anymore
+	templateKeys = [parameter['ParameterKey'] for parameter in call_with_backoff(cfClient.get_template_summary, TemplateBody=templateBody)['Parameters']]
+	call_with_backoff(cfClient.create_change_set, StackName=stackName, ChangeSetName=changeSetName, ChangeSetType='UPDATE',
+	                  TemplateBody=templateBody, Capabilities=['CAPABILITY_NAMED_IAM'],
+	                  Parameters=[{'ParameterKey': key, 'UsePreviousValue': True} for key in parameterKeys if key in templateKeys])
+	try:
+		cfClient.get_waiter('change_set_create_complete').wait(StackName=stackName, ChangeSetName=changeSetName,
+		                                                       WaiterConfig={'Delay': 5, 'MaxAttempts': 120})
+	except WaiterError:
+		changeSet = call_with_backoff(cfClient.describe_change_set, StackName=stackName, ChangeSetName=changeSetName)
+		reason = changeSet.get('StatusReason', '')
+		if changeSet['Status'] == 'FAILED' and any(emptyReason in reason for emptyReason in EMPTY_CHANGE_SET_REASONS):
+			call_with_backoff(cfClient.delete_change_set, StackName=stackName, ChangeSetName=changeSetName)
+			return None, []
+		raise StackFailed(stackName + ': change set ' + changeSet['Status'] + ': ' + reason)
+	return changeSetName, change_set_changes(cfClient, stackName, changeSetName)
+
+def is_replacement(change):
+	# 'Conditional' means CloudFormation only knows at update time
+	return change['Action'] == 'Remove' or change.get('Replacement') in ['True', 'Conditional']
+
+def changes_task_definition(change):
+	# The task definition itself, or the one a service runs
+	if change['ResourceType'] == 'AWS::ECS::TaskDefinition':
+		return True
+	return change['ResourceType'] == 'AWS::ECS::Service' and any(detail.get('Target', {}).get('Name') == 'TaskDefinition'
+	                                                             for detail in change.get('Details', []))
+
+def print_changes(stackName, changes):
+	print(stackName + ': ' + str(len(changes)) + ' resource changes')
+	for change in changes:
+		action = change['Action']
+		if action == 'Modify' and change.get('Replacement') in ['True', 'Conditional']:
+			action = 'Replace' if change['Replacement'] == 'True' else 'Replace?'
+		scope = ', '.join(change.get('Scope', []))
+		print('  %-9s %-40s %-36s %s' % (action, change['LogicalResourceId'], change['ResourceType'], scope))
+
+class StackUpdater:
+	def __init__(self, awsRegion, environment, company, cfClient=None):
+		self.awsRegion = awsRegion
+		self.prefix = environment+'-'+company
+		self.cfClient = cfClient if cfClient is not None else get_client('cloudformation', awsRegion)
+
+	def plan_stack(self, stack):
+		# Returns (stack, change set name or None, changes), or None if the stack does not exist
+		name = stack_name(self.prefix, stack)
+		existing = existing_stack(self.cfClient, name)
+		if existing is None:
+			return None
+		if existing['StackStatus'].endswith('_IN_PROGRESS') or existing['StackStatus'] == 'ROLLBACK_COMPLETE':
+			# A stack whose creation rolled back can only be deleted and created again
+			raise StackFailed(name + ' is ' + existing['StackStatus'] + ' and cannot be updated now')
+		parameterKeys = [parameter['ParameterKey'] for parameter in existing.get('Parameters', [])]
+		changeSetName, changes = create_change_set(self.cfClient, name, 'infrastructure/'+stack+'-cf.yaml', parameterKeys)
+		return stack, changeSetName, changes
+
+	def task_definition_changes(self, plans):
+		# Stacks whose change set would change the task definition of a CodeDeploy service
+		return [stack for stack, changeSetName, changes in plans
+		        if stack in CODE_DEPLOY_STACKS and changeSetName is not None and any(changes_task_definition(change) for change in changes)]
+
+	def delete_change_sets(self, pending):
+		for stack, changeSetName, _ in pending:
+			call_with_backoff(self.cfClient.delete_change_set, StackName=stack_name(self.prefix, stack), ChangeSetName=changeSetName)
+
+	def plan(self, stacks):
+		# Change sets are computed side by side; each compares one template with its live stack
+		with ThreadPoolExecutor(max_workers=len(stacks)) as executor:
+			plans = list(executor.map(self.plan_stack, stacks))
+		return [plan for plan in plans if plan is not None]
+
+	def execute(self, stack, changeSetName):
+		name = stack_name(self.prefix, stack)
+		phase = stack_phase(stack+'-update')
+		expectedMinutes = predicted_minutes(phase, self.awsRegion, 50) or DEFAULT_UPDATE_MINUTES
+		startTime = time.time()
+		try:
+			call_with_backoff(self.cfClient.execute_change_set, StackName=name, ChangeSetName=changeSetName)
+			wait_for_stack(self.cfClient, name, startTime, expectedMinutes * 60, 'UPDATE_COMPLETE')
+		except Exception:
+			record_phase(phase, self.awsRegion, startTime, time.time(), False)
+			raise
+		record_phase(phase, self.awsRegion, startTime, time.time())
+		print('AWS Cloudformation stack ' + name + ' updated in ' + str(round((time.time() - startTime) / 60, 1)) + ' minutes!')
+
+	def update(self, section, planOnly=False, allowReplacement=False):
+		# Returns False if nothing was updated because of replacements
+		plans = self.plan(SECTION_STACKS[section])
+		if not plans:
+			print('No ' + section + ' stacks exist in ' + self.awsRegion + ' yet, nothing to update.')
+			return True
+		pending = []
+		for stack, changeSetName, changes in plans:
+			if changeSetName is None:
+				print(stack_name(self.prefix, stack) + ': up to date, skipped')
+				continue
+			print_changes(stack_name(self.prefix, stack), changes)
+			pending.append((stack, changeSetName, changes))
+		# Checked before executing anything, so the stacks are never left half updated
+		codeDeploy = self.task_definition_changes(pending)
+		if codeDeploy:
+			print(('WARNING: ' if planOnly else 'ERROR: ') + ', '.join(stack_name(self.prefix, stack) for stack in codeDeploy) +
+			      ' would change the gifmachine task definition, which CloudFormation cannot update on a CodeDeploy service' +
+			      (', so executing these change sets will be refused.' if planOnly else ', so no stack was updated.') +
+			      ' Task definition changes go through the pipeline (templates/taskdefinition-template.json, deployed by CodeDeploy).')
+			if not planOnly:
+				self.delete_change_sets(pending)
+				return False
+		if planOnly:
+			for stack, changeSetName, _ in pending:
+				print('Change set ' + changeSetName + ' of ' + stack_name(self.prefix, stack) + ' left for review.')
+			return True
+		replacing = [stack for stack, _, changes in pending if any(is_replacement(change) for change in changes)]
+		if replacing and not allowReplacement:
+			print('ERROR: ' + ', '.join(stack_name(self.prefix, stack) for stack in replacing) + ' would replace or remove resources, ' +
+			      'so no stack was updated. Review the changes above and run again with --allow-replacement to apply them.')
+			self.delete_change_sets(pending)
+			return False
+		for stack, changeSetName, _ in pending:
+			self.execute(stack, changeSetName)
+		return True
+
+def main(*args):
+	parser = argparse.ArgumentParser(description='Update existing gifmachine stacks from the local templates through change sets.')
+	parser.add_argument('section', choices=sorted(SECTION_STACKS))
+	parser.add_argument('--plan-only', action='store_true', help='summarize the change sets without executing them')
+	parser.add_argument('--allow-replacement', action='store_true', help='also execute change sets replacing or removing resources')
+	arguments = parser.parse_args(args)
+	awsRegion, environment, company = get_master_aws_config_vars('config/aws-config.txt')
+	try:
+		if not StackUpdater(awsRegion, environment, company).update(arguments.section, arguments.plan_only, arguments.allow_replacement):
+			sys.exit(1)
+	except StackFailed as e:
+		print('ERROR: ' + str(e))
+		sys.exit(1)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,129 @@
+# STACK_WAITER
+# Waits for a CloudFormation stack by tailing its events: only events newer
+#  than the last one seen are read, resource progress is printed as it
+#  happens, and the wait fails on the first *_FAILED event instead of after
+#  the rollback. Polling is fast while events flow or completion is near,
+#  and slows down during long resource creations.
+
+import argparse
+import sys
+import time
+from botocore.exceptions import ClientError
+from datetime import datetime, timedelta, timezone
+from aws_clients import get_client
+from check_resources_availability import call_with_backoff
+from phase_timings import predicted_minutes
+
+MIN_POLL_INTERVAL = 2 # seconds
+MAX_POLL_INTERVAL = 20 # seconds
+POLL_BACKOFF_FACTOR = 1.5
+NEAR_COMPLETION_WINDOW = 60 # seconds before the expected completion
+DEFAULT_TIMEOUT = 3600 # seconds
+STACK_RESOURCE_TYPE = 'AWS::CloudFormation::Stack'
+
+class StackFailed(Exception):
+	pass
+
+class StackWaiter:
+	# cfClient, sleep and clock can be stubbed to replay event sequences
+	def __init__(self, cfClient, stackName, startTime=None, expectedSeconds=None, timeout=DEFAULT_TIMEOUT,
+	             sleep=time.sleep, clock=time.time):
+		self.cfClient = cfClient
+		self.stackName = stackName
+		self.clock = clock
+		self.sleep = sleep
+		# Local start of the wait, for the timeout and the expected duration
+		self.startTime = startTime if startTime is not None else clock()
+		self.since = None
+		self.expectedSeconds = expectedSeconds
+		self.timeout = timeout
+		self.lastEventId = None
+		self.interval = MIN_POLL_INTERVAL
+		self.resourceStatuses = {}
+
+	def operation_start(self):
+		# Events older than the stack's last operation belong to previous ones.
+		#  Its time comes from AWS, as the local clock may be ahead of it
+		try:
+			stack = call_with_backoff(self.cfClient.describe_stacks, StackName=self.stackName)['Stacks'][0]
+		except ClientError:
+			return datetime.fromtimestamp(self.startTime - 1, timezone.utc)
+		return max(stack[key] for key in ['CreationTime', 'LastUpdatedTime', 'DeletionTime'] if key in stack) - timedelta(seconds=1)
+
+	def new_events(self):
+		# describe_stack_events lists the newest events first, so pages are
+		#  read until the last seen event (or the start of the operation) is reached
+		if self.since is None:
+			self.since = self.operation_start()
+		def collect_events():
+			events = []
+			for page in self.cfClient.get_paginator('describe_stack_events').paginate(StackName=self.stackName):
+				for event in page['StackEvents']:
+					if event['EventId'] == self.lastEventId or event['Timestamp'] < self.since:
+						return events
+					events.append(event)
+			return events
+		events = call_with_backoff(collect_events)
+		events.reverse()
+		if events:
+			self.lastEventId = events[-1]['EventId']
+		return events
+
+	def next_interval(self, elapsed, hadNewEvents):
+		if self.expectedSeconds is not None and elapsed >= self.expectedSeconds - NEAR_COMPLETION_WINDOW:
+			return MIN_POLL_INTERVAL
+		if hadNewEvents:
+			self.interval = MIN_POLL_INTERVAL
+		else:
+			self.interval = min(MAX_POLL_INTERVAL, self.interval * POLL_BACKOFF_FACTOR)
+		return self.interval
+
+	def print_event(self, event):
+		if event['ResourceType'] != STACK_RESOURCE_TYPE or event['LogicalResourceId'] != self.stackName:
+			self.resourceStatuses[event['LogicalResourceId']] = event['ResourceStatus']
+		completed = len([status for status in self.resourceStatuses.values() if status.endswith('_COMPLETE')])
+		reason = ' (' + event['ResourceStatusReason'] + ')' if event.get('ResourceStatusReason') else ''
+		print('  %s [%2d/%2d] %-40s %-24s %s%s' % (self.stackName, completed, len(self.resourceStatuses), event['ResourceType'],
+		      event['LogicalResourceId'], event['ResourceStatus'], reason))
+
+	def wait(self, successStatus='CREATE_COMPLETE'):
+		while True:
+			events = self.new_events()
+			for event in events:
+				self.print_event(event)
+				status = event['ResourceStatus']
+				if status.endswith('_FAILED'):
+					raise StackFailed(self.stackName + ': ' + event['LogicalResourceId'] + ' ' + status + ': ' + event.get('ResourceStatusReason', ''))
+				if event['ResourceType'] == STACK_RESOURCE_TYPE and event['LogicalResourceId'] == self.stackName:
+					if status == successStatus:
+						return
+					if 'ROLLBACK' in status:
+						raise StackFailed(self.stackName + ': ' + status)
+			elapsed = self.clock() - self.startTime
+			if elapsed > self.timeout:
+				raise StackFailed(self.stackName + ': not ' + successStatus + ' after ' + str(round(elapsed)) + 's')
+			self.sleep(self.next_interval(elapsed, bool(events)))
+
+def wait_for_stack(cfClient, stackName, startTime=None, expectedSeconds=None, successStatus='CREATE_COMPLETE'):
+	StackWaiter(cfClient, stackName, startTime, expectedSeconds).wait(successStatus)
+
+def main(*args):
+	parser = argparse.ArgumentParser(description='Wait for a CloudFormation stack operation, streaming its events.')
+	parser.add_argument('stackName')
+	parser.add_argument('region')
+	parser.add_argument('--since', type=float, help='epoch seconds when the operation started, for the timeout (default: now)')
+	parser.add_argument('--phase', help='recorded phase (e.g. stack:monitoring) whose median duration is the expected one')
+	parser.add_argument('--expected-minutes', type=float, help='expected duration when the phase has no recorded timings')
+	parser.add_argument('--status', default='CREATE_COMPLETE', help='stack status to wait for')
+	arguments = parser.parse_args(args)
+	expectedMinutes = predicted_minutes(arguments.phase, arguments.region, 50) if arguments.phase else None
+	if expectedMinutes is None: expectedMinutes = arguments.expected_minutes
+	try:
+		wait_for_stack(get_client('cloudformation', arguments.region), arguments.stackName, arguments.since,
+		               expectedMinutes * 60 if expectedMinutes is not None else None, arguments.status)
+	except StackFailed as e:
+		print('ERROR: ' + str(e))
+		sys.exit(1)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
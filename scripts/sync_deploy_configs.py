@@ -0,0 +1,107 @@
+# SYNC_DEPLOY_CONFIGS
+# Incremental upload of deployment files to S3: only files whose content
+#  hash changed are sent (in parallel, over a single client), and reads of
+#  unchanged objects are served from a local cache.
+
+import hashlib
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from aws_clients import get_client
+from botocore.exceptions import ClientError
+
+CACHE_FOLDER = '.gifmachine/s3-cache'
+DEFAULT_MAX_WORKERS = 8
+
+def file_md5(filename):
+	md5 = hashlib.md5()
+	with open(filename, 'rb') as localFile:
+		for block in iter(lambda: localFile.read(1024*1024), b''):
+			md5.update(block)
+	return md5.hexdigest()
+
+def load_json(filename):
+	try:
+		with open(filename, 'r') as jsonFile:
+			return json.load(jsonFile)
+	except (IOError, ValueError):
+		return {}
+
+def save_json(filename, content):
+	os.makedirs(os.path.dirname(filename), exist_ok=True)
+	with open(filename + '.tmp', 'w') as jsonFile:
+		json.dump(content, jsonFile, indent=2)
+	os.replace(filename + '.tmp', filename)
+
+def remote_etags(s3Client, bucketName):
+	etags = {}
+	for page in s3Client.get_paginator('list_objects_v2').paginate(Bucket=bucketName):
+		for s3Object in page.get('Contents', []):
+			etags[s3Object['Key']] = s3Object['ETag'].strip('"')
+	return etags
+
+def sync_files(s3Client, bucketName, files, maxWorkers=DEFAULT_MAX_WORKERS, cacheFolder=CACHE_FOLDER):
+	# files: list of (local filename, object key) pairs
+	manifestFilename = os.path.join(cacheFolder, bucketName + '-manifest.json')
+	manifest = load_json(manifestFilename)
+	etags = remote_etags(s3Client, bucketName)
+	manifestLock = threading.Lock()
+
+	def is_unchanged(key, localMd5):
+		# Single part uploads have the content MD5 as ETag; otherwise (e.g. KMS
+		#  encrypted buckets) rely on the ETag recorded at our last upload
+		if key not in etags: return False
+		recorded = manifest.get(key, {})
+		return etags[key] == localMd5 or (recorded.get('etag') == etags[key] and recorded.get('md5') == localMd5)
+
+	def upload(localFilename, key, localMd5):
+		with open(localFilename, 'rb') as localFile:
+			response = s3Client.put_object(Bucket=bucketName, Key=key, Body=localFile.read())
+		with manifestLock:
+			manifest[key] = {'md5': localMd5, 'etag': response['ETag'].strip('"')}
+		print('> ' + localFilename + ' -> s3://' + bucketName + '/' + key)
+
+	changedFiles = []
+	for localFilename, key in files:
+		localMd5 = file_md5(localFilename)
+		if not is_unchanged(key, localMd5):
+			changedFiles.append((localFilename, key, localMd5))
+	if changedFiles:
+		with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+			for future in [executor.submit(upload, *changedFile) for changedFile in changedFiles]:
+				future.result()
+		save_json(manifestFilename, manifest)
+	print('Synced s3://' + bucketName + ': ' + str(len(changedFiles)) + ' uploaded, ' + str(len(files) - len(changedFiles)) + ' unchanged')
+	return len(changedFiles)
+
+def cached_get_object(s3Client, bucketName, key, cacheFolder=CACHE_FOLDER):
+	# Conditional GET: S3 answers 304 (no transfer) if our cached copy is current
+	cachedFilename = os.path.join(cacheFolder, bucketName, key)
+	cachedEtags = load_json(os.path.join(cacheFolder, bucketName + '-etags.json'))
+	if key in cachedEtags and os.path.exists(cachedFilename):
+		try:
+			s3Object = s3Client.get_object(Bucket=bucketName, Key=key, IfNoneMatch=cachedEtags[key])
+		except ClientError as e:
+			if e.response['Error']['Code'] not in ['304', 'NotModified']:
+				raise
+			with open(cachedFilename, 'rb') as cachedFile:
+				return cachedFile.read()
+	else:
+		s3Object = s3Client.get_object(Bucket=bucketName, Key=key)
+	content = s3Object['Body'].read()
+	os.makedirs(os.path.dirname(cachedFilename), exist_ok=True)
+	with open(cachedFilename, 'wb') as cachedFile:
+		cachedFile.write(content)
+	cachedEtags[key] = s3Object['ETag']
+	save_json(os.path.join(cacheFolder, bucketName + '-etags.json'), cachedEtags)
+	return content
+
+def main(bucketName, awsRegion, *fileMappings):
+	# fileMappings: "local/filename=object/key" items
+	s3Client = get_client('s3', awsRegion)
+	sync_files(s3Client, bucketName, [tuple(fileMapping.split('=', 1)) for fileMapping in fileMappings])
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
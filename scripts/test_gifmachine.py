@@ -1,46 +1,355 @@
 # CHECK_GIFMACHINE
 # Batch of tests to all gif machine's endpoints to check
-#  everything is online.
+#  everything is online, a benchmark mode to load test them, and a probe
+#  mode that keeps measuring them for Prometheus.
 
+import argparse
+import json
+import os
+import random
+import readiness
 import sys
 import requests
+import socket
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from requests.adapters import HTTPAdapter
 
-def test_gifmachine(gifmachineUrl):
+BENCHMARK_ENDPOINTS = {
+	'/': ('GET', '/'),
+	'/history': ('GET', '/history'),
+	'/search': ('GET', '/search?query='),
+	'/gif': ('POST', '/gif'),
+}
+DEFAULT_MIX = '/=1,/history=1,/search=1'
+DEFAULT_DURATION = 30 # seconds
+DEFAULT_CONCURRENCY = 8
+REQUEST_TIMEOUT = 10 # seconds
+PROBE_ENDPOINTS = ['/', '/history', '/search']
+DEFAULT_PROBE_INTERVAL = 15 # seconds between two probes of an endpoint
+DEFAULT_PROBE_PORT = 9101
+PROBE_LATENCY_BUCKETS = [0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10] # seconds
+CDEPOT_HEARTBEAT_INTERVAL = 15 # seconds (cDepot drops targets silent for 30s)
+
+def test_gifmachine(gifmachineUrl, readyUrls=[], deadline=readiness.DEFAULT_DEADLINE):
 	historyEndpoint='/history'
 	searchEndpoint='/search?query='
-	
-	headers = {"Accept": "application/json",
-	           "Content-Type": "application/json"}
 
 	print('Waiting for Gif Machine to be ready...')
-	if check_if_ready(gifmachineUrl,2,1,1):
-		print('Gif Machine ready! Testing...')
-		test_endpoint("/",gifmachineUrl)
-		test_endpoint("/history",gifmachineUrl+historyEndpoint)
-		test_endpoint("/search",gifmachineUrl+searchEndpoint)
-
-def test_endpoint(endpointName, endpointUrl):
-	r=requests.get(endpointUrl)
+	readiness.wait_or_exit([gifmachineUrl] + readyUrls, deadline)
+	print('Gif Machine ready! Testing...')
+	session = requests.Session()
+	test_endpoint(session, "/",gifmachineUrl)
+	test_endpoint(session, "/history",gifmachineUrl+historyEndpoint)
+	test_endpoint(session, "/search",gifmachineUrl+searchEndpoint)
+
+def test_endpoint(session, endpointName, endpointUrl):
+	r=session.get(endpointUrl)
 	if r.status_code == 200:
 		print("> Endpoint " + endpointName + " OK!")
 	else:
 		print("> Endpoint " + endpointName + " NOT OK!")
 
-def check_if_ready(gifmachineUrl, retryIn, timeout, maxRetries):
-	adapter = HTTPAdapter(max_retries=maxRetries)
-	session = requests.Session()
-	session.mount(gifmachineUrl, adapter)
-	while True:
+def parse_mix(mix):
+	weights = {}
+	for item in mix.split(','):
+		endpointName, weight = item.split('=')
+		if endpointName not in BENCHMARK_ENDPOINTS:
+			raise ValueError("Unknown endpoint '" + endpointName + "' in request mix")
+		if float(weight) > 0: weights[endpointName] = float(weight)
+	return weights
+
+def percentile(sortedValues, percent):
+	if not sortedValues: return None
+	rank = max(0, int(round(percent / 100.0 * len(sortedValues))) - 1)
+	return sortedValues[min(rank, len(sortedValues)-1)]
+
+class BenchmarkRun:
+	# Shared state of a benchmark: request schedule (for a target rate) and
+	#  per endpoint results, both guarded by one lock
+	def __init__(self, gifmachineUrl, weights, duration, rate, apiPassword):
+		self.gifmachineUrl = gifmachineUrl.rstrip('/')
+		self.endpointNames = list(weights)
+		self.weights = [weights[endpointName] for endpointName in self.endpointNames]
+		self.duration = duration
+		self.rate = rate
+		self.apiPassword = apiPassword
+		self.lock = threading.Lock()
+		self.sent = 0
+		self.latencies = dict((endpointName, []) for endpointName in self.endpointNames)
+		self.serviceTimes = dict((endpointName, []) for endpointName in self.endpointNames)
+		self.errors = dict((endpointName, 0) for endpointName in self.endpointNames)
+		self.statusCodes = dict((endpointName, {}) for endpointName in self.endpointNames)
+		self.threadLocal = threading.local()
+
+	def session(self):
+		# One keep-alive session per worker thread (sessions are not thread safe)
+		if not hasattr(self.threadLocal, 'session'):
+			self.threadLocal.session = requests.Session()
+			self.threadLocal.session.mount(self.gifmachineUrl, HTTPAdapter(pool_connections=1, pool_maxsize=1))
+		return self.threadLocal.session
+
+	def next_request_time(self):
+		with self.lock:
+			slot = self.sent
+			self.sent = self.sent + 1
+		if self.rate: return self.startTime + slot / self.rate
+		return time.time()
+
+	def send(self, endpointName):
+		method, path = BENCHMARK_ENDPOINTS[endpointName]
+		if method == 'POST':
+			gif = {'url': 'https://media.giphy.com/media/xT5LMHxhOfscxPfIfm/giphy.gif', 'who': 'benchmark',
+			       'meme_top': 'benchmark', 'meme_bottom': str(random.randint(0, 1000000)), 'secret': self.apiPassword}
+			return self.session().post(self.gifmachineUrl+path, data=gif, timeout=REQUEST_TIMEOUT)
+		return self.session().get(self.gifmachineUrl+path, timeout=REQUEST_TIMEOUT)
+
+	def worker(self):
+		while True:
+			requestTime = self.next_request_time()
+			if requestTime >= self.endTime: return
+			delay = requestTime - time.time()
+			if delay > 0: time.sleep(delay)
+			endpointName = random.choices(self.endpointNames, self.weights)[0]
+			requestStart = time.time()
+			try:
+				statusCode = self.send(endpointName).status_code
+				failed = statusCode >= 400
+			except requests.RequestException:
+				statusCode, failed = 'error', True
+			except Exception as e:
+				# Any other failure is an error sample too, not a silently dropped request
+				statusCode, failed = type(e).__name__, True
+			responseTime = time.time()
+			# Latency counts from the scheduled time, so requests sent late because
+			#  the workers fell behind still show the wait (no coordinated omission)
+			latency = responseTime - min(requestTime, requestStart)
+			with self.lock:
+				self.latencies[endpointName].append(latency)
+				self.serviceTimes[endpointName].append(responseTime - requestStart)
+				self.statusCodes[endpointName][str(statusCode)] = self.statusCodes[endpointName].get(str(statusCode), 0) + 1
+				if failed: self.errors[endpointName] = self.errors[endpointName] + 1
+
+	def run(self, concurrency):
+		self.startTime = time.time()
+		self.endTime = self.startTime + self.duration
+		with ThreadPoolExecutor(max_workers=concurrency) as executor:
+			workers = [executor.submit(self.worker) for _ in range(concurrency)]
+		# Raises what a worker died of (outside a request) instead of reporting partial results
+		for worker in workers: worker.result()
+		self.elapsed = time.time() - self.startTime
+
+	def results(self):
+		endpoints = {}
+		for endpointName in self.endpointNames:
+			latencies = sorted(self.latencies[endpointName])
+			serviceTimes = sorted(self.serviceTimes[endpointName])
+			endpoints[endpointName] = {
+				'requests': len(latencies),
+				'errors': self.errors[endpointName],
+				'errorRate': self.errors[endpointName] / len(latencies) if latencies else 0.0,
+				'throughput': len(latencies) / self.elapsed,
+				'statusCodes': self.statusCodes[endpointName],
+				'p50': percentile(latencies, 50),
+				'p90': percentile(latencies, 90),
+				'p99': percentile(latencies, 99),
+				'max': latencies[-1] if latencies else None,
+				'serviceP50': percentile(serviceTimes, 50),
+				'serviceP99': percentile(serviceTimes, 99),
+			}
+		return {'url': self.gifmachineUrl, 'startedAt': self.startTime, 'duration': self.elapsed,
+		        'rate': self.rate, 'endpoints': endpoints}
+
+class ProbeMetrics:
+	# Prometheus histograms (latency and time to first byte) and response
+	#  counter, by endpoint, rendered in the text exposition format
+	def __init__(self, buckets=PROBE_LATENCY_BUCKETS):
+		self.buckets = buckets
+		self.lock = threading.Lock()
+		self.histograms = {'gifmachine_probe_latency_seconds': {}, 'gifmachine_probe_ttfb_seconds': {}}
+		self.responses = {}
+
+	def observe_histogram(self, name, endpointName, value):
+		histogram = self.histograms[name].setdefault(endpointName, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+		for i, bucket in enumerate(self.buckets):
+			if value <= bucket: histogram['buckets'][i] = histogram['buckets'][i] + 1
+		histogram['sum'] = histogram['sum'] + value
+		histogram['count'] = histogram['count'] + 1
+
+	def observe(self, endpointName, statusCode, latency=None, timeToFirstByte=None):
+		with self.lock:
+			key = (endpointName, str(statusCode))
+			self.responses[key] = self.responses.get(key, 0) + 1
+			if latency is not None: self.observe_histogram('gifmachine_probe_latency_seconds', endpointName, latency)
+			if timeToFirstByte is not None: self.observe_histogram('gifmachine_probe_ttfb_seconds', endpointName, timeToFirstByte)
+
+	def render(self):
+		def labels(**values):
+			return '{' + ','.join(key + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+			                      for key, value in values.items()) + '}'
+		lines = []
+		with self.lock:
+			for name, helpText in [('gifmachine_probe_latency_seconds', 'Probe request latency, up to the last byte'),
+			                       ('gifmachine_probe_ttfb_seconds', 'Probe time to first byte (response headers)')]:
+				lines.append('# HELP ' + name + ' ' + helpText)
+				lines.append('# TYPE ' + name + ' histogram')
+				for endpointName, histogram in sorted(self.histograms[name].items()):
+					for bucket, count in zip(self.buckets, histogram['buckets']):
+						lines.append(name + '_bucket' + labels(endpoint=endpointName, le=repr(float(bucket))) + ' ' + str(count))
+					lines.append(name + '_bucket' + labels(endpoint=endpointName, le='+Inf') + ' ' + str(histogram['count']))
+					lines.append(name + '_sum' + labels(endpoint=endpointName) + ' ' + repr(histogram['sum']))
+					lines.append(name + '_count' + labels(endpoint=endpointName) + ' ' + str(histogram['count']))
+			lines.append('# HELP gifmachine_probe_responses_total Probe responses by status code ("error" when no response)')
+			lines.append('# TYPE gifmachine_probe_responses_total counter')
+			for (endpointName, statusCode), count in sorted(self.responses.items()):
+				lines.append('gifmachine_probe_responses_total' + labels(endpoint=endpointName, code=statusCode) + ' ' + str(count))
+		return '\n'.join(lines) + '\n'
+
+class ProbeExporter:
+	# Probes each endpoint at a low rate over one pooled keep-alive session
+	#  and serves the measures on /metrics
+	def __init__(self, gifmachineUrl, endpointNames=PROBE_ENDPOINTS, interval=DEFAULT_PROBE_INTERVAL):
+		self.gifmachineUrl = gifmachineUrl.rstrip('/')
+		self.endpointNames = endpointNames
+		self.interval = interval
+		self.metrics = ProbeMetrics()
+		self.session = requests.Session()
+		self.session.mount(self.gifmachineUrl, HTTPAdapter(pool_connections=1, pool_maxsize=len(endpointNames)))
+		self.stopped = threading.Event()
+
+	def probe(self, endpointName):
+		method, path = BENCHMARK_ENDPOINTS[endpointName]
+		requestStart = time.time()
+		try:
+			# With stream=True the call returns once the response headers are read
+			response = self.session.request(method, self.gifmachineUrl+path, stream=True, timeout=REQUEST_TIMEOUT)
+			timeToFirstByte = time.time() - requestStart
+			response.content
+			self.metrics.observe(endpointName, response.status_code, time.time() - requestStart, timeToFirstByte)
+		except requests.RequestException:
+			self.metrics.observe(endpointName, 'error')
+
+	def probe_loop(self, endpointName):
+		# Endpoints start at random offsets so probes do not come in bursts
+		nextProbe = time.time() + random.uniform(0, self.interval)
+		while not self.stopped.wait(max(0, nextProbe - time.time())):
+			self.probe(endpointName)
+			nextProbe = max(nextProbe + self.interval, time.time())
+
+	def heartbeat_loop(self, cdepotUrl, advertisedAddress, cluster):
+		# Registered like a cSidecar, so Prometheus scrapes the probe through targets.json
+		heartbeat = {'cluster': cluster, 'function': 'gifmachine-probe', 'gitBranch': '', 'taskID': socket.gethostname(),
+		             'localIP': advertisedAddress, 'publicIP': advertisedAddress}
+		while True:
+			try:
+				requests.post(cdepotUrl.rstrip('/')+'/alive', json=heartbeat, timeout=REQUEST_TIMEOUT)
+			except requests.RequestException as e:
+				print('> cDepot heartbeat failed: ' + str(e))
+			if self.stopped.wait(CDEPOT_HEARTBEAT_INTERVAL): return
+
+	def server(self, port):
+		metrics = self.metrics
+		class MetricsHandler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				if self.path.split('?')[0] != '/metrics':
+					self.send_error(404)
+					return
+				body = metrics.render().encode('utf-8')
+				self.send_response(200)
+				self.send_header('Content-Type', 'text/plain; version=0.0.4')
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, format, *args):
+				pass
+		return ThreadingHTTPServer(('', port), MetricsHandler)
+
+	def run(self, port=DEFAULT_PROBE_PORT, cdepotUrl=None, advertisedAddress=None, cluster='synthetic-probe'):
+		threads = [threading.Thread(target=self.probe_loop, args=(endpointName,), daemon=True) for endpointName in self.endpointNames]
+		if cdepotUrl:
+			threads.append(threading.Thread(target=self.heartbeat_loop, daemon=True,
+			                                args=(cdepotUrl, advertisedAddress or socket.gethostbyname(socket.gethostname())+':'+str(port), cluster)))
+		for thread in threads: thread.start()
+		metricsServer = self.server(port)
+		print('Probing ' + ', '.join(self.endpointNames) + ' of ' + self.gifmachineUrl + ' every ' + str(self.interval) + 's, metrics on :' + str(port) + '/metrics' +
+		      (' (registered with cDepot ' + cdepotUrl + ')' if cdepotUrl else ''))
 		try:
-			session.get(gifmachineUrl,timeout=timeout)
-			return True
-		except:
-			time.sleep(retryIn)
+			metricsServer.serve_forever()
+		finally:
+			self.stopped.set()
+			metricsServer.server_close()
+
+def format_ms(value):
+	return '-' if value is None else str(round(value*1000, 1))
 
-def main(gifmachineUrl):
-	test_gifmachine(gifmachineUrl)
+def print_benchmark_report(results, baseline=None):
+	print('%-10s %9s %8s %8s %9s %9s %9s %9s' % ('ENDPOINT', 'REQUESTS', 'RPS', 'ERRORS', 'P50(ms)', 'P90(ms)', 'P99(ms)', 'MAX(ms)'))
+	for endpointName, stats in results['endpoints'].items():
+		print('%-10s %9d %8.1f %7.1f%% %9s %9s %9s %9s' % (endpointName, stats['requests'], stats['throughput'], 100*stats['errorRate'],
+		      format_ms(stats['p50']), format_ms(stats['p90']), format_ms(stats['p99']), format_ms(stats['max'])))
+	if baseline:
+		print('Compared to baseline (' + time.strftime('%Y-%m-%d %H:%M', time.localtime(baseline['startedAt'])) + '):')
+		for endpointName, stats in results['endpoints'].items():
+			baselineStats = baseline['endpoints'].get(endpointName)
+			if not baselineStats or baselineStats['p50'] is None or stats['p50'] is None: continue
+			print('  %-10s p50 %+7.1f%%  p99 %+7.1f%%  rps %+7.1f%%  errors %+.1f pp' % (endpointName,
+			      100*(stats['p50']/baselineStats['p50']-1), 100*(stats['p99']/baselineStats['p99']-1),
+			      100*(stats['throughput']/baselineStats['throughput']-1) if baselineStats['throughput'] else 0.0,
+			      100*(stats['errorRate']-baselineStats['errorRate'])))
+
+def benchmark_gifmachine(gifmachineUrl, mix=DEFAULT_MIX, duration=DEFAULT_DURATION, concurrency=DEFAULT_CONCURRENCY,
+                         rate=None, apiPassword=None, outputFilename=None, baselineFilename=None):
+	weights = parse_mix(mix)
+	if '/gif' in weights and not apiPassword:
+		print("ERROR: Endpoint /gif needs the API password (--api-password or API_PASSWORD environment variable).")
+		sys.exit(1)
+	benchmarkRun = BenchmarkRun(gifmachineUrl, weights, duration, rate, apiPassword)
+	print('Benchmarking Gif Machine for ' + str(duration) + 's with ' + str(concurrency) + ' workers' +
+	      (' at ' + str(rate) + ' requests/s' if rate else '') + '...')
+	benchmarkRun.run(concurrency)
+	results = benchmarkRun.results()
+	baseline = None
+	if baselineFilename:
+		with open(baselineFilename, 'r') as baselineFile:
+			baseline = json.load(baselineFile)
+	print_benchmark_report(results, baseline)
+	if outputFilename:
+		with open(outputFilename, 'w') as outputFile:
+			json.dump(results, outputFile, indent=2)
+		print('Results saved to ' + outputFilename)
+	return results
+
+def main(*args):
+	parser = argparse.ArgumentParser(description='Test (or benchmark) Gif Machine endpoints.')
+	parser.add_argument('gifmachineUrl')
+	parser.add_argument('--ready-url', action='append', default=[], help='other url to wait for before testing (e.g. test listener)')
+	parser.add_argument('--deadline', type=float, default=readiness.DEFAULT_DEADLINE, help='seconds to wait for Gif Machine to be ready')
+	parser.add_argument('--benchmark', action='store_true', help='load test the endpoints instead of a single check')
+	parser.add_argument('--mix', default=DEFAULT_MIX, help='endpoint weights, e.g. "/=1,/history=2,/search=2,/gif=0.1"')
+	parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help='benchmark duration in seconds')
+	parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='concurrent workers')
+	parser.add_argument('--rate', type=float, help='target requests per second (default: as fast as possible)')
+	parser.add_argument('--api-password', default=os.environ.get('API_PASSWORD'), help='password for POST /gif')
+	parser.add_argument('--output', help='JSON file to save the benchmark results to')
+	parser.add_argument('--baseline', help='JSON results of a previous benchmark to compare against')
+	parser.add_argument('--probe', action='store_true', help='keep probing the endpoints, exposing Prometheus metrics')
+	parser.add_argument('--probe-interval', type=float, default=DEFAULT_PROBE_INTERVAL, help='seconds between two probes of an endpoint')
+	parser.add_argument('--port', type=int, default=DEFAULT_PROBE_PORT, help='port of the probe /metrics endpoint')
+	parser.add_argument('--cdepot-url', help='cDepot url (e.g. http://localhost:8002) to register the probe as a Prometheus target')
+	parser.add_argument('--advertise-address', help='host:port Prometheus scrapes the probe at (default: this host and --port)')
+	parser.add_argument('--cluster', default='synthetic-probe', help='cluster label of the probe target')
+	arguments = parser.parse_args(args)
+	if arguments.probe:
+		ProbeExporter(arguments.gifmachineUrl, PROBE_ENDPOINTS, arguments.probe_interval).run(arguments.port, arguments.cdepot_url,
+		                                                                                   arguments.advertise_address, arguments.cluster)
+	elif arguments.benchmark:
+		benchmark_gifmachine(arguments.gifmachineUrl, arguments.mix, arguments.duration, arguments.concurrency,
+		                     arguments.rate, arguments.api_password, arguments.output, arguments.baseline)
+	else:
+		test_gifmachine(arguments.gifmachineUrl, arguments.ready_url, arguments.deadline)
 
 if __name__ == '__main__':
     main(*sys.argv[1:])
@@ -0,0 +1,55 @@
+# CONFTEST
+# The scripts import each other as top level modules (they are run from
+#  their own folders), so the tests import them the same way.
+
+import os
+import pytest
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+for folder in ['scripts', 'cicd', os.path.join('monitoring', 'grafana')]:
+	sys.path.insert(0, os.path.join(ROOT_FOLDER, folder))
+
+@pytest.fixture
+def local_server():
+	# Starts stand-in HTTP servers on free local ports, answering each path
+	#  with a (status, delay in seconds) from routes or a callable returning
+	#  one; returns the server url and stops every server after the test
+	servers = []
+
+	def start(routes):
+		class Handler(BaseHTTPRequestHandler):
+			def answer(self):
+				path = self.path.split('?')[0]
+				route = routes.get(path, (404, 0))
+				status, delay = route() if callable(route) else route
+				if delay: time.sleep(delay)
+				body = b'ok' if status < 400 else b'error'
+				self.send_response(status)
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def do_GET(self):
+				self.answer()
+
+			def do_POST(self):
+				self.rfile.read(int(self.headers.get('Content-Length', 0)))
+				self.answer()
+
+			def log_message(self, format, *args):
+				pass
+
+		server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+		server.daemon_threads = True
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+		servers.append(server)
+		return 'http://127.0.0.1:' + str(server.server_address[1])
+
+	yield start
+	for server in servers:
+		server.shutdown()
+		server.server_close()
@@ -0,0 +1,40 @@
+import pytest
+import test_gifmachine
+
+ROUTES = {'/': (200, 0), '/history': (200, 0.05), '/search': (500, 0)}
+
+def test_parse_mix():
+	assert test_gifmachine.parse_mix('/=1,/history=2,/gif=0') == {'/': 1.0, '/history': 2.0}
+	with pytest.raises(ValueError):
+		test_gifmachine.parse_mix('/nope=1')
+
+def test_benchmark_against_a_local_server(local_server):
+	benchmarkRun = test_gifmachine.BenchmarkRun(local_server(ROUTES), {'/': 1, '/history': 1, '/search': 1}, 1.0, 60, None)
+	benchmarkRun.run(4)
+	endpoints = benchmarkRun.results()['endpoints']
+	# 60 requests/s for one second, every one of them answered
+	assert sum(stats['requests'] for stats in endpoints.values()) == 60
+	assert endpoints['/']['errors'] == 0 and endpoints['/']['statusCodes'] == {'200': endpoints['/']['requests']}
+	assert endpoints['/search']['errorRate'] == 1.0
+	assert endpoints['/search']['statusCodes'] == {'500': endpoints['/search']['requests']}
+	assert endpoints['/history']['p50'] >= 0.05 and endpoints['/history']['serviceP50'] >= 0.05
+	assert endpoints['/']['p50'] < 0.05
+
+def test_latency_counts_from_the_scheduled_time(local_server):
+	# One worker at 20 requests/s against 100ms responses falls behind: each
+	#  request waits for the previous ones, which the latency has to show
+	benchmarkRun = test_gifmachine.BenchmarkRun(local_server({'/history': (200, 0.1)}), {'/history': 1}, 0.5, 20, None)
+	benchmarkRun.run(1)
+	stats = benchmarkRun.results()['endpoints']['/history']
+	# The 10 scheduled requests are all sent, the last one about 0.45s late
+	assert stats['requests'] == 10
+	assert stats['serviceP99'] < 0.2
+	assert stats['max'] > 0.4
+	assert stats['p99'] > stats['serviceP99']
+
+def test_connection_errors_are_error_samples():
+	benchmarkRun = test_gifmachine.BenchmarkRun('http://127.0.0.1:1', {'/': 1}, 0.2, 10, None)
+	benchmarkRun.run(2)
+	stats = benchmarkRun.results()['endpoints']['/']
+	assert stats['requests'] == 2 and stats['errorRate'] == 1.0
+	assert stats['statusCodes'] == {'error': 2}
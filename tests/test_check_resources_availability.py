@@ -0,0 +1,92 @@
+import boto3
+import pytest
+from botocore.stub import Stubber
+from moto import mock_aws
+import aws_clients
+import check_resources_availability as preflight
+import preflight_cache
+
+TARGET = ('eu-west-1', 'prod', 'dundermiff')
+PREFIX = 'prod-dundermiff'
+
+@pytest.fixture
+def aws(monkeypatch, tmp_path):
+	# Moto accounts, a fresh client cache and the preflight cache in a temporary folder
+	for name, value in [('AWS_ACCESS_KEY_ID', 'testing'), ('AWS_SECRET_ACCESS_KEY', 'testing'), ('AWS_DEFAULT_REGION', 'eu-west-1')]:
+		monkeypatch.setenv(name, value)
+	monkeypatch.chdir(tmp_path)
+	monkeypatch.setattr(aws_clients, 'session', None)
+	monkeypatch.setattr(aws_clients, 'clients', {})
+	with mock_aws():
+		yield
+
+def create_some_resources():
+	boto3.client('secretsmanager', region_name='eu-west-1').create_secret(Name=PREFIX+'-DB_PASSWORD', SecretString='x')
+	boto3.client('ec2', region_name='eu-west-1').create_key_pair(KeyName=PREFIX+'-container-key')
+	boto3.client('iam').create_role(RoleName=PREFIX+'-all-jumpbox-role', AssumeRolePolicyDocument='{}')
+	boto3.client('s3').create_bucket(Bucket=PREFIX+'-keys', CreateBucketConfiguration={'LocationConstraint': 'eu-west-1'})
+
+def existing_names(results):
+	return [name for _, name, result in results if result]
+
+def test_results_follow_the_checks_order_whatever_the_concurrency(aws):
+	create_some_resources()
+	expectedNames = [name for _, name, _, _ in preflight.resource_checks('gifmachine', PREFIX)]
+	for maxWorkers in [1, 16]:
+		results, _, _, _ = preflight.run_preflight([TARGET], 'gifmachine', maxWorkers, refresh=True)
+		assert [name for _, name, _ in results[TARGET]] == expectedNames
+		assert existing_names(results[TARGET]) == [PREFIX+'-DB_PASSWORD', PREFIX+'-keys', PREFIX+'-all-jumpbox-role', PREFIX+'-container-key']
+
+def test_available_results_are_cached_and_conflicts_looked_up_again(aws):
+	create_some_resources()
+	_, hits, lookups, _ = preflight.run_preflight([TARGET], 'gifmachine')
+	assert hits == 0
+	results, hits, lookups, typeLookups = preflight.run_preflight([TARGET], 'gifmachine')
+	# Only the 4 conflicts miss the cache, and only their resource types are listed again
+	assert (hits, lookups - hits) == (lookups - 4, 4)
+	assert typeLookups == 4
+	assert len(existing_names(results[TARGET])) == 4
+	# Deleting a conflict is seen by the next run
+	boto3.client('ec2', region_name='eu-west-1').delete_key_pair(KeyName=PREFIX+'-container-key')
+	results, _, _, _ = preflight.run_preflight([TARGET], 'gifmachine')
+	assert PREFIX+'-container-key' not in existing_names(results[TARGET])
+
+def test_invalidation_by_pattern(aws):
+	preflight.run_preflight([TARGET], 'gifmachine')
+	removed = preflight_cache.invalidate([PREFIX+'-all-*'])
+	assert removed == 8 # the all-cf stack, its 2 security groups, 3 roles and 2 instance profiles
+	_, hits, lookups, _ = preflight.run_preflight([TARGET], 'gifmachine')
+	assert lookups - hits == removed
+
+def test_one_paginated_call_per_resource_type():
+	# Every requested name of a type is answered by a single listing
+	iamClient = boto3.client('iam', region_name='us-east-1', aws_access_key_id='testing', aws_secret_access_key='testing')
+	cfClient = boto3.client('cloudformation', region_name='eu-west-1', aws_access_key_id='testing', aws_secret_access_key='testing')
+	index = preflight.ResourceIndex({'iam': iamClient, 'cloudformation': cfClient})
+	roleNames = [PREFIX+'-'+role+'-role' for role in ['all-jumpbox', 'all-natinstance', 'all-docker-build', 'db-dbinstance']]
+	for roleName in roleNames:
+		index.request('role', roleName)
+	for stackName in [PREFIX+'-all-cf', PREFIX+'-db-cf']:
+		index.request('stack', stackName)
+	with Stubber(iamClient) as iamStubber, Stubber(cfClient) as cfStubber:
+		iamStubber.add_response('list_roles', {'Roles': [{'RoleName': roleNames[1], 'Path': '/', 'RoleId': 'AROAEXAMPLEEXAMPLE1',
+		                                                  'Arn': 'arn:aws:iam::123456789012:role/'+roleNames[1],
+		                                                  'CreateDate': '2026-01-01T00:00:00Z'}]}, {})
+		cfStubber.add_response('describe_stacks', {'Stacks': [{'StackName': PREFIX+'-db-cf', 'CreationTime': '2026-01-01T00:00:00Z',
+		                                                       'StackStatus': 'CREATE_COMPLETE'}]}, {})
+		index.resolve(8)
+		iamStubber.assert_no_pending_responses()
+		cfStubber.assert_no_pending_responses()
+	assert [index.exists('role', roleName) for roleName in roleNames] == [0, 1, 0, 0]
+	assert [index.exists('stack', stackName) for stackName in [PREFIX+'-all-cf', PREFIX+'-db-cf']] == [0, 1]
+
+def test_throttling_is_retried(monkeypatch):
+	monkeypatch.setattr(preflight.time, 'sleep', lambda seconds: None)
+	calls = []
+	def throttled_call():
+		calls.append(1)
+		if len(calls) < 3:
+			raise preflight.ClientError({'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'}}, 'ListRoles')
+		return 'done'
+	assert preflight.call_with_backoff(throttled_call) == 'done'
+	assert len(calls) == 3
@@ -0,0 +1,181 @@
+import json
+import os
+import boto3
+import pytest
+from botocore.stub import Stubber
+import deploy_gifmachine
+from deploy_gifmachine import GifmachineDeployment
+from orchestrator import Orchestrator
+
+PREFIX = 'prod-dundermiff'
+KEY_NAMES = ['jumpbox', 'natinstance', 'dbinstance', 'container']
+# Steps without builds, uploads or stacks, which only call the stubbed clients
+CREATION_STEPS = ['create_secrets', 'create_keys_bucket', 'create_ecr_repository'] + ['create_key_'+keyName for keyName in KEY_NAMES]
+STACK_NAME = PREFIX+'-all-cf'
+
+@pytest.fixture
+def stubbers(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	for name in deploy_gifmachine.CREDENTIALS:
+		monkeypatch.setenv(name, 'typed-'+name)
+	clients = {}
+	stubbers = {}
+	for service in ['s3', 'secretsmanager', 'ec2', 'ecr', 'cloudformation']:
+		clients[service] = boto3.client(service, region_name='eu-west-1', aws_access_key_id='testing', aws_secret_access_key='testing')
+		stubbers[service] = Stubber(clients[service])
+		stubbers[service].activate()
+	stubbers['deployment'] = GifmachineDeployment('eu-west-1', 'prod', 'dundermiff', clients)
+	yield stubbers
+	for service in clients:
+		stubbers[service].assert_no_pending_responses()
+		stubbers[service].deactivate()
+
+def expect_creations(stubbers, keyNames=KEY_NAMES, failingKey=None):
+	# Responses in the order one worker runs CREATION_STEPS, with nothing created yet
+	for name in deploy_gifmachine.CREDENTIALS:
+		stubbers['secretsmanager'].add_client_error('describe_secret', 'ResourceNotFoundException', expected_params={'SecretId': PREFIX+'-'+name})
+		stubbers['secretsmanager'].add_response('create_secret', {'Name': PREFIX+'-'+name},
+		                                        {'Name': PREFIX+'-'+name, 'SecretString': 'typed-'+name})
+	stubbers['s3'].add_client_error('head_bucket', '404', http_status_code=404, expected_params={'Bucket': PREFIX+'-keys'})
+	stubbers['s3'].add_response('create_bucket', {}, {'Bucket': PREFIX+'-keys', 'CreateBucketConfiguration': {'LocationConstraint': 'eu-west-1'}})
+	stubbers['ecr'].add_client_error('describe_repositories', 'RepositoryNotFoundException', expected_params={'repositoryNames': [PREFIX+'-gifmachine']})
+	stubbers['ecr'].add_response('create_repository', {'repository': {'repositoryName': PREFIX+'-gifmachine'}}, {'repositoryName': PREFIX+'-gifmachine'})
+	for keyName in keyNames:
+		keyPairName = PREFIX+'-'+keyName+'-key'
+		stubbers['ec2'].add_client_error('describe_key_pairs', 'InvalidKeyPair.NotFound', expected_params={'KeyNames': [keyPairName]})
+		if keyName == failingKey:
+			stubbers['ec2'].add_client_error('create_key_pair', 'KeyPairLimitExceeded', expected_params={'KeyName': keyPairName})
+		else:
+			stubbers['ec2'].add_response('create_key_pair', {'KeyName': keyPairName, 'KeyMaterial': 'PRIVATE '+keyName}, {'KeyName': keyPairName})
+
+def creation_orchestrator(stubbers, tmp_path):
+	steps = [step for step in stubbers['deployment'].steps() if step.name in CREATION_STEPS]
+	return Orchestrator(steps, str(tmp_path / 'state.json'), 1)
+
+def done_steps(tmp_path):
+	with open(tmp_path / 'state.json') as stateFile:
+		return [name for name, stepState in json.load(stateFile).items() if stepState['status'] == 'done']
+
+def test_creates_everything_and_saves_the_state(stubbers, tmp_path, capsys):
+	expect_creations(stubbers)
+	assert creation_orchestrator(stubbers, tmp_path).run()
+	started = [line.split()[1] for line in capsys.readouterr().out.splitlines() if line.startswith('[START]')]
+	assert started == CREATION_STEPS
+	assert sorted(done_steps(tmp_path)) == sorted(CREATION_STEPS)
+	with open(os.path.join('keys', PREFIX+'-jumpbox-key.pem')) as keyFile:
+		assert keyFile.read() == 'PRIVATE jumpbox'
+
+def test_resumes_after_a_failed_step(stubbers, tmp_path):
+	expect_creations(stubbers, failingKey='natinstance')
+	assert not creation_orchestrator(stubbers, tmp_path).run()
+	assert 'create_key_natinstance' not in done_steps(tmp_path)
+	assert len(done_steps(tmp_path)) == len(CREATION_STEPS) - 1
+	# Only the failed step runs again
+	stubbers['ec2'].add_client_error('describe_key_pairs', 'InvalidKeyPair.NotFound', expected_params={'KeyNames': [PREFIX+'-natinstance-key']})
+	stubbers['ec2'].add_response('create_key_pair', {'KeyName': PREFIX+'-natinstance-key', 'KeyMaterial': 'PRIVATE natinstance'},
+	                             {'KeyName': PREFIX+'-natinstance-key'})
+	assert creation_orchestrator(stubbers, tmp_path).run(resume=True)
+	assert sorted(done_steps(tmp_path)) == sorted(CREATION_STEPS)
+
+def test_rerun_over_existing_resources_creates_nothing(stubbers, tmp_path):
+	for name in deploy_gifmachine.CREDENTIALS:
+		stubbers['secretsmanager'].add_response('describe_secret', {'Name': PREFIX+'-'+name}, {'SecretId': PREFIX+'-'+name})
+	stubbers['s3'].add_response('head_bucket', {}, {'Bucket': PREFIX+'-keys'})
+	stubbers['ecr'].add_response('describe_repositories', {'repositories': [{'repositoryName': PREFIX+'-gifmachine'}]},
+	                             {'repositoryNames': [PREFIX+'-gifmachine']})
+	os.makedirs('keys')
+	for keyName in KEY_NAMES:
+		open(os.path.join('keys', PREFIX+'-'+keyName+'-key.pem'), 'w').close()
+		stubbers['ec2'].add_response('describe_key_pairs', {'KeyPairs': [{'KeyName': PREFIX+'-'+keyName+'-key'}]},
+		                             {'KeyNames': [PREFIX+'-'+keyName+'-key']})
+	assert creation_orchestrator(stubbers, tmp_path).run()
+
+def test_existing_key_pair_without_its_private_key(stubbers):
+	stubbers['ec2'].add_response('describe_key_pairs', {'KeyPairs': [{'KeyName': PREFIX+'-jumpbox-key'}]}, {'KeyNames': [PREFIX+'-jumpbox-key']})
+	with pytest.raises(RuntimeError) as failure:
+		stubbers['deployment'].create_key_pair('jumpbox')
+	assert 'is missing' in str(failure.value)
+
+def test_secret_pending_deletion_is_restored(stubbers, monkeypatch):
+	monkeypatch.setattr(deploy_gifmachine, 'CREDENTIALS', ['API_PASSWORD'])
+	stubbers['secretsmanager'].add_response('describe_secret', {'Name': PREFIX+'-API_PASSWORD', 'DeletedDate': 1700000000},
+	                                        {'SecretId': PREFIX+'-API_PASSWORD'})
+	stubbers['secretsmanager'].add_response('restore_secret', {}, {'SecretId': PREFIX+'-API_PASSWORD'})
+	stubbers['deployment'].create_secrets()
+
+def test_steps_start_after_their_dependencies(tmp_path):
+	deployment = GifmachineDeployment('eu-west-1', 'prod', 'dundermiff', clients={})
+	steps = deployment.steps()
+	finished = []
+	startedEarly = []
+	for step in steps:
+		def record(step=step):
+			startedEarly.extend(dependency for dependency in step.dependsOn if dependency not in finished)
+			finished.append(step.name)
+		step.function = record
+	assert Orchestrator(steps, str(tmp_path / 'state.json'), 4).run()
+	assert startedEarly == []
+	assert finished[-2:] == ['create_gifmachine_stack', 'test_gifmachine']
+
+@pytest.fixture
+def stack(stubbers, monkeypatch, tmp_path):
+	os.makedirs('infrastructure')
+	with open(os.path.join('infrastructure', 'all-cf.yaml'), 'w') as templateFile:
+		templateFile.write('Resources: {}')
+	created = []
+	monkeypatch.setattr(deploy_gifmachine, 'STACK_POLL_INTERVAL', 0)
+	monkeypatch.setattr(deploy_gifmachine, 'wait_for_stack', lambda cfClient, stackName, *args: created.append(stackName))
+	monkeypatch.setattr(deploy_gifmachine, 'record_phase', lambda *args: None)
+	monkeypatch.setattr(deploy_gifmachine, 'predicted_minutes', lambda *args: None)
+	monkeypatch.setattr(deploy_gifmachine, 'predicted_eta_string', lambda *args: '4 min')
+	return stubbers['cloudformation'], created
+
+def stack_statuses(stubber, *statuses):
+	for status in statuses:
+		if status is None:
+			stubber.add_client_error('describe_stacks', 'ValidationError', 'Stack with id '+STACK_NAME+' does not exist',
+			                         expected_params={'StackName': STACK_NAME})
+		else:
+			stubber.add_response('describe_stacks', {'Stacks': [{'StackName': STACK_NAME, 'StackStatus': status,
+			                     'CreationTime': '2026-10-18T10:00:00Z'}]}, {'StackName': STACK_NAME})
+
+def expect_create_stack(stubber):
+	stubber.add_response('create_stack', {'StackId': 'arn:aws:cloudformation:eu-west-1:123456789012:stack/'+STACK_NAME+'/1'},
+	                     {'StackName': STACK_NAME, 'TemplateBody': 'Resources: {}', 'Capabilities': ['CAPABILITY_NAMED_IAM'],
+	                      'Parameters': [{'ParameterKey': 'Environment', 'ParameterValue': 'prod'},
+	                                     {'ParameterKey': 'Company', 'ParameterValue': 'dundermiff'}]})
+
+def test_creates_a_missing_stack(stubbers, stack):
+	stubber, created = stack
+	stack_statuses(stubber, None)
+	expect_create_stack(stubber)
+	stubbers['deployment'].create_all_stack()
+	assert created == [STACK_NAME]
+
+def test_existing_stack_is_kept(stubbers, stack):
+	stubber, created = stack
+	stack_statuses(stubber, 'UPDATE_COMPLETE')
+	stubbers['deployment'].create_all_stack()
+	assert created == []
+
+def test_waits_for_a_stack_in_progress(stubbers, stack):
+	stubber, created = stack
+	stack_statuses(stubber, 'CREATE_IN_PROGRESS', 'CREATE_IN_PROGRESS', 'CREATE_COMPLETE')
+	stubbers['deployment'].create_all_stack()
+	assert created == []
+
+def test_rolled_back_stack_is_deleted_and_created_again(stubbers, stack):
+	stubber, created = stack
+	stack_statuses(stubber, 'ROLLBACK_IN_PROGRESS', 'ROLLBACK_COMPLETE')
+	stubber.add_response('delete_stack', {}, {'StackName': STACK_NAME})
+	stack_statuses(stubber, 'DELETE_IN_PROGRESS', None)
+	expect_create_stack(stubber)
+	stubbers['deployment'].create_all_stack()
+	assert created == [STACK_NAME]
+
+def test_stack_in_a_failed_state_stops_the_step(stubbers, stack):
+	stubber, created = stack
+	stack_statuses(stubber, 'UPDATE_ROLLBACK_FAILED')
+	with pytest.raises(RuntimeError) as failure:
+		stubbers['deployment'].create_all_stack()
+	assert 'UPDATE_ROLLBACK_FAILED' in str(failure.value)
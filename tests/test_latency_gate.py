@@ -0,0 +1,93 @@
+import boto3
+import pytest
+from botocore.stub import Stubber
+import latency_gate
+
+def stats(p95Ms, p99Ms, errorRate=0.0):
+	return {'p50Ms': p95Ms / 2, 'p95Ms': p95Ms, 'p99Ms': p99Ms, 'errorRate': errorRate, 'requests': 180}
+
+def test_green_within_budget():
+	# Limits: p95 100*1.2+25 = 145ms, p99 200*1.3+25 = 285ms, errors 0.5%+1%
+	assert latency_gate.budget_violations(stats(100, 200, 0.005), stats(145, 285, 0.015)) == []
+
+def test_green_over_latency_budget():
+	violations = latency_gate.budget_violations(stats(100, 200), stats(146, 286))
+	assert violations == ['p95 146ms over budget 145ms (blue 100ms)', 'p99 286ms over budget 285ms (blue 200ms)']
+
+def test_slack_absorbs_noise_on_fast_endpoints():
+	assert latency_gate.budget_violations(stats(2, 3), stats(20, 25)) == []
+
+def test_green_over_error_budget():
+	violations = latency_gate.budget_violations(stats(100, 200, 0.0), stats(100, 200, 0.02))
+	assert violations == ['error rate 2.0% over budget 1.0% (blue 0.0%)']
+
+def test_custom_budgets():
+	budgets = dict(latency_gate.DEFAULT_BUDGETS, p95Ratio=1.0, slackMs=0)
+	assert len(latency_gate.budget_violations(stats(100, 200), stats(101, 200), budgets)) == 1
+
+def test_summary():
+	latencies = [i / 1000.0 for i in range(1, 101)]
+	summary = latency_gate.summary(latencies, 5)
+	assert (summary['p50Ms'], summary['p95Ms'], summary['p99Ms']) == pytest.approx((50, 95, 99))
+	assert summary['errorRate'] == 0.05
+	assert latency_gate.summary([], 0)['errorRate'] == 1.0
+
+@pytest.fixture
+def codedeploy(monkeypatch):
+	client = boto3.client('codedeploy', region_name='eu-west-1', aws_access_key_id='testing', aws_secret_access_key='testing')
+	monkeypatch.setattr(boto3, 'client', lambda service: client)
+	monkeypatch.setenv('BLUE_URL', 'http://blue')
+	monkeypatch.setenv('GREEN_URL', 'http://green')
+	with Stubber(client) as stubber:
+		yield stubber
+		stubber.assert_no_pending_responses()
+
+def expect_status(stubber, status):
+	stubber.add_response('put_lifecycle_event_hook_execution_status', {'lifecycleEventHookExecutionId': 'hook-1'},
+	                     {'deploymentId': 'd-1', 'lifecycleEventHookExecutionId': 'hook-1', 'status': status})
+
+HOOK_EVENT = {'DeploymentId': 'd-1', 'LifecycleEventHookExecutionId': 'hook-1'}
+
+def test_hook_succeeds_within_budget(monkeypatch, codedeploy):
+	monkeypatch.setattr(latency_gate, 'run_gate', lambda *args, **kwargs: [])
+	expect_status(codedeploy, 'Succeeded')
+	assert latency_gate.lambda_handler(HOOK_EVENT, None) == {'status': 'Succeeded', 'violations': []}
+
+def test_hook_fails_over_budget(monkeypatch, codedeploy):
+	monkeypatch.setattr(latency_gate, 'run_gate', lambda *args, **kwargs: ['p99 300ms over budget 285ms (blue 200ms)'])
+	expect_status(codedeploy, 'Failed')
+	assert latency_gate.lambda_handler(HOOK_EVENT, None)['status'] == 'Failed'
+
+def test_hook_fails_when_the_gate_cannot_run(monkeypatch, codedeploy):
+	def unreachable(*args, **kwargs):
+		raise OSError('Name or service not known')
+	monkeypatch.setattr(latency_gate, 'run_gate', unreachable)
+	expect_status(codedeploy, 'Failed')
+	assert latency_gate.lambda_handler(HOOK_EVENT, None)['violations'] == ['Name or service not known']
+
+def test_hook_reads_budgets_from_the_environment(monkeypatch, codedeploy):
+	budgets = []
+	monkeypatch.setattr(latency_gate, 'run_gate', lambda blueUrl, greenUrl, gateBudgets, **kwargs: budgets.append(gateBudgets) or [])
+	monkeypatch.setenv('GATE_BUDGETS', '{"p99Ratio": 1.5}')
+	expect_status(codedeploy, 'Succeeded')
+	latency_gate.lambda_handler(HOOK_EVENT, None)
+	assert budgets == [dict(latency_gate.DEFAULT_BUDGETS, p99Ratio=1.5)]
+
+FAST = {'/': (200, 0), '/history': (200, 0), '/search': (200, 0)}
+
+def gate(local_server, greenRoutes):
+	return latency_gate.run_gate(local_server(FAST), local_server(greenRoutes), requests=10, concurrency=4)
+
+def test_gate_passes_equal_targets(local_server):
+	assert gate(local_server, FAST) == []
+
+def test_gate_fails_slow_green(local_server):
+	violations = gate(local_server, dict(FAST, **{'/history': (200, 0.1)}))
+	assert [violation.split()[0] for violation in violations] == ['p95', 'p99']
+
+def test_gate_fails_erroring_green(local_server):
+	violations = gate(local_server, dict(FAST, **{'/search': (500, 0)}))
+	assert len(violations) == 1 and violations[0].startswith('error rate 33.3% over budget 1.0%')
+
+def test_gate_ignores_client_errors(local_server):
+	assert gate(local_server, dict(FAST, **{'/search': (404, 0)})) == []
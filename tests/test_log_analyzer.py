@@ -0,0 +1,80 @@
+import random
+import time
+import pytest
+from log_analyzer import LatencySketch, LogAnalyzer, RequestParser, normalize_path
+
+def exact_quantile(values, q):
+	return sorted(values)[int(q * (len(values) - 1))]
+
+@pytest.mark.parametrize('q', [0.5, 0.9, 0.95, 0.99, 0.999])
+def test_sketch_quantiles_within_relative_accuracy(q):
+	generator = random.Random(42)
+	latencies = [generator.lognormvariate(-3, 1.2) for _ in range(20000)]
+	sketch = LatencySketch()
+	for latency in latencies:
+		sketch.add(latency)
+	exact = exact_quantile(latencies, q)
+	assert abs(sketch.quantile(q) - exact) <= LatencySketch.RELATIVE_ACCURACY * exact
+
+def test_sketch_merge_matches_one_sketch():
+	generator = random.Random(7)
+	latencies = [generator.expovariate(20) for _ in range(5000)]
+	whole = LatencySketch()
+	halves = [LatencySketch(), LatencySketch()]
+	for i, latency in enumerate(latencies):
+		whole.add(latency, failed=i % 10 == 0)
+		halves[i % 2].add(latency, failed=i % 10 == 0)
+	merged = halves[0].merge(halves[1])
+	assert merged.buckets == whole.buckets
+	assert (merged.count, merged.errors, merged.maxSeconds) == (whole.count, whole.errors, whole.maxSeconds)
+
+def test_sketch_round_trips_through_the_state_file_format():
+	sketch = LatencySketch()
+	for latency in [0.00001, 0.012, 0.3, 2.5]:
+		sketch.add(latency, latency > 1)
+	restored = LatencySketch.from_dict(sketch.to_dict())
+	assert restored.buckets == sketch.buckets
+	assert [restored.quantile(q) for q in [0, 0.5, 1]] == [sketch.quantile(q) for q in [0, 0.5, 1]]
+	assert LatencySketch().quantile(0.99) is None
+
+def test_sketch_quantile_never_exceeds_the_max():
+	sketch = LatencySketch()
+	sketch.add(0.1234)
+	assert sketch.quantile(0.99) == 0.1234
+
+def test_normalize_path():
+	assert normalize_path('/gif/123?foo=bar') == '/gif/:id'
+	assert normalize_path('/history') == '/history'
+	assert normalize_path('/search?query=cats') == '/search'
+	assert normalize_path('/') == '/'
+
+def test_parses_common_log_lines():
+	line = '10.0.1.12 - - [18/Oct/2026:10:00:00 +0000] "GET /search?query=cats HTTP/1.1" 200 1234 0.0123'
+	assert RequestParser().parse('task-1', line) == ('GET /search', 0.0123, 200, 1792317600.0)
+
+def test_parses_rails_requests_per_task():
+	parser = RequestParser()
+	assert parser.parse('task-1', 'Started GET "/history" for 10.0.1.12 at 2026-10-18 10:00:00 +0000') is None
+	assert parser.parse('task-2', 'Started POST "/gif" for 10.0.1.13 at 2026-10-18 10:00:00 +0000') is None
+	assert parser.parse('task-2', 'Completed 500 Internal Server Error in 250ms (ActiveRecord: 3.1ms)') == ('POST /gif', 0.25, 500, None)
+	assert parser.parse('task-1', 'Completed 200 OK in 12ms (Views: 5.0ms)') == ('GET /history', 0.012, 200, None)
+	assert parser.parse('task-1', 'Completed 200 OK in 12ms') is None
+	assert parser.parse('task-1', 'Puma starting in single mode...') is None
+
+def test_file_reads_resume_where_they_stopped(tmp_path):
+	logFilename = tmp_path / 'task-1.log'
+	stateFilename = str(tmp_path / 'state.json')
+	line = '10.0.1.12 - - [%s] "GET /history HTTP/1.1" 200 1234 %s\n'
+	timestamp = time.strftime('%d/%b/%Y:%H:%M:%S +0000', time.gmtime())
+	logFilename.write_text(''.join(line % (timestamp, '0.010') for _ in range(3)))
+	analyzer = LogAnalyzer(stateFilename)
+	analyzer.read_file(str(logFilename))
+	assert analyzer.newRequests == 3
+	with open(str(logFilename), 'a') as logFile:
+		logFile.write(line % (timestamp, '0.500') + (line % (timestamp, '0.020'))[:20]) # the last line is still being written
+	analyzer = LogAnalyzer(stateFilename)
+	analyzer.read_file(str(logFilename))
+	assert analyzer.newRequests == 1
+	sketch = analyzer.window_sketches('endpoints')['GET /history']
+	assert sketch.count == 4
+	assert sketch.maxSeconds == 0.5
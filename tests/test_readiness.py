@@ -0,0 +1,110 @@
+import pytest
+import requests
+import readiness
+
+class FakeClock:
+	def __init__(self):
+		self.now = 1000.0
+		self.sleeps = []
+
+	def time(self):
+		return self.now
+
+	def sleep(self, seconds):
+		self.sleeps.append(seconds)
+		self.now = self.now + seconds
+
+class FakeResponse:
+	def __init__(self, statusCode, text=''):
+		self.status_code = statusCode
+		self.text = text
+
+def fake_session(answers, clock):
+	# Session returning the answers in order (the last one forever); an
+	#  exception answer is raised. Every probe takes one second
+	class FakeSession:
+		def mount(self, prefix, adapter):
+			pass
+
+		def get(self, url, timeout):
+			clock.now = clock.now + 1
+			answer = answers.pop(0) if len(answers) > 1 else answers[0]
+			if isinstance(answer, Exception): raise answer
+			return answer
+	return FakeSession
+
+@pytest.fixture
+def clock(monkeypatch):
+	clock = FakeClock()
+	monkeypatch.setattr(readiness, 'time', clock)
+	# Upper bound of the full jitter, so the backoff sequence is deterministic
+	monkeypatch.setattr(readiness.random, 'uniform', lambda low, high: high)
+	return clock
+
+def test_ready_after_backing_off(monkeypatch, clock):
+	answers = [requests.ConnectionError(), FakeResponse(503), FakeResponse(200)]
+	monkeypatch.setattr(readiness.requests, 'Session', fake_session(answers, clock))
+	result = readiness.probe_until_ready('http://gifmachine', clock.now + 60)
+	assert result.ready
+	assert result.attempts == 3
+	assert clock.sleeps == [2, 4]
+	assert result.timeToReady == 3 + 2 + 4
+
+def test_backoff_is_capped(monkeypatch, clock):
+	monkeypatch.setattr(readiness.requests, 'Session', fake_session([FakeResponse(502)], clock))
+	readiness.probe_until_ready('http://gifmachine', clock.now + 3600)
+	assert clock.sleeps[:4] == [2, 4, 8, 16]
+	assert max(clock.sleeps) == readiness.BACKOFF_CAP
+
+def test_never_sleeps_past_the_deadline(monkeypatch, clock):
+	monkeypatch.setattr(readiness.requests, 'Session', fake_session([requests.ConnectTimeout()], clock))
+	deadline = clock.now + 60
+	result = readiness.probe_until_ready('http://gifmachine', deadline)
+	assert not result.ready
+	assert result.lastError == 'ConnectTimeout'
+	assert clock.now < deadline
+	assert result.attempts == 5 # probes at 1, 4, 9, 18 and 35s; the next backoff (30s) would end past 60s
+
+def test_expected_content(monkeypatch, clock):
+	answers = [FakeResponse(200, 'Loading...'), FakeResponse(200, 'Grafana')]
+	monkeypatch.setattr(readiness.requests, 'Session', fake_session(answers, clock))
+	result = readiness.probe_until_ready('http://grafana', clock.now + 60, expectedContent='Grafana')
+	assert result.ready
+	assert result.attempts == 2
+
+def test_wait_or_exit_exits_when_not_ready(monkeypatch, clock):
+	monkeypatch.setattr(readiness.requests, 'Session', fake_session([FakeResponse(503)], clock))
+	with pytest.raises(SystemExit) as exit:
+		readiness.wait_or_exit(['http://gifmachine'], 30)
+	assert exit.value.code == readiness.NOT_READY_EXIT_CODE
+
+@pytest.fixture
+def fast_backoff(monkeypatch):
+	monkeypatch.setattr(readiness, 'BACKOFF_BASE', 0.05)
+	monkeypatch.setattr(readiness, 'BACKOFF_CAP', 0.2)
+	monkeypatch.setattr(readiness.random, 'uniform', lambda low, high: high)
+
+def ready_after(seconds):
+	readyTime = readiness.time.time() + seconds
+	return lambda: (200, 0) if readiness.time.time() >= readyTime else (503, 0)
+
+def test_local_servers_ready_late(local_server, fast_backoff, capsys):
+	readyUrl = local_server({'/': (200, 0)}) + '/'
+	lateUrl = local_server({'/': ready_after(0.5)}) + '/'
+	results = readiness.wait_until_ready([readyUrl, lateUrl], 10)
+	assert [result.ready for result in results] == [True, True]
+	assert results[0].attempts == 1 and results[0].timeToReady < 0.5
+	assert results[1].attempts > 1 and 0.5 <= results[1].timeToReady < 1.5
+	assert readiness.report(results)
+	assert lateUrl + ' ready after ' in capsys.readouterr().out
+
+def test_local_server_not_ready_before_the_deadline(local_server, fast_backoff, capsys):
+	readyUrl = local_server({'/': (200, 0)}) + '/'
+	lateUrl = local_server({'/': ready_after(60)}) + '/'
+	startTime = readiness.time.time()
+	with pytest.raises(SystemExit) as exit:
+		readiness.wait_or_exit([readyUrl, lateUrl], 1)
+	assert exit.value.code == readiness.NOT_READY_EXIT_CODE == 3
+	assert readiness.time.time() - startTime < 2
+	output = capsys.readouterr().out
+	assert lateUrl + ' NOT ready after ' in output and 'last error: status code 503' in output
@@ -0,0 +1,18 @@
+import pytest
+from recording_rules import recorded_series
+
+def test_counter_function_on_a_traffic_counter():
+	rules = {}
+	assert recorded_series('increase(cSidecar_RxTraffic[1m])', rules) == ('instance:cSidecar_RxTraffic:increase1m', 'cSidecar_RxTraffic')
+	assert rules == {'instance:cSidecar_RxTraffic:increase1m': 'increase(cSidecar_RxTraffic[1m])'}
+
+def test_counter_function_on_a_gauge_is_rejected():
+	with pytest.raises(ValueError):
+		recorded_series('rate(cSidecar_CPUUtilization[5m])', {})
+	assert recorded_series('avg_over_time(cSidecar_MemoryUtilization[5m])', {})[0] == 'instance:cSidecar_MemoryUtilization:avg_over_time5m'
+
+def test_aggregation_of_a_recorded_series():
+	rules = {}
+	series, metric = recorded_series('sum by (cluster) (increase(cSidecar_TxTraffic[1m]))', rules)
+	assert (series, metric) == ('cluster:cSidecar_TxTraffic:sum_increase1m', 'cSidecar_TxTraffic')
+	assert list(rules) == ['instance:cSidecar_TxTraffic:increase1m', 'cluster:cSidecar_TxTraffic:sum_increase1m']
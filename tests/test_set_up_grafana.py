@@ -0,0 +1,138 @@
+import copy
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import pytest
+import set_up_grafana
+from set_up_grafana import GrafanaProvisioner, is_unchanged
+
+PROVISIONING_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'monitoring', 'grafana')
+
+class FakeGrafana:
+	# Datasources and dashboards kept in memory behind the API paths the
+	#  provisioner uses, recording every request it gets
+	def __init__(self):
+		self.datasources = []
+		self.dashboards = {}
+		self.requests = []
+		self.lock = threading.Lock()
+
+	def add_dashboard(self, dashboard):
+		stored = dict(copy.deepcopy(dashboard), id=len(self.dashboards) + 1, version=dashboard.get('version', 0) + 1)
+		self.dashboards[dashboard['uid']] = stored
+		return self.search_result(dashboard['uid'])
+
+	def search_result(self, uid):
+		return {'uid': uid, 'url': '/d/' + uid + '/' + self.dashboards[uid]['title'].lower().replace(' ', '-')}
+
+	def handle(self, method, path, query, body):
+		if method == 'GET' and path == '/api/datasources':
+			return self.datasources
+		if method == 'POST' and path == '/api/datasources':
+			self.datasources.append(dict(body, id=len(self.datasources) + 1, orgId=1, version=1, readOnly=False))
+			return {'id': len(self.datasources)}
+		if method == 'PUT' and path.startswith('/api/datasources/'):
+			index = [datasource['id'] for datasource in self.datasources].index(int(path.split('/')[-1]))
+			self.datasources[index] = dict(body, orgId=1, version=self.datasources[index]['version'] + 1, readOnly=False)
+			return {'id': body['id']}
+		if method == 'GET' and path == '/api/search':
+			limit, page = int(query['limit'][0]), int(query['page'][0])
+			results = [dict(self.search_result(uid), title=dashboard['title'], type='dash-db') for uid, dashboard in sorted(self.dashboards.items())]
+			return results[(page - 1) * limit:page * limit]
+		if method == 'GET' and path.startswith('/api/dashboards/uid/'):
+			return {'dashboard': self.dashboards[path.split('/')[-1]], 'meta': {}}
+		if method == 'POST' and path == '/api/dashboards/db':
+			return self.add_dashboard(body['dashboard'])
+		raise KeyError(path)
+
+	def writes(self):
+		return [(method, path) for method, path in self.requests if method != 'GET']
+
+@pytest.fixture
+def grafana():
+	fakeGrafana = FakeGrafana()
+
+	class Handler(BaseHTTPRequestHandler):
+		def answer(self, method):
+			url = urlparse(self.path)
+			length = int(self.headers.get('Content-Length', 0))
+			body = json.loads(self.rfile.read(length)) if length else None
+			with fakeGrafana.lock:
+				fakeGrafana.requests.append((method, url.path))
+				try:
+					status, response = 200, fakeGrafana.handle(method, url.path, parse_qs(url.query), body)
+				except KeyError:
+					status, response = 404, {'message': 'Not found'}
+			content = json.dumps(response).encode()
+			self.send_response(status)
+			self.send_header('Content-Type', 'application/json')
+			self.send_header('Content-Length', str(len(content)))
+			self.end_headers()
+			self.wfile.write(content)
+
+		def do_GET(self):
+			self.answer('GET')
+
+		def do_POST(self):
+			self.answer('POST')
+
+		def do_PUT(self):
+			self.answer('PUT')
+
+		def log_message(self, format, *args):
+			pass
+
+	server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	fakeGrafana.url = 'http://127.0.0.1:' + str(server.server_address[1])
+	yield fakeGrafana
+	server.shutdown()
+	server.server_close()
+
+def test_first_run_creates_everything(grafana):
+	urls = GrafanaProvisioner(grafana.url).provision(PROVISIONING_FOLDER)
+	assert sorted(grafana.writes()) == [('POST', '/api/dashboards/db'), ('POST', '/api/datasources')]
+	assert urls == {'gifmachines': grafana.url + '/d/gifmachine/gifmachines'}
+	assert [datasource['uid'] for datasource in grafana.datasources] == ['prometheus']
+
+def test_second_run_writes_nothing(grafana, capsys):
+	GrafanaProvisioner(grafana.url).provision(PROVISIONING_FOLDER)
+	grafana.requests = []
+	urls = GrafanaProvisioner(grafana.url).provision(PROVISIONING_FOLDER)
+	assert grafana.writes() == []
+	assert urls == {'gifmachines': grafana.url + '/d/gifmachine/gifmachines'}
+	assert '0 created, 0 updated, 2 unchanged' in capsys.readouterr().out
+
+def test_dashboards_indexed_by_uid_over_search_pages(grafana, monkeypatch):
+	monkeypatch.setattr(set_up_grafana, 'SEARCH_PAGE_SIZE', 2)
+	for i in range(3):
+		grafana.add_dashboard({'uid': 'other-' + str(i), 'title': 'Other ' + str(i), 'panels': []})
+	GrafanaProvisioner(grafana.url).provision(PROVISIONING_FOLDER)
+	grafana.requests = []
+	GrafanaProvisioner(grafana.url).provision(PROVISIONING_FOLDER)
+	# 4 dashboards over pages of 2 (the last one empty), and only the provisioned one downloaded
+	assert grafana.requests.count(('GET', '/api/search')) == 3
+	assert [path for method, path in grafana.requests if path.startswith('/api/dashboards/uid/')] == ['/api/dashboards/uid/gifmachine']
+	assert grafana.writes() == []
+
+def test_dashboard_edited_in_grafana_is_overwritten(grafana):
+	GrafanaProvisioner(grafana.url).provision(PROVISIONING_FOLDER)
+	grafana.dashboards['gifmachine']['title'] = 'edited by hand'
+	grafana.requests = []
+	GrafanaProvisioner(grafana.url).provision(PROVISIONING_FOLDER)
+	assert grafana.writes() == [('POST', '/api/dashboards/db')]
+	assert grafana.dashboards['gifmachine']['title'] == 'gifmachines'
+
+def test_datasource_without_uid_is_matched_by_name(grafana):
+	grafana.datasources.append({'id': 7, 'name': 'Prometheus', 'type': 'prometheus', 'url': 'localhost:9090', 'orgId': 1, 'version': 1})
+	GrafanaProvisioner(grafana.url).provision(PROVISIONING_FOLDER)
+	assert ('PUT', '/api/datasources/7') in grafana.writes()
+	assert grafana.datasources[0]['uid'] == 'prometheus' and grafana.datasources[0]['url'] == 'prometheus:9090'
+
+def test_is_unchanged():
+	desired = {'uid': 'prometheus', 'name': 'Prometheus', 'id': None}
+	assert is_unchanged(desired, {'uid': 'prometheus', 'name': 'Prometheus', 'id': 3, 'jsonData': {}}, ['id'])
+	assert not is_unchanged(desired, {'uid': 'prometheus', 'name': 'Prom', 'id': 3}, ['id'])
+	assert not is_unchanged(desired, {'uid': 'prometheus', 'name': 'Prometheus', 'id': 3}, [])
@@ -0,0 +1,108 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+import pytest
+from botocore.stub import ANY, Stubber
+import stack_updater
+from stack_updater import StackUpdater
+
+ROOT_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+PREFIX = 'prod-dundermiff'
+
+@pytest.fixture
+def cloudformation(monkeypatch):
+	# Templates are read from the repository, and stacks are planned one at a
+	#  time so the stubbed responses come in a known order
+	monkeypatch.chdir(ROOT_FOLDER)
+	monkeypatch.setattr(stack_updater, 'ThreadPoolExecutor', lambda max_workers: ThreadPoolExecutor(max_workers=1))
+	monkeypatch.setattr(stack_updater, 'record_phase', lambda *args, **kwargs: None)
+	monkeypatch.setattr(stack_updater, 'predicted_minutes', lambda *args: None)
+	executed = []
+	monkeypatch.setattr(stack_updater, 'wait_for_stack', lambda cfClient, stackName, *args: executed.append(stackName))
+	cfClient = boto3.client('cloudformation', region_name='eu-west-1', aws_access_key_id='testing', aws_secret_access_key='testing')
+	with Stubber(cfClient) as stubber:
+		yield StackUpdater('eu-west-1', 'prod', 'dundermiff', cfClient), stubber, executed
+		stubber.assert_no_pending_responses()
+
+def change(logicalId, resourceType, action='Modify', replacement='False', details=[]):
+	return {'Type': 'Resource', 'ResourceChange': {'Action': action, 'LogicalResourceId': logicalId, 'ResourceType': resourceType,
+	        'Replacement': replacement, 'Scope': ['Properties'], 'Details': details}}
+
+def plan(stubber, stack, changes=None, stackParameters=['Environment', 'Company'], templateParameters=['Environment', 'Company']):
+	# A stack whose change set has the given changes (None for an empty one)
+	name = PREFIX+'-'+stack+'-cf'
+	stubber.add_response('describe_stacks', {'Stacks': [{'StackName': name, 'StackStatus': 'UPDATE_COMPLETE', 'CreationTime': '2026-10-01T10:00:00Z',
+	                     'Parameters': [{'ParameterKey': key, 'ParameterValue': 'value'} for key in stackParameters]}]}, {'StackName': name})
+	stubber.add_response('get_template_summary', {'Parameters': [{'ParameterKey': key} for key in templateParameters]}, {'TemplateBody': ANY})
+	stubber.add_response('create_change_set', {'Id': 'change-set-'+stack}, {'StackName': name, 'ChangeSetName': ANY, 'ChangeSetType': 'UPDATE',
+	                     'TemplateBody': ANY, 'Capabilities': ['CAPABILITY_NAMED_IAM'],
+	                     'Parameters': [{'ParameterKey': key, 'UsePreviousValue': True} for key in stackParameters if key in templateParameters]})
+	if changes is None:
+		failed = {'Status': 'FAILED', 'StatusReason': "The submitted information didn't contain changes."}
+		stubber.add_response('describe_change_set', failed, {'StackName': name, 'ChangeSetName': ANY})
+		stubber.add_response('describe_change_set', failed, {'StackName': name, 'ChangeSetName': ANY})
+		stubber.add_response('delete_change_set', {}, {'StackName': name, 'ChangeSetName': ANY})
+	else:
+		stubber.add_response('describe_change_set', {'Status': 'CREATE_COMPLETE'}, {'StackName': name, 'ChangeSetName': ANY})
+		stubber.add_response('describe_change_set', {'Status': 'CREATE_COMPLETE', 'Changes': changes}, {'StackName': name, 'ChangeSetName': ANY})
+
+def test_skips_empty_change_sets(cloudformation, capsys):
+	updater, stubber, executed = cloudformation
+	for stack in ['all', 'db', 'gifmachine']:
+		plan(stubber, stack)
+	assert updater.update('gifmachine')
+	assert executed == []
+	assert capsys.readouterr().out.count('up to date, skipped') == 3
+
+def test_executes_in_dependency_order(cloudformation):
+	updater, stubber, executed = cloudformation
+	plan(stubber, 'all', [change('Vpc', 'AWS::EC2::VPC')])
+	plan(stubber, 'db')
+	plan(stubber, 'gifmachine', [change('LoadBalancer', 'AWS::ElasticLoadBalancingV2::LoadBalancer')])
+	for stack in ['all', 'gifmachine']:
+		stubber.add_response('execute_change_set', {}, {'StackName': PREFIX+'-'+stack+'-cf', 'ChangeSetName': ANY})
+	assert updater.update('gifmachine')
+	assert executed == [PREFIX+'-all-cf', PREFIX+'-gifmachine-cf']
+
+def test_refuses_replacements(cloudformation, capsys):
+	updater, stubber, executed = cloudformation
+	plan(stubber, 'all', [change('Vpc', 'AWS::EC2::VPC')])
+	plan(stubber, 'db', [change('Database', 'AWS::RDS::DBInstance', replacement='True')])
+	plan(stubber, 'gifmachine')
+	for stack in ['all', 'db']:
+		stubber.add_response('delete_change_set', {}, {'StackName': PREFIX+'-'+stack+'-cf', 'ChangeSetName': ANY})
+	assert not updater.update('gifmachine')
+	assert executed == []
+	assert PREFIX+'-db-cf would replace or remove resources' in capsys.readouterr().out
+
+def test_refuses_task_definition_changes_of_the_code_deploy_service(cloudformation, capsys):
+	updater, stubber, executed = cloudformation
+	plan(stubber, 'all', [change('Vpc', 'AWS::EC2::VPC')])
+	plan(stubber, 'db')
+	taskDefinitionDetail = {'Target': {'Attribute': 'Properties', 'Name': 'TaskDefinition', 'RequiresRecreation': 'Never'},
+	                        'Evaluation': 'Dynamic', 'ChangeSource': 'ResourceReference', 'CausingEntity': 'TaskDefinition'}
+	plan(stubber, 'gifmachine', [change('TaskDefinition', 'AWS::ECS::TaskDefinition', replacement='True'),
+	                             change('Service', 'AWS::ECS::Service', details=[taskDefinitionDetail])])
+	for stack in ['all', 'gifmachine']:
+		stubber.add_response('delete_change_set', {}, {'StackName': PREFIX+'-'+stack+'-cf', 'ChangeSetName': ANY})
+	# Not even with --allow-replacement
+	assert not updater.update('gifmachine', allowReplacement=True)
+	assert executed == []
+	output = capsys.readouterr().out
+	assert 'ERROR: ' + PREFIX+'-gifmachine-cf would change the gifmachine task definition' in output
+	assert 'through the pipeline' in output
+
+def test_service_changes_without_a_new_task_definition_are_allowed(cloudformation):
+	updater, stubber, executed = cloudformation
+	plan(stubber, 'all')
+	plan(stubber, 'db')
+	desiredCountDetail = {'Target': {'Attribute': 'Properties', 'Name': 'DesiredCount', 'RequiresRecreation': 'Never'}, 'Evaluation': 'Static'}
+	plan(stubber, 'gifmachine', [change('Service', 'AWS::ECS::Service', details=[desiredCountDetail])])
+	stubber.add_response('execute_change_set', {}, {'StackName': PREFIX+'-gifmachine-cf', 'ChangeSetName': ANY})
+	assert updater.update('gifmachine')
+	assert executed == [PREFIX+'-gifmachine-cf']
+
+def test_drops_parameters_removed_from_the_template(cloudformation):
+	updater, stubber, executed = cloudformation
+	plan(stubber, 'monitoring', stackParameters=['Environment', 'Company', 'GrafanaVersion'])
+	assert updater.update('monitoring')
@@ -0,0 +1,132 @@
+from datetime import datetime, timezone
+import boto3
+import pytest
+from botocore.stub import Stubber
+import stack_waiter
+from stack_waiter import StackFailed, StackWaiter
+
+STACK_NAME = 'prod-dundermiff-monitoring-cf'
+START_TIME = 1700000000.0
+
+class FakeClock:
+	def __init__(self):
+		self.now = START_TIME
+		self.sleeps = []
+
+	def time(self):
+		return self.now
+
+	def sleep(self, seconds):
+		self.sleeps.append(seconds)
+		self.now = self.now + seconds
+
+def event(eventId, status, logicalId=STACK_NAME, resourceType=stack_waiter.STACK_RESOURCE_TYPE, secondsAfterStart=1, reason=None):
+	stackEvent = {'StackId': 'arn:aws:cloudformation:eu-west-1:123456789012:stack/'+STACK_NAME+'/1', 'EventId': eventId,
+	              'StackName': STACK_NAME, 'LogicalResourceId': logicalId, 'ResourceType': resourceType, 'ResourceStatus': status,
+	              'Timestamp': datetime.fromtimestamp(START_TIME + secondsAfterStart, timezone.utc)}
+	if reason: stackEvent['ResourceStatusReason'] = reason
+	return stackEvent
+
+@pytest.fixture
+def cloudformation():
+	cfClient = boto3.client('cloudformation', region_name='eu-west-1', aws_access_key_id='testing', aws_secret_access_key='testing')
+	with Stubber(cfClient) as stubber:
+		yield cfClient, stubber
+		stubber.assert_no_pending_responses()
+
+def stack_started(stubber, secondsAfterStart=0, operationTime='CreationTime'):
+	stack = {'StackName': STACK_NAME, 'StackStatus': 'CREATE_IN_PROGRESS', 'CreationTime': datetime.fromtimestamp(START_TIME - 86400, timezone.utc)}
+	stack[operationTime] = datetime.fromtimestamp(START_TIME + secondsAfterStart, timezone.utc)
+	stubber.add_response('describe_stacks', {'Stacks': [stack]}, {'StackName': STACK_NAME})
+
+def respond(stubber, *events):
+	# describe_stack_events lists the newest events first
+	stubber.add_response('describe_stack_events', {'StackEvents': list(reversed(events))}, {'StackName': STACK_NAME})
+
+def waiter(cfClient, clock, expectedSeconds=None, timeout=stack_waiter.DEFAULT_TIMEOUT):
+	return StackWaiter(cfClient, STACK_NAME, START_TIME, expectedSeconds, timeout, sleep=clock.sleep, clock=clock.time)
+
+def test_waits_until_the_stack_completes(cloudformation):
+	cfClient, stubber = cloudformation
+	stack_started(stubber)
+	clock = FakeClock()
+	started = [event('1', 'CREATE_IN_PROGRESS'), event('2', 'CREATE_IN_PROGRESS', 'Instance', 'AWS::EC2::Instance')]
+	respond(stubber, *started)
+	respond(stubber, *started)
+	respond(stubber, *(started + [event('3', 'CREATE_COMPLETE', 'Instance', 'AWS::EC2::Instance', 60), event('4', 'CREATE_COMPLETE', secondsAfterStart=61)]))
+	waiter(cfClient, clock).wait()
+	# Events flowing keep the fast interval, a quiet poll backs off
+	assert clock.sleeps == [stack_waiter.MIN_POLL_INTERVAL, stack_waiter.MIN_POLL_INTERVAL * stack_waiter.POLL_BACKOFF_FACTOR]
+
+def test_fails_on_the_first_failed_resource(cloudformation):
+	cfClient, stubber = cloudformation
+	stack_started(stubber)
+	respond(stubber, event('1', 'CREATE_IN_PROGRESS'), event('2', 'CREATE_FAILED', 'Bucket', 'AWS::S3::Bucket', reason='Bucket already exists'),
+	        event('3', 'ROLLBACK_IN_PROGRESS'))
+	with pytest.raises(StackFailed) as failure:
+		waiter(cfClient, FakeClock()).wait()
+	assert 'Bucket CREATE_FAILED: Bucket already exists' in str(failure.value)
+
+def test_fails_on_a_stack_rollback(cloudformation):
+	cfClient, stubber = cloudformation
+	stack_started(stubber)
+	respond(stubber, event('1', 'UPDATE_IN_PROGRESS'), event('2', 'UPDATE_ROLLBACK_IN_PROGRESS'))
+	with pytest.raises(StackFailed) as failure:
+		waiter(cfClient, FakeClock()).wait('UPDATE_COMPLETE')
+	assert str(failure.value) == STACK_NAME + ': UPDATE_ROLLBACK_IN_PROGRESS'
+
+def test_ignores_events_of_previous_operations(cloudformation):
+	cfClient, stubber = cloudformation
+	stack_started(stubber)
+	clock = FakeClock()
+	previous = event('0', 'UPDATE_COMPLETE', secondsAfterStart=-3600)
+	respond(stubber, previous)
+	respond(stubber, previous, event('1', 'UPDATE_IN_PROGRESS'), event('2', 'UPDATE_COMPLETE'))
+	waiter(cfClient, clock).wait('UPDATE_COMPLETE')
+	assert len(clock.sleeps) == 1
+
+def test_local_clock_ahead_of_aws(cloudformation):
+	# The update started 2 minutes before the local start time
+	cfClient, stubber = cloudformation
+	stack_started(stubber, -120, 'LastUpdatedTime')
+	respond(stubber, event('0', 'UPDATE_COMPLETE', secondsAfterStart=-7200), event('1', 'UPDATE_IN_PROGRESS', secondsAfterStart=-120),
+	        event('2', 'UPDATE_COMPLETE', secondsAfterStart=-60))
+	waiter(cfClient, FakeClock()).wait('UPDATE_COMPLETE')
+
+def test_previous_completion_is_not_taken_for_this_one(cloudformation):
+	cfClient, stubber = cloudformation
+	clock = FakeClock()
+	stack_started(stubber, -120, 'LastUpdatedTime')
+	previous = [event('0', 'UPDATE_IN_PROGRESS', secondsAfterStart=-7260), event('1', 'UPDATE_COMPLETE', secondsAfterStart=-7200)]
+	respond(stubber, *(previous + [event('2', 'UPDATE_IN_PROGRESS', secondsAfterStart=-120)]))
+	respond(stubber, *(previous + [event('2', 'UPDATE_IN_PROGRESS', secondsAfterStart=-120), event('3', 'UPDATE_COMPLETE', secondsAfterStart=-100)]))
+	waiter(cfClient, clock).wait('UPDATE_COMPLETE')
+	assert len(clock.sleeps) == 1
+
+def test_falls_back_to_the_local_start_time(cloudformation):
+	cfClient, stubber = cloudformation
+	clock = FakeClock()
+	stubber.add_client_error('describe_stacks', 'AccessDenied', expected_params={'StackName': STACK_NAME})
+	previous = event('0', 'CREATE_COMPLETE', secondsAfterStart=-3600)
+	respond(stubber, previous, event('1', 'CREATE_IN_PROGRESS'))
+	respond(stubber, previous, event('1', 'CREATE_IN_PROGRESS'), event('2', 'CREATE_COMPLETE'))
+	waiter(cfClient, clock).wait()
+	assert len(clock.sleeps) == 1
+
+def test_times_out(cloudformation):
+	cfClient, stubber = cloudformation
+	stack_started(stubber)
+	clock = FakeClock()
+	for _ in range(3):
+		respond(stubber)
+	with pytest.raises(StackFailed) as failure:
+		waiter(cfClient, clock, timeout=4).wait()
+	assert 'not CREATE_COMPLETE after' in str(failure.value)
+
+def test_poll_interval_backs_off_and_speeds_up_near_completion():
+	stackWaiter = StackWaiter(None, STACK_NAME, START_TIME, expectedSeconds=600, clock=FakeClock().time)
+	intervals = [stackWaiter.next_interval(100, False) for _ in range(10)]
+	assert intervals[:2] == [3.0, 4.5]
+	assert max(intervals) == stack_waiter.MAX_POLL_INTERVAL
+	assert stackWaiter.next_interval(100, True) == stack_waiter.MIN_POLL_INTERVAL
+	assert stackWaiter.next_interval(600 - stack_waiter.NEAR_COMPLETION_WINDOW, False) == stack_waiter.MIN_POLL_INTERVAL
@@ -0,0 +1,79 @@
+import copy
+import json
+import os
+from update_taskdef_template import comparable_task_definition, diff_task_definitions
+
+TEMPLATE_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'templates', 'taskdefinition-template.json')
+
+def rendered_task_definition():
+	with open(TEMPLATE_FILENAME) as templateFile:
+		taskDef = json.load(templateFile)
+	taskDef['family'] = 'prod-dundermiff-gifmachine-taskdefinition'
+	for container in taskDef['containerDefinitions']:
+		container['image'] = '123456789012.dkr.ecr.eu-west-1.amazonaws.com/prod-dundermiff-gifmachine@sha256:abc'
+		container['environment'] = [{'name': 'ENVIRONMENT', 'value': 'prod'}, {'name': 'COMPANY', 'value': 'dundermiff'}]
+	return taskDef
+
+def registered(taskDef):
+	# What describe_task_definition returns for a registered definition
+	live = copy.deepcopy(taskDef)
+	live.update({'taskDefinitionArn': 'arn:aws:ecs:eu-west-1:123456789012:task-definition/'+taskDef['family']+':7', 'revision': 7,
+	             'status': 'ACTIVE', 'requiresAttributes': [{'name': 'com.amazonaws.ecs.capability.logging-driver.awslogs'}],
+	             'compatibilities': ['EC2', 'FARGATE'], 'registeredAt': '2026-10-18T10:00:00Z', 'registeredBy': 'arn:aws:iam::123456789012:role/cicd',
+	             'volumes': [], 'placementConstraints': []})
+	for container in live['containerDefinitions']:
+		container.update({'mountPoints': [], 'volumesFrom': [], 'systemControls': []})
+		container['environment'].reverse()
+	return live
+
+def changed_fields(rendered, live):
+	return diff_task_definitions(comparable_task_definition(rendered), comparable_task_definition(live))
+
+def test_registered_definition_is_unchanged():
+	taskDef = rendered_task_definition()
+	assert changed_fields(taskDef, registered(taskDef)) == []
+
+def test_defaults_filled_in_by_ecs_are_ignored():
+	taskDef = rendered_task_definition()
+	for mapping in taskDef['containerDefinitions'][0]['portMappings']:
+		del mapping['hostPort'], mapping['protocol']
+	live = registered(rendered_task_definition())
+	assert changed_fields(taskDef, live) == []
+
+def test_changed_field():
+	taskDef = rendered_task_definition()
+	live = registered(taskDef)
+	taskDef['containerDefinitions'][0]['image'] = taskDef['containerDefinitions'][0]['image'].replace('abc', 'def')
+	assert changed_fields(taskDef, live) == ['taskDefinition.containerDefinitions[gifmachine].image']
+
+def test_field_removed_from_the_template():
+	taskDef = rendered_task_definition()
+	live = registered(taskDef)
+	del taskDef['containerDefinitions'][1]['portMappings']
+	del taskDef['taskRoleArn']
+	assert sorted(changed_fields(taskDef, live)) == ['taskDefinition.containerDefinitions[csidecar].portMappings', 'taskDefinition.taskRoleArn']
+
+def test_field_added_to_the_template():
+	taskDef = rendered_task_definition()
+	live = registered(taskDef)
+	taskDef['containerDefinitions'][0]['stopTimeout'] = 30
+	assert changed_fields(taskDef, live) == ['taskDefinition.containerDefinitions[gifmachine].stopTimeout']
+
+def test_string_and_number_sizes_compare_equal():
+	taskDef = rendered_task_definition()
+	live = registered(taskDef)
+	live['cpu'] = int(live['cpu'])
+	assert changed_fields(taskDef, live) == []
+
+def test_non_default_value_of_a_defaulted_field():
+	taskDef = rendered_task_definition()
+	live = registered(taskDef)
+	live['containerDefinitions'][0]['mountPoints'] = [{'sourceVolume': 'data', 'containerPath': '/data'}]
+	assert changed_fields(taskDef, live) == ['taskDefinition.containerDefinitions[gifmachine].mountPoints']
+
+def test_default_value_set_in_the_template_is_compared():
+	taskDef = rendered_task_definition()
+	live = registered(taskDef)
+	live['containerDefinitions'][1]['essential'] = True
+	assert changed_fields(taskDef, live) == ['taskDefinition.containerDefinitions[csidecar].essential']
+	assert 'revision' not in comparable_task_definition(live) and live['revision'] == 7